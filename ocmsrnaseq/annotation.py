@@ -0,0 +1,167 @@
+'''
+annotation.py - gene annotation tables from a gtf file
+=======================================================
+
+Build transcript to gene, gene to name, biotype and transcript length
+tables from a gtf file in a single pass. Tables are cached on disk under a
+directory named after the checksum of the gtf so that a rebuild
+is only necessary when the annotation changes.
+
+'''
+
+import os
+import gzip
+import hashlib
+import shutil
+import tempfile
+
+# tables that make up an annotation index
+TRANSCRIPTS2GENES = "transcripts2genes.tsv"
+GENES2NAMES = "genes2names.tsv"
+GENE_BIOTYPES = "gene_biotypes.tsv"
+TRANSCRIPT_BIOTYPES = "transcript_biotypes.tsv"
+TRANSCRIPT_LENGTHS = "transcript_lengths.tsv"
+
+TABLES = (TRANSCRIPTS2GENES, GENES2NAMES, GENE_BIOTYPES, TRANSCRIPT_BIOTYPES,
+          TRANSCRIPT_LENGTHS)
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"),
+                             ".cache", "ocmsrnaseq", "annotations")
+
+
+def open_file(infile, mode="rt"):
+    '''open a file that may or may not be gzipped
+    '''
+    if infile.endswith(".gz"):
+        return gzip.open(infile, mode)
+    return open(infile, mode)
+
+
+def checksum(infile, blocksize=1 << 20):
+    '''return the sha1 checksum of a file read in blocks
+    '''
+    sha = hashlib.sha1()
+    with open(infile, "rb") as inf:
+        for block in iter(lambda: inf.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def parse_attributes(field):
+    '''parse the attribute column of a gtf entry into a dictionary
+    '''
+    attributes = {}
+    for attribute in field.split(";"):
+        attribute = attribute.strip()
+        if not attribute:
+            continue
+        key, _, value = attribute.partition(" ")
+        attributes[key] = value.strip().strip('"')
+    return attributes
+
+
+def iterate_gtf(infile):
+    '''iterate over gtf entries yielding the feature, the length of
+    the feature and the parsed attributes
+    '''
+    with open_file(infile) as inf:
+        for line in inf:
+            if line.startswith("#"):
+                continue
+            data = line.rstrip("\n").split("\t")
+            if len(data) < 9:
+                continue
+            yield (data[2], int(data[4]) - int(data[3]) + 1,
+                   parse_attributes(data[8]))
+
+
+def build_index(infile, outdir):
+    '''read the gtf once and write the annotation tables to outdir.
+
+    Genes and transcripts are deduplicated with dictionaries so that
+    each id is stored once however many exons it has.
+    '''
+    transcript2gene = {}
+    transcript2biotype = {}
+    transcript2length = {}
+    gene2name = {}
+    gene2biotype = {}
+
+    for feature, length, attributes in iterate_gtf(infile):
+        gene_id = attributes.get("gene_id")
+        if gene_id is None:
+            continue
+        if gene_id not in gene2name:
+            gene2name[gene_id] = attributes.get("gene_name", "")
+            gene2biotype[gene_id] = attributes.get(
+                "gene_biotype", attributes.get("gene_type", ""))
+
+        transcript_id = attributes.get("transcript_id")
+        if transcript_id is None:
+            continue
+        # the length of a transcript is the sum of its exons, as in
+        # the transcript sequences the kallisto index is built from
+        if feature == "exon":
+            transcript2length[transcript_id] = \
+                transcript2length.get(transcript_id, 0) + length
+        if transcript_id in transcript2gene:
+            continue
+        transcript2gene[transcript_id] = gene_id
+        transcript2biotype[transcript_id] = attributes.get(
+            "transcript_biotype", attributes.get("transcript_type", ""))
+
+    tables = ((TRANSCRIPTS2GENES, ("TXNAME", "GENEID"), transcript2gene),
+              (GENES2NAMES, ("gene_id", "gene_name"), gene2name),
+              (GENE_BIOTYPES, ("gene_id", "gene_biotype"), gene2biotype),
+              (TRANSCRIPT_BIOTYPES, ("transcript_id", "transcript_biotype"),
+               transcript2biotype),
+              (TRANSCRIPT_LENGTHS, ("transcript_id", "length"),
+               dict((x, str(y)) for x, y in transcript2length.items())))
+
+    for filename, header, mapping in tables:
+        with open(os.path.join(outdir, filename), "w") as outf:
+            outf.write("\t".join(header) + "\n")
+            for key in sorted(mapping):
+                outf.write(key + "\t" + mapping[key] + "\n")
+
+
+def read_lengths(infile):
+    '''read a transcript length table into a dictionary
+    '''
+    lengths = {}
+    with open(infile) as inf:
+        inf.readline()
+        for line in inf:
+            transcript, length = line.rstrip("\n").split("\t")[:2]
+            lengths[transcript] = int(length)
+    return lengths
+
+
+def cached_index(infile, cache_dir=DEFAULT_CACHE):
+    '''return the directory holding the annotation tables for infile,
+    building them if they are not already in the cache.
+
+    The index is built in a temporary directory and renamed into
+    place so that concurrent builds from different projects do
+    not see partially written tables.
+    '''
+    index_dir = os.path.join(cache_dir, checksum(infile))
+    if all(os.path.exists(os.path.join(index_dir, x)) for x in TABLES):
+        return index_dir
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=cache_dir, prefix=".build_")
+    try:
+        build_index(infile, tmpdir)
+        with open(os.path.join(tmpdir, "source.txt"), "w") as outf:
+            outf.write(os.path.abspath(infile) + "\n")
+        try:
+            os.rename(tmpdir, index_dir)
+        except OSError:
+            # another job got there first
+            if not os.path.exists(index_dir):
+                raise
+    finally:
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+    return index_dir
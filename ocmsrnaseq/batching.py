@@ -0,0 +1,31 @@
+'''
+batching.py - distribute pipeline inputs over batches
+=====================================================
+
+Tasks that run several samples per job (to load an index or an R
+session once) balance their batches with :func:`pack`, which places
+the largest items first into the lightest batch (longest processing
+time first)::
+
+    batches = pack(samples, 4, weight=lambda x: os.path.getsize(x))
+
+'''
+
+
+def pack(items, nbatches, weight):
+    '''distribute *items* over at most *nbatches* batches so that the
+    summed *weight* of each batch is similar. Items of equal weight
+    are placed in sorted order, so batches are the same between runs.
+    Returns a list of non-empty batches, each a sorted list of items
+    '''
+    nbatches = min(nbatches, len(items))
+    if nbatches <= 0:
+        return []
+    weights = dict((item, weight(item)) for item in items)
+    batches = [[] for i in range(nbatches)]
+    volumes = [0] * nbatches
+    for item in sorted(items, key=lambda x: (-weights[x], x)):
+        i = volumes.index(min(volumes))
+        batches[i].append(item)
+        volumes[i] += weights[item]
+    return [sorted(batch) for batch in batches]
@@ -0,0 +1,544 @@
+'''
+citeseq.py - counting of hashtag/antibody derived tags
+=======================================================
+
+A native implementation of the counting performed by CITE-seq-Count for
+HTO/ADT libraries:
+
+* the cell barcode and UMI are taken from read 1 (cbf/cbl, umif/umil,
+  1-based inclusive positions as for CITE-seq-Count)
+* the tag is matched at the start of read 2 (after trimming) against a
+  precomputed Hamming neighbourhood of every tag sequence, so each read
+  requires a single dictionary lookup per tag length
+* cell barcodes within a Hamming distance of 1 of a selected cell are
+  corrected to that cell
+* UMIs are collapsed with the directional method (as umi_tools, used
+  by CITE-seq-Count)
+
+Reads are counted in chunks across a process pool and per-chunk counts
+are merged. Large libraries can also be counted in shards, each a job
+that counts every Nth block of reads of the original fastq files; shard
+counts are kept at the level of (cell barcode, UMI, tag) so that cells
+are selected and UMIs collapsed after shards are merged. Outputs follow the CITE-seq-Count layout::
+
+    <outdir>/read_count/{matrix.mtx.gz,barcodes.tsv.gz,features.tsv.gz}
+    <outdir>/umi_count/{matrix.mtx.gz,barcodes.tsv.gz,features.tsv.gz}
+    <outdir>/run_report.yaml
+
+with features named <tag_name>-<tag_sequence> and an "unmapped" row.
+
+The number of cells can be estimated beforehand from the inflection of
+the barcode rank curve, with barcodes counted exactly as compact integer
+codes (:func:`count_barcodes`, :func:`find_knee`).
+
+'''
+
+import os
+import sys
+import gzip
+import math
+import bisect
+import time
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+
+NUCLEOTIDES = "ACGTN"
+
+
+def load_tags(infile):
+    '''load a tag file of tag_sequence,tag_name lines
+    '''
+    tags = []
+    with open(infile) as inf:
+        for line in inf:
+            line = line.strip()
+            if not line:
+                continue
+            seq, name = line.split(",")[:2]
+            tags.append((seq.upper(), name))
+    return sorted(tags, key=lambda x: x[1])
+
+
+def hamming_neighbours(seq, distance, alphabet=NUCLEOTIDES):
+    '''return all sequences within *distance* substitutions of *seq*
+    '''
+    neighbours = {seq}
+    # sequences with d substitutions and the first position that may
+    # still be substituted, so that each set of positions is visited once
+    frontier = [(seq, 0)]
+    for d in range(distance):
+        extended = []
+        for neighbour, start in frontier:
+            for p in range(start, len(seq)):
+                prefix, suffix = neighbour[:p], neighbour[p + 1:]
+                for b in alphabet:
+                    if b != seq[p]:
+                        x = prefix + b + suffix
+                        neighbours.add(x)
+                        extended.append((x, p + 1))
+        frontier = extended
+    return neighbours
+
+
+def build_tag_index(tags, max_error):
+    '''build a dictionary from every sequence within *max_error*
+    substitutions of a tag to the index of that tag. Sequences that
+    are within *max_error* of more than one tag are excluded.
+
+    Returns a list of (length, index) tuples, one per tag length.
+    '''
+    by_length = collections.defaultdict(dict)
+    ambiguous = collections.defaultdict(set)
+    for i, (seq, name) in enumerate(tags):
+        index = by_length[len(seq)]
+        for neighbour in hamming_neighbours(seq, max_error):
+            if neighbour in index and index[neighbour] != i:
+                ambiguous[len(seq)].add(neighbour)
+            index[neighbour] = i
+    for length, index in by_length.items():
+        for seq in ambiguous[length]:
+            del index[seq]
+    return sorted(by_length.items(), reverse=True)
+
+
+def read_pairs(fastq1, fastq2, chunksize, shard=0, nshards=1):
+    '''yield chunks of (read1, read2) sequences from gzipped fastq files.
+
+    Reads are taken in blocks of *chunksize* read pairs. If *nshards*
+    is greater than 1 only every *nshards*-th block, starting at
+    *shard*, is returned; the lines of other blocks are skipped without
+    being decoded or parsed, so that shards of a library can be counted
+    as independent jobs from the original fastq files.
+    '''
+    nlines = 4 * chunksize
+    with gzip.open(fastq1, "rb") as inf1, gzip.open(fastq2, "rb") as inf2:
+        for block in itertools.count():
+            if block % nshards != shard:
+                collections.deque(itertools.islice(inf1, nlines), maxlen=0)
+                collections.deque(itertools.islice(inf2, nlines), maxlen=0)
+                if not inf1.peek(1):
+                    break
+                continue
+            lines1 = list(itertools.islice(inf1, nlines))
+            lines2 = list(itertools.islice(inf2, nlines))
+            if not lines1:
+                break
+            yield [(r1.decode(), r2.decode())
+                   for r1, r2 in zip(lines1[1::4], lines2[1::4])]
+            if len(lines1) < nlines:
+                break
+
+
+# state shared with worker processes
+_WORKER = {}
+
+
+def _init_worker(tag_index, ntags, cb, umi, trim):
+    _WORKER.update(tag_index=tag_index, ntags=ntags, cb=cb, umi=umi,
+                   trim=trim)
+
+
+def _count_chunk(chunk):
+    '''count (cell barcode, umi, tag) triples in a chunk of read pairs.
+    Reads with no matching tag are counted against tag index ntags
+    (unmapped)
+    '''
+    tag_index = _WORKER["tag_index"]
+    unmapped = _WORKER["ntags"]
+    cb_start, cb_end = _WORKER["cb"]
+    umi_start, umi_end = _WORKER["umi"]
+    trim = _WORKER["trim"]
+
+    counts = collections.Counter()
+    for r1, r2 in chunk:
+        tag = unmapped
+        for length, index in tag_index:
+            tag = index.get(r2[trim:trim + length], unmapped)
+            if tag != unmapped:
+                break
+        # barcodes are interned so that the triples of a cell share
+        # one barcode string, also once pickled back from a worker
+        counts[(sys.intern(r1[cb_start:cb_end]), r1[umi_start:umi_end],
+                tag)] += 1
+    return counts
+
+
+def hamming(a, b):
+    return sum(x != y for x, y in zip(a, b))
+
+
+def umi_neighbours(umis, distance):
+    '''return a dictionary of each UMI to the set of other UMIs of *umis*
+    within *distance* substitutions.
+
+    UMIs are bucketed by their Hamming neighbours over a single wildcard
+    base (:func:`hamming_neighbours` with the alphabet "*"), i.e. by
+    every way of masking *distance* of their positions. Two UMIs of the
+    same length are within *distance* substitutions exactly if they
+    share a bucket, so only UMIs that are neighbours are ever compared
+    and the cost grows linearly with the number of UMIs rather than
+    with the number of pairs.
+    '''
+    buckets = collections.defaultdict(list)
+    for umi in umis:
+        masks = min(distance, len(umi))
+        for key in hamming_neighbours(umi, masks, alphabet="*"):
+            if key.count("*") == masks:
+                buckets[key].append(umi)
+
+    neighbours = dict((umi, set()) for umi in umis)
+    for bucket in buckets.values():
+        if len(bucket) > 1:
+            for umi in bucket:
+                neighbours[umi].update(bucket)
+    for umi, others in neighbours.items():
+        others.discard(umi)
+    return neighbours
+
+
+def collapse_umis(umi_counts, distance):
+    '''return the number of UMIs after directional collapsing.
+
+    UMIs are visited from most to least abundant; a UMI absorbs
+    neighbours within *distance* that have at most (count + 1) / 2
+    reads, and the neighbours of those, as in umi_tools directional.
+    '''
+    if len(umi_counts) == 1 or distance == 0:
+        return len(umi_counts)
+    umis = sorted(umi_counts, key=lambda x: (-umi_counts[x], x))
+    neighbours = umi_neighbours(umis, distance)
+    seen = set()
+    clusters = 0
+    for umi in umis:
+        if umi in seen:
+            continue
+        clusters += 1
+        seen.add(umi)
+        queue = [umi]
+        while queue:
+            node = queue.pop()
+            for other in neighbours[node]:
+                if other not in seen and \
+                   umi_counts[node] >= 2 * umi_counts[other] - 1:
+                    seen.add(other)
+                    queue.append(other)
+    return clusters
+
+
+def _collapse_cells(args):
+    '''count reads and collapsed UMIs for a batch of cells
+    '''
+    cells, distance = args
+    result = []
+    for cell, tag2umis in cells:
+        for tag, umi_counts in tag2umis.items():
+            result.append((cell, tag, sum(umi_counts.values()),
+                           collapse_umis(umi_counts, distance)))
+    return result
+
+
+def select_cells(barcode_counts, ncells, whitelist=None, bc_distance=1):
+    '''return a mapping of observed barcodes to cells.
+
+    Cells are taken from *whitelist* if given, otherwise the *ncells*
+    barcodes with most reads. Other barcodes within *bc_distance* (0 or
+    1) of exactly one cell are corrected to that cell.
+    '''
+    if whitelist is None:
+        ranked = sorted(barcode_counts.items(), key=lambda x: (-x[1], x[0]))
+        whitelist = [x[0] for x in ranked[:ncells]]
+    cells = set(whitelist)
+
+    barcode2cell = {x: x for x in cells}
+    if bc_distance > 0:
+        neighbours = collections.defaultdict(set)
+        for cell in cells:
+            for neighbour in hamming_neighbours(cell, 1):
+                neighbours[neighbour].add(cell)
+        for barcode in barcode_counts:
+            if barcode in cells:
+                continue
+            candidates = neighbours.get(barcode)
+            if candidates and len(candidates) == 1:
+                barcode2cell[barcode] = next(iter(candidates))
+    return barcode2cell
+
+
+def write_mtx(outdir, features, barcodes, entries):
+    '''write a feature x barcode matrix in 10x/CITE-seq-Count layout.
+    *entries* are (feature index, barcode index, value) tuples
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    with gzip.open(os.path.join(outdir, "features.tsv.gz"), "wt") as outf:
+        outf.write("".join(x + "\n" for x in features))
+    with gzip.open(os.path.join(outdir, "barcodes.tsv.gz"), "wt") as outf:
+        outf.write("".join(x + "\n" for x in barcodes))
+    with gzip.open(os.path.join(outdir, "matrix.mtx.gz"), "wt") as outf:
+        outf.write("%%MatrixMarket matrix coordinate integer general\n")
+        outf.write("%\n")
+        outf.write("%i %i %i\n" % (len(features), len(barcodes), len(entries)))
+        for row, col, value in entries:
+            outf.write("%i %i %i\n" % (row + 1, col + 1, value))
+
+
+def count_reads(fastq1, fastq2, tags, cbf, cbl, umif, umil, trim=0,
+                max_error=2, nthreads=1, chunksize=100000, shard=0,
+                nshards=1):
+    '''count (cell barcode, umi, tag) triples for all read pairs (or the
+    blocks of a shard, see :func:`read_pairs`) using a pool of *nthreads*
+    processes. Returns a Counter of triples. Tag index len(tags) denotes
+    unmapped reads
+    '''
+    tag_index = build_tag_index(tags, max_error)
+    initargs = (tag_index, len(tags), (cbf - 1, cbl), (umif - 1, umil), trim)
+
+    counts = collections.Counter()
+    chunks = read_pairs(fastq1, fastq2, chunksize, shard, nshards)
+    if nthreads > 1:
+        with multiprocessing.Pool(nthreads, _init_worker, initargs) as pool:
+            for chunk_counts in pool.imap_unordered(_count_chunk, chunks):
+                counts.update(chunk_counts)
+    else:
+        _init_worker(*initargs)
+        for chunk in chunks:
+            counts.update(_count_chunk(chunk))
+    return counts
+
+
+def write_counts(counts, outfile):
+    '''write (cell barcode, umi, tag) counts to a gzipped table
+    '''
+    with gzip.open(outfile, "wt", compresslevel=1) as outf:
+        for (barcode, umi, tag), n in counts.items():
+            outf.write("%s\t%s\t%i\t%i\n" % (barcode, umi, tag, n))
+
+
+def read_counts(infiles):
+    '''read and sum (cell barcode, umi, tag) counts written by
+    :func:`write_counts`, e.g. from several shards of a library
+    '''
+    counts = collections.Counter()
+    for infile in infiles:
+        with gzip.open(infile, "rt") as inf:
+            for line in inf:
+                barcode, umi, tag, n = line[:-1].split("\t")
+                counts[(barcode, umi, int(tag))] += int(n)
+    return counts
+
+
+def build_matrices(counts, tags, outdir, ncells, whitelist=None,
+                   bc_distance=1, umi_distance=2, nthreads=1,
+                   start_time=None):
+    '''select and correct cells, collapse UMIs and write read_count and
+    umi_count matrices and run_report.yaml to *outdir*
+    '''
+    start_time = start_time or time.time()
+    unmapped = len(tags)
+
+    barcode_counts = collections.Counter()
+    total = mapped = 0
+    for (barcode, umi, tag), n in counts.items():
+        total += n
+        if tag != unmapped:
+            mapped += n
+            barcode_counts[barcode] += n
+
+    barcode2cell = select_cells(barcode_counts, ncells, whitelist,
+                                bc_distance)
+
+    cell2tags = collections.defaultdict(
+        lambda: collections.defaultdict(collections.Counter))
+    for (barcode, umi, tag), n in counts.items():
+        cell = barcode2cell.get(barcode)
+        if cell is not None:
+            cell2tags[cell][tag][umi] += n
+
+    cells = sorted(cell2tags.items())
+    batches = [(cells[i:i + 500], umi_distance)
+               for i in range(0, len(cells), 500)]
+    if nthreads > 1:
+        with multiprocessing.Pool(nthreads) as pool:
+            results = pool.map(_collapse_cells, batches)
+    else:
+        results = [_collapse_cells(x) for x in batches]
+
+    barcodes = [x[0] for x in cells]
+    barcode_index = {x: i for i, x in enumerate(barcodes)}
+    read_entries, umi_entries = [], []
+    for cell, tag, nreads, numis in itertools.chain.from_iterable(results):
+        read_entries.append((tag, barcode_index[cell], nreads))
+        umi_entries.append((tag, barcode_index[cell], numis))
+    read_entries.sort(key=lambda x: (x[1], x[0]))
+    umi_entries.sort(key=lambda x: (x[1], x[0]))
+
+    features = ["%s-%s" % (name, seq) for seq, name in tags] + ["unmapped"]
+    write_mtx(os.path.join(outdir, "read_count"), features, barcodes,
+              read_entries)
+    write_mtx(os.path.join(outdir, "umi_count"), features, barcodes,
+              umi_entries)
+
+    percentage_mapped = round(100 * mapped / total) if total else 0
+    corrected = sum(1 for x, y in barcode2cell.items() if x != y)
+    with open(os.path.join(outdir, "run_report.yaml"), "w") as outf:
+        outf.write("Date: %s\n" % time.strftime("%Y-%m-%d"))
+        outf.write("Running time: %.1f seconds\n" %
+                   (time.time() - start_time))
+        outf.write("CITE-seq-Count Version: ocmsrnaseq native\n")
+        outf.write("Reads processed: %i\n" % total)
+        outf.write("Percentage mapped: %i\n" % percentage_mapped)
+        outf.write("Percentage unmapped: %i\n" % (100 - percentage_mapped))
+        outf.write("Uncorrected cells: 0\n")
+        outf.write("Correction:\n")
+        outf.write("\tCell barcodes collapsing threshold: %i\n" % bc_distance)
+        outf.write("\tCell barcodes corrected: %i\n" % corrected)
+        outf.write("\tUMI collapsing threshold: %i\n" % umi_distance)
+        outf.write("Run parameters:\n")
+        outf.write("\tExpected cells: %i\n" % len(barcodes))
+
+    return {"reads": total, "mapped": mapped, "cells": len(barcodes)}
+
+
+BARCODE_BASES = b"ACGTN"
+
+
+def _encode_barcodes(barcodes, length):
+    '''encode equal length barcodes (bytes) as base 5 integers (any
+    base other than A, C, G or T is taken as N)
+    '''
+    table = np.full(256, 4, dtype=np.int64)
+    for i, base in enumerate(b"ACGT"):
+        table[base] = i
+    bases = np.frombuffer(b"".join(barcodes), dtype=np.uint8)
+    digits = table[bases.reshape(len(barcodes), length)]
+    return digits @ (5 ** np.arange(length - 1, -1, -1, dtype=np.int64))
+
+
+def _decode_barcodes(codes, length):
+    '''decode barcodes encoded by :func:`_encode_barcodes`'''
+    codes = np.array(codes, dtype=np.int64)
+    digits = np.empty((len(codes), length), dtype=np.uint8)
+    for i in range(length - 1, -1, -1):
+        codes, digits[:, i] = np.divmod(codes, 5)
+    letters = np.frombuffer(BARCODE_BASES, dtype=np.uint8)[digits]
+    return [x.decode() for x in letters.view("S%i" % length).ravel()]
+
+
+def _merge_counts(codes, counts, chunk):
+    '''add the barcode codes in chunk to the sorted unique *codes*
+    and their *counts*'''
+    chunk, chunk_counts = np.unique(np.asarray(chunk, dtype=np.int64),
+                                    return_counts=True)
+    codes, index = np.unique(np.concatenate([codes, chunk]),
+                             return_inverse=True)
+    counts = np.bincount(index, np.concatenate([counts, chunk_counts]),
+                         minlength=len(codes)).astype(np.int64)
+    return codes, counts
+
+
+def count_barcodes(fastq1, cbf, cbl, topk=100000, max_reads=None,
+                   chunksize=1000000):
+    '''stream read 1 counting cell barcodes exactly. Barcodes are held
+    as integer codes (16 bytes per distinct barcode with its count) and
+    counted in chunks of *chunksize* reads, so memory depends on the
+    number of distinct barcodes rather than of reads.
+
+    Returns a dictionary of counts for the *topk* barcodes with the
+    most reads and the number of reads scanned. Reads too short to
+    contain the barcode are not counted.
+    '''
+    start, end = cbf - 1, cbl
+    length = end - start
+    if length > 27:
+        raise ValueError("cell barcodes of more than 27 bases are not "
+                         "supported")
+    codes = np.zeros(0, dtype=np.int64)
+    counts = np.zeros(0, dtype=np.int64)
+    nreads = 0
+    chunk = []
+    with gzip.open(fastq1, "rb") as inf:
+        for seq in itertools.islice(inf, 1, None, 4):
+            barcode = seq[start:end]
+            if len(barcode) == length:
+                chunk.append(barcode)
+            nreads += 1
+            if len(chunk) >= chunksize:
+                codes, counts = _merge_counts(
+                    codes, counts, _encode_barcodes(chunk, length))
+                chunk = []
+            if max_reads and nreads >= max_reads:
+                break
+    if chunk:
+        codes, counts = _merge_counts(codes, counts,
+                                      _encode_barcodes(chunk, length))
+
+    # most reads first, ties in barcode order
+    top = np.lexsort((codes, -counts))[:topk]
+    barcodes = _decode_barcodes(codes[top], length)
+    return dict(zip(barcodes, (int(x) for x in counts[top]))), nreads
+
+
+def find_knee(counts, min_count=100, bandwidth=0.02, exclude=50,
+              npoints=1000):
+    '''return the number of cells from barcode counts as the inflection
+    of the log-log barcode rank curve, i.e. the steepest drop in counts
+    between cell and background barcodes. As in DropletUtils
+    barcodeRanks, runs of equal counts are collapsed to their mid rank,
+    barcodes with fewer than *min_count* reads are ignored and the
+    curve is smoothed before the steepest drop is found.
+
+    The gradient is averaged over windows of +/- *bandwidth* of the log
+    rank range (evaluated at *npoints* positions), so that single noisy
+    steps do not decide the inflection, and the top *exclude*
+    barcodes are ignored. The cutoff is then placed at the steepest
+    step between adjacent points within the steepest window.
+    '''
+    values = sorted((x for x in counts if x >= min_count), reverse=True)
+    if len(values) < 3:
+        return len(values)
+
+    # (log mid rank, log count, number of barcodes up to this run)
+    points = []
+    start = 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            points.append((math.log10((start + i + 1) / 2),
+                           math.log10(values[start]),
+                           i))
+            start = i
+    if len(points) < 3:
+        return len(values)
+
+    xs = [x for x, y, n in points]
+    ys = [y for x, y, n in points]
+
+    def interpolate(x):
+        i = bisect.bisect_right(xs, x)
+        if i == 0:
+            return ys[0]
+        if i == len(xs):
+            return ys[-1]
+        x1, x2, y1, y2 = xs[i - 1], xs[i], ys[i - 1], ys[i]
+        return y1 + (y2 - y1) * (x - x1) / (x2 - x1)
+
+    width = bandwidth * (xs[-1] - xs[0])
+    lower = max(xs[0] + width, math.log10(min(exclude, len(values))))
+    upper = xs[-1] - width
+    if width <= 0 or upper <= lower:
+        lower, upper, width = xs[0], xs[-1], 0
+
+    if width > 0:
+        step = (upper - lower) / (npoints - 1)
+        centres = [lower + i * step for i in range(npoints)]
+        centre = min(centres,
+                     key=lambda x: (interpolate(x + width) -
+                                    interpolate(x - width)))
+        lower, upper = centre - width, centre + width
+
+    # steepest step between adjacent points within the window
+    steps = [i for i in range(len(points) - 1)
+             if xs[i + 1] >= lower and xs[i] <= upper]
+    steepest = min(steps, key=lambda i: (ys[i + 1] - ys[i]) /
+                   (xs[i + 1] - xs[i]))
+    return points[steepest][2]
@@ -0,0 +1,150 @@
+'''
+fastq.py - lightweight fastq utilities
+=======================================
+
+Streaming helpers for gzipped fastq files that do not depend on
+any external parsers. Only as many records as are needed are read.
+
+'''
+
+import gzip
+import random
+import itertools
+import statistics
+
+
+class FastqError(ValueError):
+    '''raised when a fastq file is malformed or mates are inconsistent
+    '''
+
+
+def iterate(infile, nreads=None):
+    '''iterate over (name, sequence, quality) records of a gzipped
+    fastq file, stopping after *nreads* records if given
+    '''
+    with gzip.open(infile, "rt") as inf:
+        records = zip(*[inf] * 4)
+        if nreads is not None:
+            records = itertools.islice(records, nreads)
+        for n, (header, seq, plus, qual) in enumerate(records):
+            if not header.startswith("@") or not plus.startswith("+"):
+                raise FastqError("%s: record %i is not a fastq record" %
+                                 (infile, n + 1))
+            seq, qual = seq.rstrip("\n"), qual.rstrip("\n")
+            if len(seq) != len(qual):
+                raise FastqError(
+                    "%s: record %i has sequence and quality of different "
+                    "lengths" % (infile, n + 1))
+            yield header[1:].rstrip("\n"), seq, qual
+
+
+def read_name(header):
+    '''return the read name from a fastq header without the comment
+    or /1 /2 mate suffix
+    '''
+    name = header.split()[0]
+    if name.endswith("/1") or name.endswith("/2"):
+        name = name[:-2]
+    return name
+
+
+def scan(p1, p2=None, nreads=10000):
+    '''scan the first *nreads* reads of a sample.
+
+    If *p2* is given mates are checked to have the same read names
+    and to be equal in number. Returns a dictionary with the layout
+    (paired or single), number of reads scanned and the mean and
+    standard deviation of read length of read 1.
+    '''
+    lengths = []
+    if p2 is None:
+        for name, seq, qual in iterate(p1, nreads):
+            lengths.append(len(seq))
+    else:
+        sentinel = object()
+        for n, (r1, r2) in enumerate(itertools.zip_longest(
+                iterate(p1, nreads), iterate(p2, nreads),
+                fillvalue=sentinel)):
+            if r1 is sentinel or r2 is sentinel:
+                raise FastqError("%s and %s have different numbers of "
+                                 "reads" % (p1, p2))
+            if read_name(r1[0]) != read_name(r2[0]):
+                raise FastqError("read %i has different names in %s (%s) "
+                                 "and %s (%s)" % (n + 1, p1, r1[0], p2, r2[0]))
+            lengths.append(len(r1[1]))
+
+    if not lengths:
+        raise FastqError("%s contains no reads" % p1)
+
+    return {"layout": "single" if p2 is None else "paired",
+            "nreads": len(lengths),
+            "read_length": statistics.mean(lengths),
+            "read_length_sd": statistics.pstdev(lengths)}
+
+
+def count_reads(infile, blocksize=1 << 20):
+    '''count the reads in a gzipped fastq file without parsing records
+    '''
+    nlines = 0
+    with gzip.open(infile, "rb") as inf:
+        for block in iter(lambda: inf.read(blocksize), b""):
+            nlines += block.count(b"\n")
+    return nlines // 4
+
+
+def subsample(infiles, outfiles, fraction=None, nreads=None, seed=1,
+              compresslevel=4):
+    '''subsample reads from one or more mate files (R1, R2, ...)
+    keeping mates in sync.
+
+    Either a *fraction* of reads (each read kept with that probability)
+    or an exact number of reads (*nreads*, using selection sampling)
+    is written. Records are streamed so that no reads are held in
+    memory; for *nreads* the input is read twice, once to count the
+    reads. Selection depends only on *seed* and the order of reads so
+    the output is reproducible. Returns the number of reads written.
+    '''
+    if (fraction is None) == (nreads is None):
+        raise ValueError("specify one of fraction or nreads")
+
+    rng = random.Random(seed)
+    if nreads is not None:
+        remaining = count_reads(infiles[0])
+        needed = min(nreads, remaining)
+
+        def keep():
+            nonlocal remaining, needed
+            selected = rng.random() * remaining < needed
+            remaining -= 1
+            if selected:
+                needed -= 1
+            return selected
+    else:
+        def keep():
+            return rng.random() < fraction
+
+    inhandles = [gzip.open(x, "rt") for x in infiles]
+    outhandles = [gzip.open(x, "wt", compresslevel=compresslevel)
+                  for x in outfiles]
+    written = 0
+    try:
+        records = [zip(*[x] * 4) for x in inhandles]
+        sentinel = object()
+        for n, mates in enumerate(itertools.zip_longest(*records,
+                                                        fillvalue=sentinel)):
+            if sentinel in mates:
+                raise FastqError("mate files %s have different numbers of "
+                                 "reads" % ", ".join(infiles))
+            if len(set(read_name(x[0][1:]) for x in mates)) > 1:
+                raise FastqError("read %i has different names in mate "
+                                 "files %s" % (n + 1, ", ".join(infiles)))
+            if keep():
+                for outf, record in zip(outhandles, mates):
+                    outf.writelines(record)
+                written += 1
+            elif nreads is not None and needed == 0:
+                break
+    finally:
+        for handle in inhandles + outhandles:
+            handle.close()
+    return written
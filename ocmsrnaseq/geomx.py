@@ -0,0 +1,354 @@
+'''
+geomx.py - helpers for running geomxngspipeline on GeoMx DSP data
+==================================================================
+
+GeoMx DSP configuration (.ini) files list the AOIs of a run in the
+[AOI_List] section, keyed by sample id. FASTQ files for an AOI are named
+<sample id>_..._L00<lane>_R<read>_001.fastq.gz and geomxngspipeline
+writes one <sample id>.dcc file per AOI and a summary.txt covering all
+AOIs that were processed together.
+
+To avoid scanning the FASTQ directory and parsing the (large) ini file
+in every job, :func:`build_manifest` does both once and writes an index
+with one entry per AOI::
+
+    <outdir>/template.ini      ini with empty [Processing_v2] and
+                               [AOI_List] sections
+    <outdir>/manifest.tsv      aoi, number of FASTQs, FASTQs
+    <outdir>/aois/<aoi>.json   AOI_List value, Processing_v2 section
+                               and FASTQ files of the AOI
+
+A job reads the entries of its AOIs only and writes its ini with
+:func:`write_entry_config` by filling in these sections of the template,
+so that sections stay in the order of the original ini.
+
+Runs with several .ini files (e.g. one per slide) are combined with
+:func:`combine_inis`, which requires the same [Targets] in every file
+and AOIs to be unique across files, before the manifest is built.
+
+DCC files are parsed in parallel (:func:`build_count_matrix`) and their
+RTS ids are mapped to targets with an index built from the PKC (JSON)
+files. Counts are written as a sparse probe x AOI matrix in the
+h5matrix (10x) layout with probe annotations under matrix/features and
+the DCC attributes joined with the lab worksheet under
+matrix/aoi_metadata, one dataset per column.
+
+'''
+
+import os
+import re
+import json
+import multiprocessing
+import configparser
+import numpy as np
+import scipy.sparse
+import h5py
+import ocmsrnaseq.h5matrix as h5matrix
+
+
+def read_config(ini):
+    '''read a GeoMx .ini file preserving the case of keys
+    '''
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    with open(ini) as inf:
+        config.read_file(inf)
+    return config
+
+
+def _parse_ini(ini):
+    '''return the sections of an ini as dictionaries and the set of
+    its targets
+    '''
+    config = read_config(ini)
+    sections = dict((x, dict(config[x])) for x in config.sections())
+    targets = frozenset(sections.get("Targets", {}).items())
+    return ini, sections, targets
+
+
+def combine_inis(inis, outfile, index=None, nthreads=1):
+    '''combine the AOI lists of several GeoMx .ini files (e.g. one per
+    slide) into a single ini written to outfile.
+
+    Files are parsed in parallel. All files must have the same
+    [Targets] and an AOI may only be listed in one file. Other sections
+    are taken from the first file. If *index* is given, a JSON index of
+    each AOI to its [AOI_List] value and the file it was listed in is
+    written to it. Returns the index.
+    '''
+    with multiprocessing.Pool(nthreads) as pool:
+        parsed = pool.map(_parse_ini, inis)
+
+    first, sections, targets = parsed[0]
+    aois = {}
+    for ini, x, other in parsed:
+        if other != targets:
+            raise ValueError("targets in %s and %s do not match" %
+                             (first, ini))
+        for aoi, value in x["AOI_List"].items():
+            if aoi in aois:
+                raise ValueError("AOI %s is listed in %s and %s" %
+                                 (aoi, aois[aoi]["ini"], ini))
+            aois[aoi] = {"config": value, "ini": ini}
+
+    combined = configparser.ConfigParser()
+    combined.optionxform = str
+    combined.read_dict(sections)
+    combined["AOI_List"] = dict((x, y["config"]) for x, y in aois.items())
+    with open(outfile, "w") as outf:
+        combined.write(outf)
+
+    if index is not None:
+        with open(index, "w") as outf:
+            json.dump(aois, outf, separators=(",", ":"))
+    return aois
+
+
+def scan_fastqs(directory="."):
+    '''scan directory once returning a dictionary of sample id to the
+    sorted FASTQ files (absolute paths) of the sample
+    '''
+    fastqs = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".fastq.gz") and "_" in entry.name:
+                sample = entry.name.split("_")[0]
+                fastqs.setdefault(sample, []).append(
+                    os.path.abspath(entry.path))
+    return dict((x, sorted(y)) for x, y in fastqs.items())
+
+
+def build_manifest(ini, outdir, directory=".", index=None):
+    '''write the AOI manifest for the AOIs in *ini* that have FASTQ
+    files in *directory*. Returns the AOIs written and the AOIs of the
+    ini without FASTQ files.
+
+    If *ini* was combined from several files, the *index* returned by
+    :func:`combine_inis` records the file of each AOI in its entry.
+    '''
+    config = read_config(ini)
+    fastqs = scan_fastqs(directory)
+    processing = dict(config["Processing_v2"])
+    aois = dict(config["AOI_List"])
+
+    # the sections of the entries are left empty in the template so
+    # that the ini of a job keeps the section order of the original
+    template = configparser.ConfigParser()
+    template.optionxform = str
+    template.read_dict(dict(
+        (x, {} if x in ("Processing_v2", "AOI_List") else config[x])
+        for x in config.sections()))
+
+    os.makedirs(os.path.join(outdir, "aois"), exist_ok=True)
+    with open(os.path.join(outdir, "template.ini"), "w") as outf:
+        template.write(outf)
+
+    written, missing = [], []
+    with open(os.path.join(outdir, "manifest.tsv"), "w") as outf:
+        outf.write("aoi\tnfastqs\tfastqs\n")
+        for aoi in sorted(aois):
+            if aoi not in fastqs:
+                missing.append(aoi)
+                continue
+            entry = {"aoi": aoi,
+                     "config": aois[aoi],
+                     "processing": processing,
+                     "fastqs": fastqs[aoi],
+                     "ini": index[aoi]["ini"] if index else ini}
+            with open(os.path.join(outdir, "aois", aoi + ".json"), "w") as e:
+                json.dump(entry, e, indent=1)
+            outf.write("%s\t%i\t%s\n" % (aoi, len(fastqs[aoi]),
+                                          ",".join(fastqs[aoi])))
+            written.append(aoi)
+    return written, missing
+
+
+def read_entry(manifest_dir, aoi):
+    '''read the manifest entry of an AOI
+    '''
+    with open(os.path.join(manifest_dir, "aois", aoi + ".json")) as inf:
+        return json.load(inf)
+
+
+def write_entry_config(manifest_dir, entries, outfile, threads=1):
+    '''write an ini for the AOIs of manifest *entries* to outfile with
+    the number of processing threads set to *threads*
+    '''
+    processing = dict(entries[0]["processing"])
+    processing["threads"] = str(threads)
+    config = read_config(os.path.join(manifest_dir, "template.ini"))
+    config["Processing_v2"] = processing
+    config["AOI_List"] = dict((x["aoi"], x["config"]) for x in entries)
+    with open(outfile, "w") as outf:
+        config.write(outf)
+
+
+def split_summary(infile, aois, outfiles):
+    '''split a summary.txt written for several AOIs into one file per
+    AOI.
+
+    The summary is a table with a header line followed by one line per
+    AOI whose first field is the AOI id (possibly with a suffix such as
+    .dcc). Each file gets the header and the lines of its AOI. Blank
+    lines start a new table whose first line is also a header. A
+    ValueError is raised if a line matches none of *aois* or if an AOI
+    has no lines, so that summaries are never silently mixed or lost.
+    '''
+    lines = dict((aoi, []) for aoi in aois)
+    nlines = dict((aoi, 0) for aoi in aois)
+    with open(infile) as inf:
+        in_table = False
+        for n, line in enumerate(inf):
+            if not line.strip() or not in_table:
+                # blank and header lines go to every file
+                in_table = bool(line.strip())
+                for x in lines.values():
+                    x.append(line)
+                continue
+            # the first field is the AOI id, possibly with a suffix
+            field = re.split(r"[\s,]", line, 1)[0]
+            aoi = re.split(r"[._]", field, 1)[0]
+            if field in lines:
+                aoi = field
+            elif aoi not in lines:
+                raise ValueError("line %i of %s (%s) matches no AOI of the "
+                                 "batch" % (n + 1, infile, field))
+            lines[aoi].append(line)
+            nlines[aoi] += 1
+
+    missing = [aoi for aoi in aois if not nlines[aoi]]
+    if missing:
+        raise ValueError("%s has no lines for AOIs %s" %
+                         (infile, ", ".join(missing)))
+
+    for aoi, outfile in zip(aois, outfiles):
+        with open(outfile, "w") as outf:
+            outf.writelines(lines[aoi])
+
+
+def parse_dcc(infile):
+    '''parse a DCC file returning the attributes of the Header,
+    Scan_Attributes and NGS_Processing_Attributes sections and the
+    counts of each RTS id in the Code_Summary section
+    '''
+    attributes, counts = {}, {}
+    section = None
+    with open(infile) as inf:
+        for line in inf:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("</"):
+                section = None
+            elif line.startswith("<") and line.endswith(">"):
+                section = line[1:-1]
+            elif section == "Code_Summary":
+                rts, count = line.split(",")[:2]
+                counts[rts] = counts.get(rts, 0) + int(float(count))
+            elif section is not None:
+                key, value = (line.split(",", 1) + [""])[:2]
+                attributes[key] = value.strip('"')
+    return attributes, counts
+
+
+def read_pkc(infiles):
+    '''build an index of RTS id to (target, probe id, code class,
+    module) from PKC files. The module is the PKC file name
+    '''
+    index = {}
+    for infile in infiles:
+        module = os.path.basename(infile)
+        if module.endswith(".pkc"):
+            module = module[:-len(".pkc")]
+        with open(infile) as inf:
+            pkc = json.load(inf)
+        for target in pkc["Targets"]:
+            for probe in target.get("Probes", []):
+                index[probe["RTS_ID"]] = (target["DisplayName"],
+                                          probe.get("ProbeID", ""),
+                                          target.get("CodeClass", ""),
+                                          module)
+    return index
+
+
+def read_worksheet(infile, column="Sample_ID"):
+    '''read a tab separated lab worksheet returning the column names
+    and a dictionary of rows keyed by sample id (without .dcc)
+    '''
+    with open(infile) as inf:
+        header = inf.readline().rstrip("\r\n").split("\t")
+        rows = {}
+        for line in inf:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < len(header):
+                fields += [""] * (len(header) - len(fields))
+            row = dict(zip(header, fields))
+            key = row[column]
+            if key.endswith(".dcc"):
+                key = key[:-len(".dcc")]
+            rows[key] = row
+    return header, rows
+
+
+def build_count_matrix(dcc_files, pkc_files, outfile, worksheet=None,
+                       nthreads=1):
+    '''parse DCC files in parallel and write a probe x AOI count matrix
+    with probe and AOI metadata to outfile (see module documentation).
+
+    Probes are the RTS ids of the PKC files. Returns the AOI metadata
+    columns and rows and the number of counts of RTS ids not in the PKC
+    files.
+    '''
+    probes = read_pkc(pkc_files)
+    rts_ids = sorted(probes)
+    rts_index = dict((x, i) for i, x in enumerate(rts_ids))
+    aois = [os.path.basename(x)[:-len(".dcc")] for x in dcc_files]
+
+    with multiprocessing.Pool(nthreads) as pool:
+        parsed = pool.map(parse_dcc, dcc_files, chunksize=8)
+
+    rows, cols, values = [], [], []
+    unknown = 0
+    columns = []
+    for col, (attributes, counts) in enumerate(parsed):
+        for key in attributes:
+            if key not in columns:
+                columns.append(key)
+        for rts, count in counts.items():
+            if rts in rts_index:
+                rows.append(rts_index[rts])
+                cols.append(col)
+                values.append(count)
+            else:
+                unknown += count
+
+    matrix = scipy.sparse.csc_matrix(
+        (np.array(values, dtype=np.int32), (rows, cols)),
+        shape=(len(rts_ids), len(aois)))
+
+    metadata = [dict(x[0]) for x in parsed]
+    if worksheet:
+        header, worksheet_rows = read_worksheet(worksheet)
+        columns += [x for x in header if x not in columns]
+        for aoi, row in zip(aois, metadata):
+            row.update(worksheet_rows.get(aoi, {}))
+    metadata = [[row.get(x, "") for x in columns] for row in metadata]
+
+    h5matrix.write_matrix(outfile, matrix, aois, rts_ids,
+                          names=[probes[x][0] for x in rts_ids],
+                          types=[probes[x][2] for x in rts_ids])
+    with h5py.File(outfile, "a") as outf:
+        group = outf["matrix"]
+        for name, i in (("probe_id", 1), ("module", 3)):
+            group.create_dataset(
+                "features/" + name,
+                data=np.array([probes[x][i] for x in rts_ids], dtype=object),
+                dtype=h5py.string_dtype())
+        aoi_metadata = group.create_group("aoi_metadata", track_order=True)
+        for i, column in enumerate(columns):
+            aoi_metadata.create_dataset(
+                column.replace("/", "_"),
+                data=np.array([x[i] for x in metadata], dtype=object),
+                dtype=h5py.string_dtype())
+
+    return columns, dict(zip(aois, metadata)), unknown
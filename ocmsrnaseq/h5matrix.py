@@ -0,0 +1,338 @@
+'''
+h5matrix.py - sparse on-disk store for 10x style matrices
+==========================================================
+
+Matrices from cellranger and CITE-seq-Count (MatrixMarket directories)
+are converted once to HDF5 in the 10x (cellranger v3) layout so that
+they can be read without parsing text::
+
+    matrix/barcodes                  cell barcodes
+    matrix/features/id               feature ids
+    matrix/features/name             feature names
+    matrix/features/feature_type     feature types
+    matrix/shape                     (features, barcodes)
+    matrix/data, indices, indptr     CSC matrix (a column per barcode)
+    matrix/csr/data, indices, indptr CSR copy (a row per feature),
+                                     optional
+
+The same files can be read in R with Seurat::Read10X_h5.
+
+Datasets are gzip compressed in chunks by default. Files written
+without compression are stored contiguously and :class:`H5Matrix`
+reads them through memory maps.
+
+'''
+
+import os
+import tempfile
+import numpy as np
+import scipy.sparse
+import h5py
+import ocmsrnaseq.mtx as mtx
+
+
+def read_features(infile):
+    '''read a 10x features (or genes) file returning ids, names and
+    types. Files with a single column (CITE-seq-Count) are taken as
+    antibody capture features
+    '''
+    ids, names, types = [], [], []
+    for line in mtx.read_lines(infile):
+        fields = line.split("\t")
+        ids.append(fields[0])
+        names.append(fields[1] if len(fields) > 1 else fields[0])
+        if len(fields) > 2:
+            types.append(fields[2])
+        elif len(fields) == 1:
+            types.append("Antibody Capture")
+        else:
+            types.append("Gene Expression")
+    return ids, names, types
+
+
+def _create(group, name, data, compression):
+    if compression and len(data) > 0:
+        return group.create_dataset(name, data=data,
+                                    chunks=(min(len(data), 1 << 18),),
+                                    compression=compression, shuffle=True)
+    return group.create_dataset(name, data=data)
+
+
+def _strings(group, name, values):
+    group.create_dataset(name, data=np.array(values, dtype=object),
+                         dtype=h5py.string_dtype())
+
+
+def _create_matrix(outf, barcodes, ids, names, types, shape):
+    '''create the matrix group with barcode and feature indexes'''
+    group = outf.create_group("matrix")
+    _strings(group, "barcodes", barcodes)
+    _strings(group, "features/id", ids)
+    _strings(group, "features/name", names)
+    _strings(group, "features/feature_type", types)
+    group.create_dataset("shape", data=np.array(shape, dtype=np.int32))
+    return group
+
+
+def _compress(indptr, indices, data, group, compression, blocksize):
+    '''write a compressed sparse matrix held in (memory mapped) arrays
+    to group, sorting the indices within each column (row) in blocks
+    '''
+    nnz = len(data)
+    out_indices = group.create_dataset(
+        "indices", shape=(nnz,), dtype=np.int64,
+        chunks=(min(max(nnz, 1), 1 << 18),) if compression else None,
+        compression=compression or None,
+        shuffle=bool(compression))
+    out_data = group.create_dataset(
+        "data", shape=(nnz,), dtype=data.dtype,
+        chunks=(min(max(nnz, 1), 1 << 18),) if compression else None,
+        compression=compression or None,
+        shuffle=bool(compression))
+    _create(group, "indptr", indptr, compression)
+
+    # blocks of whole columns of roughly blocksize entries
+    start = 0
+    nmajor = len(indptr) - 1
+    while start < nmajor:
+        end = np.searchsorted(indptr, indptr[start] + blocksize, "right") - 1
+        end = min(max(end, start + 1), nmajor)
+        first, last = indptr[start], indptr[end]
+        major = np.repeat(np.arange(start, end), np.diff(indptr[start:end + 1]))
+        order = np.lexsort((indices[first:last], major))
+        out_indices[first:last] = indices[first:last][order]
+        out_data[first:last] = data[first:last][order]
+        start = end
+
+
+def from_mtx(indir, outfile, csr=False, compression="gzip",
+             blocksize=1 << 24, tmpdir=None):
+    '''convert the 10x MatrixMarket directory *indir* to *outfile*.
+
+    The matrix is streamed twice: once to count the entries of each
+    column (and row) and once to place them in memory mapped temporary
+    arrays, so memory use does not depend on the size of the matrix.
+    '''
+    matrix, barcodes, features = mtx.matrix_files(indir)
+    nrows, ncols, nnz = mtx.dimensions(matrix)
+    with mtx.open_file(matrix, "rb") as inf:
+        integer = b"integer" in mtx.read_header(inf)[0][0]
+    dtype = np.int32 if integer else np.float64
+
+    row_entries = np.zeros(nrows, dtype=np.int64)
+    col_entries = np.zeros(ncols, dtype=np.int64)
+    for rows, cols, values in mtx.iterate_entries(matrix):
+        col_entries += np.bincount(cols, minlength=ncols)
+        row_entries += np.bincount(rows, minlength=nrows)
+    nnz = int(col_entries.sum())
+
+    layouts = [("csc", col_entries, 1)]
+    if csr:
+        layouts.append(("csr", row_entries, 0))
+
+    tmpdir = tempfile.mkdtemp(dir=tmpdir or os.path.dirname(
+        os.path.abspath(outfile)))
+    try:
+        arrays = {}
+        for name, entries, axis in layouts:
+            indptr = np.concatenate([[0], np.cumsum(entries)])
+            arrays[name] = (
+                indptr,
+                np.memmap(os.path.join(tmpdir, name + ".indices"),
+                          dtype=np.int64, mode="w+", shape=(max(nnz, 1),)),
+                np.memmap(os.path.join(tmpdir, name + ".data"),
+                          dtype=dtype, mode="w+", shape=(max(nnz, 1),)))
+
+        # scatter each block into place keeping the file order within
+        # each column (row)
+        filled = dict((name, np.zeros(len(entries), dtype=np.int64))
+                      for name, entries, axis in layouts)
+        for rows, cols, values in mtx.iterate_entries(matrix):
+            for name, entries, axis in layouts:
+                indptr, indices, data = arrays[name]
+                major, minor = (cols, rows) if axis == 1 else (rows, cols)
+                order = np.argsort(major, kind="stable")
+                major, minor = major[order], minor[order]
+                starts = np.searchsorted(major, major, "left")
+                position = (indptr[major] + filled[name][major] +
+                            np.arange(len(major)) - starts)
+                indices[position] = minor
+                data[position] = values[order]
+                filled[name] += np.bincount(major, minlength=len(entries))
+
+        ids, names, types = read_features(features)
+        with h5py.File(outfile, "w") as outf:
+            group = _create_matrix(outf, mtx.read_lines(barcodes),
+                                   ids, names, types, (nrows, ncols))
+            for name, entries, axis in layouts:
+                indptr, indices, data = arrays[name]
+                _compress(indptr, indices[:nnz], data[:nnz],
+                          group if name == "csc" else group.create_group(name),
+                          compression, blocksize)
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+def write_matrix(outfile, matrix, barcodes, ids, names=None, types=None,
+                 csr=False, compression="gzip"):
+    '''write an in memory (features x barcodes) sparse matrix to
+    outfile in the same layout as :func:`from_mtx`
+    '''
+    matrix = scipy.sparse.csc_matrix(matrix)
+    matrix.sort_indices()
+    names = names or ids
+    types = types or ["Gene Expression"] * len(ids)
+    with h5py.File(outfile, "w") as outf:
+        group = _create_matrix(outf, barcodes, ids, names, types,
+                               matrix.shape)
+        layouts = [(group, matrix)]
+        if csr:
+            by_row = scipy.sparse.csr_matrix(matrix)
+            by_row.sort_indices()
+            layouts.append((group.create_group("csr"), by_row))
+        for out, m in layouts:
+            _create(out, "data", m.data, compression)
+            _create(out, "indices", m.indices.astype(np.int64), compression)
+            _create(out, "indptr", m.indptr.astype(np.int64), compression)
+
+
+def _decode(values):
+    return [x.decode() if isinstance(x, bytes) else x for x in values]
+
+
+class H5Matrix(object):
+    '''read access to a matrix written by :func:`from_mtx` (or a
+    cellranger filtered/raw_feature_bc_matrix.h5)::
+
+        with H5Matrix("gex.h5") as m:
+            counts, features, barcodes = m.read(barcodes=["AAAC-1"])
+
+    Contiguous (uncompressed) datasets are read through memory maps.
+    '''
+
+    def __init__(self, infile, mmap=True):
+        self.infile = infile
+        self.h5 = h5py.File(infile, "r")
+        self.group = self.h5["matrix"]
+        self.shape = tuple(int(x) for x in self.group["shape"][:])
+        self.barcodes = _decode(self.group["barcodes"][:])
+        self.features = _decode(self.group["features/id"][:])
+        self.feature_names = _decode(self.group["features/name"][:])
+        self.mmap = mmap
+        self._barcode_index = None
+        self._feature_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.h5.close()
+
+    def _array(self, name):
+        '''return a dataset as a memory map where possible'''
+        dataset = self.group[name]
+        offset = dataset.id.get_offset()
+        if (self.mmap and dataset.chunks is None and offset is not None
+                and dataset.size > 0):
+            return np.memmap(self.infile, dtype=dataset.dtype, mode="r",
+                             offset=offset, shape=dataset.shape)
+        return dataset
+
+    def _index(self, values, lookup):
+        '''convert names or integer positions to sorted positions'''
+        if values is None:
+            return None
+        values = list(values)
+        if values and not isinstance(values[0], (str, bytes)):
+            return np.sort(np.asarray(values, dtype=np.int64))
+        missing = [x for x in values if x not in lookup]
+        if missing:
+            raise KeyError("%i of %i names not found in %s, e.g. %s" %
+                           (len(missing), len(values), self.infile,
+                            missing[0]))
+        return np.sort(np.array([lookup[x] for x in values], dtype=np.int64))
+
+    def barcode_positions(self, barcodes):
+        if self._barcode_index is None:
+            self._barcode_index = dict(
+                (x, i) for i, x in enumerate(self.barcodes))
+        return self._index(barcodes, self._barcode_index)
+
+    def feature_positions(self, features):
+        if self._feature_index is None:
+            self._feature_index = dict(
+                (x, i) for i, x in enumerate(self.features))
+            for i, x in enumerate(self.feature_names):
+                self._feature_index.setdefault(x, i)
+        return self._index(features, self._feature_index)
+
+    def _read_major(self, prefix, positions):
+        '''read the selected columns (CSC) or rows (CSR) returning a
+        compressed matrix of the selection'''
+        indptr = self._array(prefix + "indptr")[:]
+        indices = self._array(prefix + "indices")
+        data = self._array(prefix + "data")
+        if positions is None:
+            return indptr, indices[:], data[:]
+
+        starts, ends = indptr[positions], indptr[positions + 1]
+        new_indptr = np.concatenate([[0], np.cumsum(ends - starts)])
+        new_indices = np.empty(new_indptr[-1], dtype=indices.dtype)
+        new_data = np.empty(new_indptr[-1], dtype=data.dtype)
+
+        # merge runs of adjacent positions into single reads
+        breaks = np.where(positions[1:] != positions[:-1] + 1)[0] + 1
+        for run in np.split(np.arange(len(positions)), breaks):
+            if len(run) == 0:
+                continue
+            first, last = starts[run[0]], ends[run[-1]]
+            out = new_indptr[run[0]]
+            new_indices[out:out + last - first] = indices[first:last]
+            new_data[out:out + last - first] = data[first:last]
+        return new_indptr, new_indices, new_data
+
+    def read(self, barcodes=None, features=None):
+        '''read the matrix restricted to *barcodes* and/or *features*
+        (names or 0-based positions).
+
+        Returns a scipy.sparse.csc_matrix (features x barcodes) and the
+        selected feature ids and barcodes, in file order.
+        '''
+        columns = self.barcode_positions(barcodes)
+        rows = self.feature_positions(features)
+        nrows, ncols = self.shape
+
+        if columns is None and rows is not None and "csr" in self.group:
+            indptr, indices, data = self._read_major("csr/", rows)
+            matrix = scipy.sparse.csr_matrix(
+                (data, indices, indptr), shape=(len(rows), ncols)).tocsc()
+        else:
+            indptr, indices, data = self._read_major("", columns)
+            ncolumns = ncols if columns is None else len(columns)
+            matrix = scipy.sparse.csc_matrix(
+                (data, indices, indptr), shape=(nrows, ncolumns))
+            if rows is not None:
+                matrix = matrix[rows]
+
+        selected_features = (self.features if rows is None else
+                             [self.features[i] for i in rows])
+        selected_barcodes = (self.barcodes if columns is None else
+                             [self.barcodes[i] for i in columns])
+        return matrix, selected_features, selected_barcodes
+
+    def column_totals(self):
+        '''return the sum of each column (barcode)'''
+        indptr = self._array("indptr")[:]
+        data = self._array("data")
+        totals = np.zeros(self.shape[1])
+        nonempty = np.diff(indptr) > 0
+        if nonempty.any():
+            totals[nonempty] = np.add.reduceat(
+                np.asarray(data[:], dtype=np.float64),
+                indptr[:-1][nonempty])
+        return totals
@@ -0,0 +1,407 @@
+'''
+htodemux.py - demultiplexing of hashtag oligo (HTO) counts
+===========================================================
+
+A native implementation of Seurat's HTODemux that works on the HTO
+count matrix alone:
+
+* HTO counts are normalised with the centred log-ratio (CLR) across
+  cells, as NormalizeData(normalization.method="CLR")
+* cells are clustered on the CLR values into (number of HTOs + 1)
+  groups with k-medoids (CLARA, as cluster::clara used by Seurat)
+* for each HTO the cluster with the lowest average expression is taken
+  as background, a negative binomial is fitted to its counts and cells
+  above the positive.quantile of the fit are called positive for the HTO
+* cells positive for no HTO are Negative, for one HTO a Singlet and for
+  more than one a Doublet
+
+The per-cell calls use the same names as the Seurat metadata
+(HTO_maxID, HTO_secondID, HTO_margin, HTO_classification,
+HTO_classification.global and hash.ID). As in Seurat, HTO_maxID,
+HTO_secondID and HTO_margin are taken from the CLR values, so the
+margin is a difference of CLR values rather than of counts.
+
+Calls can be checked against the output of the Seurat engine
+(hto_demux.R) with :func:`read_calls` and :func:`compare_calls`.
+
+Compact per-sample outputs are written to HDF5 (:func:`write_h5`) by
+both this engine and hto_demux.R, so that reports can be built without
+loading Seurat objects::
+
+    barcodes             cell barcodes
+    htos                 HTO names
+    counts               HTO counts
+    clr                  CLR normalised HTO counts
+    calls/<column>       one dataset per call column (CALL_COLUMNS
+                         without barcode) and nCount_RNA. HTO_margin
+                         is a float (difference of CLR values) as
+                         written by R
+
+counts and clr are stored cell-major (cells x HTOs as read by h5py)
+so that they are HTO x cell matrices as read by rhdf5 in R.
+
+'''
+
+import numpy as np
+import h5py
+import scipy.optimize
+import scipy.special
+import scipy.stats
+import ocmsrnaseq.mtx as mtx
+import ocmsrnaseq.h5matrix as h5matrix
+
+
+CALL_COLUMNS = ["barcode",
+                "HTO_maxID",
+                "HTO_secondID",
+                "HTO_margin",
+                "HTO_classification",
+                "HTO_classification.global",
+                "hash.ID"]
+
+
+def read_hto_matrix(indir, exclude=()):
+    '''read a CITE-seq-Count matrix directory (or a matrix converted
+    with h5matrix.from_mtx) returning a dense (hto x cell) count array,
+    the HTO names and the cell barcodes.
+
+    As in hto_demux.R the "unmapped" row, HTOs without counts, cells
+    without counts and HTOs in *exclude* are removed.
+    '''
+    if indir.endswith(".h5"):
+        with h5matrix.H5Matrix(indir) as infile:
+            counts, htos, barcodes = infile.read()
+        counts = counts.toarray().astype(np.float64)
+        htos, barcodes = np.array(htos), np.array(barcodes)
+    else:
+        matrix, barcodes, features = mtx.matrix_files(indir)
+        nrows, ncols, nnz = mtx.dimensions(matrix)
+        counts = np.zeros((nrows, ncols))
+        for rows, cols, values in mtx.iterate_entries(matrix):
+            counts[rows, cols] = values
+
+        htos = np.array([x.split("\t")[0]
+                         for x in mtx.read_lines(features)])
+        barcodes = np.array(mtx.read_lines(barcodes))
+
+    keep = (htos != "unmapped") & (counts.sum(axis=1) > 0)
+    counts, htos = counts[keep], htos[keep]
+    keep = counts.sum(axis=0) > 0
+    counts, barcodes = counts[:, keep], barcodes[keep]
+    keep = ~np.isin(htos, list(exclude))
+    return counts[keep], htos[keep], barcodes
+
+
+def clr(counts):
+    '''centred log-ratio normalisation of each row (HTO) across cells
+    '''
+    logged = np.log1p(counts)
+    geometric = np.exp(logged.sum(axis=1) / counts.shape[1])
+    return np.log1p(counts / geometric[:, np.newaxis])
+
+
+def pam(distances, k):
+    '''partitioning around medoids (BUILD and SWAP) on a square distance
+    matrix, returning the indices of the medoids
+    '''
+    n = distances.shape[0]
+    if n <= k:
+        return np.arange(n)
+
+    # BUILD: greedily add the medoid that most reduces the total distance
+    medoids = [int(np.argmin(distances.sum(axis=0)))]
+    nearest = distances[:, medoids[0]].copy()
+    for i in range(1, k):
+        gain = np.maximum(nearest[:, np.newaxis] - distances, 0).sum(axis=0)
+        gain[medoids] = -1
+        medoids.append(int(np.argmax(gain)))
+        nearest = np.minimum(nearest, distances[:, medoids[-1]])
+
+    # SWAP: exchange a medoid and a non-medoid while the cost decreases
+    medoids = np.array(medoids)
+    while True:
+        to_medoids = distances[:, medoids]
+        order = np.argsort(to_medoids, axis=1)
+        first = to_medoids[np.arange(n), order[:, 0]]
+        second = to_medoids[np.arange(n), order[:, 1]]
+        cost = first.sum()
+        # distance of each point to its nearest medoid once medoid i is
+        # removed
+        without = np.where(order[:, 0] == np.arange(k)[:, np.newaxis],
+                           second, first)
+        swapped = np.minimum(without[:, :, np.newaxis],
+                             distances[np.newaxis, :, :]).sum(axis=1)
+        swapped[:, medoids] = np.inf
+        i, h = np.unravel_index(np.argmin(swapped), swapped.shape)
+        if swapped[i, h] >= cost - 1e-10:
+            return medoids
+        medoids[i] = h
+
+
+def euclidean(x, y):
+    '''euclidean distances between the rows of x and y
+    '''
+    d = (x * x).sum(axis=1)[:, np.newaxis] + (y * y).sum(axis=1) - 2 * x @ y.T
+    return np.sqrt(np.maximum(d, 0))
+
+
+def clara(x, k, samples=100, sampsize=None, seed=1):
+    '''k-medoids clustering of the rows of x with CLARA: PAM is run on
+    *samples* random subsets of *sampsize* rows (40 + 2k by default), the
+    best medoids found so far are included in each subset, and the
+    medoids with the lowest mean distance over all rows are kept.
+
+    Returns the cluster (0 to k-1) of each row.
+    '''
+    n = x.shape[0]
+    if sampsize is None:
+        sampsize = min(n, 40 + 2 * k)
+    sampsize = max(min(n, sampsize), min(n, k + 1))
+    rng = np.random.RandomState(seed)
+
+    best, best_cost = None, np.inf
+    for sample in range(samples if sampsize < n else 1):
+        if best is None:
+            subset = rng.choice(n, sampsize, replace=False)
+        else:
+            rest = np.setdiff1d(np.arange(n), best)
+            subset = np.concatenate(
+                [best, rng.choice(rest, sampsize - k, replace=False)])
+        medoids = subset[pam(euclidean(x[subset], x[subset]), k)]
+        cost = euclidean(x, x[medoids]).min(axis=1).mean()
+        if cost < best_cost:
+            best, best_cost = medoids, cost
+
+    return np.argmin(euclidean(x, x[best]), axis=1)
+
+
+def fit_nbinom(values):
+    '''maximum likelihood fit of a negative binomial, returning size and
+    mu. The MLE of mu is the mean; size is found by maximising the profile
+    likelihood.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    mu = values.mean()
+    if mu == 0:
+        return np.inf, 0.0
+
+    def negloglik(log_size):
+        size = np.exp(log_size)
+        return -(scipy.special.gammaln(values + size).sum()
+                 - n * scipy.special.gammaln(size)
+                 + n * size * np.log(size / (size + mu))
+                 + values.sum() * np.log(mu / (size + mu)))
+
+    result = scipy.optimize.minimize_scalar(negloglik,
+                                            bounds=(-20, 20),
+                                            method="bounded")
+    return np.exp(result.x), mu
+
+
+def nbinom_cutoff(values, quantile):
+    '''return the *quantile* of a negative binomial fitted to values
+    '''
+    size, mu = fit_nbinom(values)
+    if mu == 0:
+        return 0.0
+    return scipy.stats.nbinom.ppf(quantile, size, size / (size + mu))
+
+
+def hto_demux(counts, htos, positive_quantile=0.99, samples=100, seed=1,
+              normalised=None, clusters=None):
+    '''demultiplex cells from a (hto x cell) count array.
+
+    The CLR values (*normalised*) and the clusters can be given to avoid
+    recomputing them when calling repeatedly on the same counts.
+
+    Returns a dictionary with the CLR values, the positive calls (hto x
+    cell boolean array), the cutoff of each HTO and the per-cell call
+    columns of CALL_COLUMNS (without barcode).
+    '''
+    nhtos, ncells = counts.shape
+    htos = np.asarray(htos)
+    if normalised is None:
+        normalised = clr(counts)
+    if clusters is None:
+        clusters = clara(normalised.T, nhtos + 1, samples=samples, seed=seed)
+
+    # average expression per cluster on the non-log scale as Seurat's
+    # AverageExpression
+    nclusters = clusters.max() + 1
+    sizes = np.bincount(clusters, minlength=nclusters)
+    average = np.zeros((nhtos, nclusters))
+    for i in range(nhtos):
+        average[i] = (np.bincount(clusters, np.expm1(normalised[i]),
+                                  nclusters) / np.maximum(sizes, 1))
+    average[:, sizes == 0] = np.inf
+
+    cutoffs = np.zeros(nhtos)
+    positive = np.zeros((nhtos, ncells), dtype=bool)
+    for i in range(nhtos):
+        background = counts[i, clusters == np.argmin(average[i])]
+        cutoffs[i] = nbinom_cutoff(background, positive_quantile)
+        positive[i] = counts[i] > cutoffs[i]
+
+    npositive = positive.sum(axis=0)
+    classification_global = np.where(
+        npositive == 0, "Negative",
+        np.where(npositive == 1, "Singlet", "Doublet")).astype(object)
+
+    # the highest and second highest HTO and their margin are taken
+    # from the CLR values as in Seurat. Each ID is the first HTO with
+    # the value (as which() in R), so the second ID is the highest HTO
+    # if the two highest values are tied
+    order = np.argsort(-normalised, axis=0, kind="stable")
+    max_id = htos[order[0]]
+    cells = np.arange(ncells)
+    if nhtos > 1:
+        highest = normalised[order[0], cells]
+        second = normalised[order[1], cells]
+        second_id = htos[np.argmax(normalised == second, axis=0)]
+        margin = highest - second
+    else:
+        second_id = max_id
+        margin = np.zeros(ncells)
+
+    classification = max_id.astype(object)
+    doublets = classification_global == "Doublet"
+    classification[doublets] = ["_".join(sorted(x)) for x in
+                                zip(max_id[doublets], second_id[doublets])]
+    classification[classification_global == "Negative"] = "Negative"
+    hash_id = classification.copy()
+    hash_id[doublets] = "Doublet"
+
+    return {"clr": normalised,
+            "positive": positive,
+            "cutoffs": cutoffs,
+            "HTO_maxID": max_id,
+            "HTO_secondID": second_id,
+            "HTO_margin": margin,
+            "HTO_classification": classification,
+            "HTO_classification.global": classification_global,
+            "hash.ID": hash_id}
+
+
+def write_calls(outf, barcodes, result):
+    '''write the per-cell calls to an open file as a tab separated table
+    '''
+    outf.write("\t".join(CALL_COLUMNS) + "\n")
+    columns = [barcodes] + [result[x] for x in CALL_COLUMNS[1:]]
+    for row in zip(*columns):
+        outf.write("%s\t%s\t%s\t%.6f\t%s\t%s\t%s\n" % row)
+
+
+def sweep(counts, htos, barcodes, totals, umi_thresholds, quantiles,
+          exclusions=((),), samples=100, seed=1):
+    '''demultiplex the same cells over a grid of GEX UMI thresholds, HTO
+    exclusions and positive quantiles.
+
+    *counts*, *htos* and *barcodes* are as returned by read_hto_matrix
+    (without exclusions) and *totals* is the GEX UMI total of each of
+    the barcodes. Normalisation and clustering are computed once per
+    UMI threshold and exclusion and reused across quantiles.
+
+    Yields a dictionary of the settings and the number of cells of each
+    global classification.
+    '''
+    htos = np.asarray(htos)
+    for umi_threshold in umi_thresholds:
+        cells = totals >= umi_threshold
+        for exclude in exclusions:
+            rows = ~np.isin(htos, list(exclude))
+            subset = counts[rows][:, cells]
+            normalised = clusters = None
+            if subset.shape[1] > rows.sum() + 1:
+                normalised = clr(subset)
+                clusters = clara(normalised.T, rows.sum() + 1,
+                                 samples=samples, seed=seed)
+            for quantile in quantiles:
+                row = {"umi_threshold": umi_threshold,
+                       "excluded_htos": ",".join(exclude),
+                       "positive_quantile": quantile,
+                       "cells": subset.shape[1],
+                       "Singlet": 0,
+                       "Doublet": 0,
+                       "Negative": 0}
+                if clusters is not None:
+                    result = hto_demux(subset, htos[rows],
+                                       positive_quantile=quantile,
+                                       normalised=normalised,
+                                       clusters=clusters)
+                    calls = result["HTO_classification.global"]
+                    for x in ("Singlet", "Doublet", "Negative"):
+                        row[x] = int((calls == x).sum())
+                yield row
+
+
+def write_h5(outfile, barcodes, htos, counts, result, ncount_rna=None):
+    '''write the compact per-sample demultiplexing output (see module
+    documentation) to outfile
+    '''
+    string_type = h5py.string_dtype()
+    with h5py.File(outfile, "w") as outf:
+        outf.create_dataset("barcodes", data=np.array(barcodes, dtype=object),
+                            dtype=string_type)
+        outf.create_dataset("htos", data=np.array(htos, dtype=object),
+                            dtype=string_type)
+        outf.create_dataset("counts", data=counts.T.astype(np.int32),
+                            compression="gzip", shuffle=True)
+        outf.create_dataset("clr", data=result["clr"].T,
+                            compression="gzip", shuffle=True)
+        for column in CALL_COLUMNS[1:]:
+            values = result[column]
+            if column == "HTO_margin":
+                outf.create_dataset("calls/" + column,
+                                    data=np.asarray(values, dtype=np.float64))
+            else:
+                outf.create_dataset("calls/" + column,
+                                    data=np.array(values, dtype=object),
+                                    dtype=string_type)
+        if ncount_rna is None:
+            ncount_rna = np.full(len(barcodes), np.nan)
+        outf.create_dataset("calls/nCount_RNA", data=ncount_rna)
+
+
+def read_calls(infile):
+    '''read the barcodes and per-cell calls from a file written by
+    :func:`write_h5` or hto_demux.R. Returns a dictionary of call
+    column to array, including barcode
+    '''
+    with h5py.File(infile, "r") as inf:
+        calls = {"barcode": inf["barcodes"].asstr()[:]}
+        for column in CALL_COLUMNS[1:]:
+            dataset = inf["calls/" + column]
+            if column == "HTO_margin":
+                calls[column] = dataset[:].astype(np.float64)
+            else:
+                calls[column] = dataset.asstr()[:]
+    return calls
+
+
+def compare_calls(barcodes, result, reference):
+    '''compare the calls in *result* for *barcodes* with the calls in
+    *reference* (as returned by :func:`read_calls`) on the barcodes
+    found in both.
+
+    Returns a dictionary with the number of shared cells, the fraction
+    of them with the same value of each string call column and the
+    largest absolute difference of HTO_margin.
+    '''
+    index = dict((x, i) for i, x in enumerate(reference["barcode"]))
+    rows = np.array([i for i, x in enumerate(barcodes) if x in index],
+                    dtype=int)
+    other = np.array([index[barcodes[i]] for i in rows], dtype=int)
+    comparison = {"cells": len(rows)}
+    for column in CALL_COLUMNS[1:]:
+        values = np.asarray(result[column])[rows]
+        expected = np.asarray(reference[column])[other]
+        if column == "HTO_margin":
+            comparison[column] = float(np.max(np.abs(
+                values.astype(np.float64) - expected), initial=0.0))
+        elif len(rows):
+            comparison[column] = float(np.mean(
+                values.astype(str) == expected.astype(str)))
+        else:
+            comparison[column] = 0.0
+    return comparison
@@ -0,0 +1,311 @@
+'''
+kallisto.py - post-processing of kallisto outputs
+==================================================
+
+Combine per-sample kallisto abundance files into transcript x sample
+and gene x sample matrices stored in a single compressed hdf5 file.
+Gene level summaries follow tximport (type="kallisto"):
+
+* counts - sum of est_counts over the transcripts of a gene
+* abundance - sum of tpm over the transcripts of a gene
+* length - tpm weighted mean of transcript effective lengths. Where
+  a gene has no abundance in a sample the mean effective length of its
+  transcripts across all samples is used.
+
+The length matrix can be used to derive offsets for DESeq2/edgeR in
+the same way as the tximport length matrix.
+
+Matrices are chunked by sample so that single samples can be read
+without decompressing the whole matrix, e.g.::
+
+    counts, genes, samples = load_matrix("kallisto_quant.h5",
+                                         "gene/counts",
+                                         samples=["sample1"])
+
+'''
+
+import numpy as np
+import h5py
+
+# columns of abundance.tsv written by kallisto quant
+ABUNDANCE_COLUMNS = ("target_id", "length", "eff_length", "est_counts", "tpm")
+
+
+def read_abundance(infile):
+    '''read a kallisto abundance file returning a list of
+    transcript ids and an array of eff_length, est_counts and tpm
+    '''
+    with open(infile) as inf:
+        header = tuple(inf.readline().rstrip("\n").split("\t"))
+        if header != ABUNDANCE_COLUMNS:
+            raise ValueError("%s is not a kallisto abundance file" % infile)
+        data = [line.rstrip("\n").split("\t") for line in inf]
+    transcripts = [x[0] for x in data]
+    values = np.array([x[2:] for x in data], dtype=np.float64)
+    return transcripts, values
+
+
+def read_transcripts2genes(infile):
+    '''read a TXNAME GENEID table into a dictionary
+    '''
+    transcript2gene = {}
+    with open(infile) as inf:
+        inf.readline()
+        for line in inf:
+            transcript, gene = line.rstrip("\n").split("\t")[:2]
+            transcript2gene[transcript] = gene
+    return transcript2gene
+
+
+def aggregate_abundances(infiles, samples, tx2gene_file, outfile):
+    '''stream abundance files into transcript and gene level matrices
+    in outfile.
+
+    Only one sample is held in memory at a time; each is written as a
+    column of the chunked output datasets.
+    '''
+    transcript2gene = read_transcripts2genes(tx2gene_file)
+    transcripts, values = read_abundance(infiles[0])
+
+    genes = sorted(set(transcript2gene.get(x) for x in transcripts) - {None})
+    gene_index = {gene: i for i, gene in enumerate(genes)}
+    transcript_gene = np.array(
+        [gene_index.get(transcript2gene.get(x), -1) for x in transcripts])
+    mapped = transcript_gene >= 0
+    ntranscripts, ngenes, nsamples = len(transcripts), len(genes), len(samples)
+
+    string_type = h5py.string_dtype()
+    with h5py.File(outfile, "w") as outf:
+        outf.create_dataset("samples", data=np.array(samples, dtype=object),
+                            dtype=string_type)
+        outf.create_dataset("transcript/names",
+                            data=np.array(transcripts, dtype=object),
+                            dtype=string_type)
+        outf.create_dataset("transcript/gene", data=transcript_gene)
+        outf.create_dataset("gene/names", data=np.array(genes, dtype=object),
+                            dtype=string_type)
+
+        def _matrix(name, nrows):
+            return outf.create_dataset(name, shape=(nrows, nsamples),
+                                       dtype=np.float64,
+                                       chunks=(nrows, 1),
+                                       compression="gzip", shuffle=True)
+
+        tx_efflen = _matrix("transcript/eff_length", ntranscripts)
+        tx_counts = _matrix("transcript/est_counts", ntranscripts)
+        tx_tpm = _matrix("transcript/tpm", ntranscripts)
+        gene_counts = _matrix("gene/counts", ngenes)
+        gene_abundance = _matrix("gene/abundance", ngenes)
+        gene_length = _matrix("gene/length", ngenes)
+
+        efflen_sum = np.zeros(ntranscripts)
+        index = transcript_gene[mapped]
+        for i, infile in enumerate(infiles):
+            if i > 0:
+                sample_transcripts, values = read_abundance(infile)
+                if sample_transcripts != transcripts:
+                    raise ValueError(
+                        "transcripts in %s differ from %s - were they "
+                        "quantified against the same index?" %
+                        (infile, infiles[0]))
+            efflen, counts, tpm = values.T
+            tx_efflen[:, i] = efflen
+            tx_counts[:, i] = counts
+            tx_tpm[:, i] = tpm
+            efflen_sum += efflen
+
+            abundance = np.bincount(index, tpm[mapped], ngenes)
+            weighted = np.bincount(index, (tpm * efflen)[mapped], ngenes)
+            gene_counts[:, i] = np.bincount(index, counts[mapped], ngenes)
+            gene_abundance[:, i] = abundance
+            with np.errstate(invalid="ignore", divide="ignore"):
+                gene_length[:, i] = np.where(abundance > 0,
+                                             weighted / abundance, np.nan)
+
+        # fill lengths for genes with no abundance in a sample with
+        # the average transcript length across samples
+        ntx = np.bincount(index, minlength=ngenes)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average_length = np.bincount(
+                index, (efflen_sum / nsamples)[mapped], ngenes) / ntx
+        for i in range(nsamples):
+            lengths = gene_length[:, i]
+            missing = np.isnan(lengths)
+            if missing.any():
+                lengths[missing] = average_length[missing]
+                gene_length[:, i] = lengths
+
+    return ntranscripts - int(mapped.sum())
+
+
+def load_matrix(infile, dataset, samples=None, rows=None):
+    '''load a matrix from an aggregated kallisto hdf5 file.
+
+    *dataset* is e.g. "gene/counts" or "transcript/tpm". Subsets of
+    *samples* and/or *rows* (transcript or gene names) can be given to
+    avoid reading the whole matrix. Returns the matrix, row names and
+    sample names.
+    '''
+    level = dataset.split("/")[0]
+    with h5py.File(infile, "r") as inf:
+        all_samples = inf["samples"].asstr()[:].tolist()
+        all_rows = inf[level + "/names"].asstr()[:].tolist()
+        data = inf[dataset]
+
+        if samples is None:
+            columns = np.arange(len(all_samples))
+        else:
+            lookup = {x: i for i, x in enumerate(all_samples)}
+            columns = np.array([lookup[x] for x in samples], dtype=int)
+        if rows is None:
+            row_index = None
+        else:
+            lookup = {x: i for i, x in enumerate(all_rows)}
+            row_index = np.array([lookup[x] for x in rows], dtype=int)
+
+        if samples is None:
+            matrix = data[:]
+        else:
+            # h5py requires increasing indices for fancy indexing
+            order = np.argsort(columns)
+            matrix = np.empty((len(all_rows), len(columns)))
+            matrix[:, order] = data[:, columns[order]]
+
+    if row_index is not None:
+        matrix = matrix[row_index, :]
+        all_rows = list(rows)
+    return matrix, all_rows, [all_samples[i] for i in columns]
+
+
+def summarise_bootstraps(infile, chunksize=10):
+    '''compute per-transcript mean and variance of est_counts across
+    the bootstraps in a kallisto abundance.h5 file.
+
+    Bootstraps are read *chunksize* at a time and combined with the
+    running totals (Chan et al. parallel variance), so memory use is
+    independent of the number of bootstraps. Returns transcript ids,
+    est_counts, bootstrap means, (sample) variances and the number of
+    bootstraps; means and variances are nan if no bootstraps were run.
+    '''
+    with h5py.File(infile, "r") as inf:
+        transcripts = inf["aux/ids"].asstr()[:].tolist()
+        est_counts = inf["est_counts"][:]
+        bootstraps = sorted(inf["bootstrap"].keys(),
+                            key=lambda x: int(x[2:])) \
+            if "bootstrap" in inf else []
+
+        n = 0
+        mean = np.zeros(len(transcripts))
+        m2 = np.zeros(len(transcripts))
+        for start in range(0, len(bootstraps), chunksize):
+            chunk = np.vstack([inf["bootstrap"][x][:]
+                               for x in bootstraps[start:start + chunksize]])
+            nchunk = chunk.shape[0]
+            chunk_mean = chunk.mean(axis=0)
+            chunk_m2 = ((chunk - chunk_mean) ** 2).sum(axis=0)
+            delta = chunk_mean - mean
+            total = n + nchunk
+            mean += delta * nchunk / total
+            m2 += chunk_m2 + delta ** 2 * n * nchunk / total
+            n = total
+
+    if n == 0:
+        mean[:] = np.nan
+        variance = np.full(len(transcripts), np.nan)
+    elif n == 1:
+        variance = np.zeros(len(transcripts))
+    else:
+        variance = m2 / (n - 1)
+    return transcripts, est_counts, mean, variance, n
+
+
+def barcode_index(barcode):
+    '''return the sample index encoded in a barcode of a kallisto bus
+    --batch run (2 bits per base, A=0, C=1, G=2, T=3)
+    '''
+    index = 0
+    for base in barcode:
+        index = index * 4 + "ACGT".index(base)
+    return index
+
+
+def split_tcc_quant(abundance_mtx, efflens_mtx, barcodes, nsamples):
+    '''split the transcript x sample output of kallisto quant-tcc run on
+    the bus file of a --batch run into per-sample arrays.
+
+    *barcodes* are the rows of the matrices (the barcodes of the bustools
+    count matrix). Effective lengths are those of each sample, or of all
+    samples if quant-tcc wrote a single row. Samples without pseudoaligned
+    reads have no barcode and are returned with zero counts and, as they
+    have no fragment length distribution, the mean effective lengths of
+    the batch. Returns an array of shape (nsamples, ntranscripts, 3) of
+    eff_length, est_counts and tpm, with tpm computed from est_counts and
+    eff_length as by kallisto quant.
+    '''
+    import scipy.io
+
+    counts = scipy.io.mmread(abundance_mtx).toarray()
+    efflens = scipy.io.mmread(efflens_mtx)
+    efflens = efflens.toarray() if hasattr(efflens, "toarray") \
+        else np.asarray(efflens)
+    if counts.shape[0] != len(barcodes):
+        counts = counts.T
+    if efflens.shape[1] != counts.shape[1]:
+        efflens = efflens.T
+
+    ntranscripts = counts.shape[1]
+    values = np.zeros((nsamples, ntranscripts, 3))
+    found = np.zeros(nsamples, dtype=bool)
+    for row, barcode in enumerate(barcodes):
+        i = barcode_index(barcode)
+        if i >= nsamples:
+            raise ValueError("barcode %s is not a sample of the batch" %
+                             barcode)
+        efflen = efflens[row if efflens.shape[0] > 1 else 0]
+        rate = np.divide(counts[row], efflen, out=np.zeros(ntranscripts),
+                         where=efflen > 0)
+        values[i, :, 0] = efflen
+        values[i, :, 1] = counts[row]
+        if rate.sum() > 0:
+            values[i, :, 2] = rate / rate.sum() * 1e6
+        found[i] = True
+    values[~found, :, 0] = efflens.mean(axis=0)
+    return values
+
+
+def write_abundance(outfile, transcripts, lengths, values):
+    '''write length, eff_length, est_counts and tpm of transcripts as a
+    kallisto abundance file, formatting numbers as kallisto quant
+    (6 significant digits)
+    '''
+    with open(outfile, "w") as outf:
+        outf.write("\t".join(ABUNDANCE_COLUMNS) + "\n")
+        for transcript, length, (efflen, count, tpm) in zip(
+                transcripts, lengths, values):
+            outf.write("%s\t%i\t%g\t%g\t%g\n" %
+                       (transcript, length, efflen, count, tpm))
+
+
+def write_abundance_h5(outfile, transcripts, lengths, values,
+                       run_info=None):
+    '''write the datasets of a kallisto quant abundance.h5 file without
+    bootstraps (aux/ids, aux/lengths, aux/eff_lengths, aux/num_bootstrap
+    and est_counts). The version and call of *run_info* (the
+    run_info.json of the kallisto run) are added if given
+    '''
+    string_type = h5py.string_dtype()
+    with h5py.File(outfile, "w") as outf:
+        outf.create_dataset("aux/ids", data=np.array(transcripts,
+                                                     dtype=object),
+                            dtype=string_type)
+        outf.create_dataset("aux/lengths",
+                            data=np.asarray(lengths, dtype=np.int32))
+        outf.create_dataset("aux/eff_lengths", data=values[:, 0])
+        outf.create_dataset("aux/num_bootstrap",
+                            data=np.array([0], dtype=np.int32))
+        outf.create_dataset("est_counts", data=values[:, 1])
+        for key in ("kallisto_version", "index_version", "call",
+                    "start_time"):
+            if run_info and key in run_info:
+                outf.create_dataset("aux/" + key, data=str(run_info[key]),
+                                    dtype=string_type)
@@ -0,0 +1,161 @@
+'''
+mtx.py - streaming access to 10x style MatrixMarket directories
+================================================================
+
+cellranger and CITE-seq-Count write matrices as directories containing
+matrix.mtx(.gz), barcodes.tsv(.gz) and features.tsv(.gz) (genes.tsv in
+older versions). The functions here read matrix.mtx in large blocks
+that are parsed with numpy so that matrices can be summarised or
+filtered without loading them into memory.
+
+'''
+
+import os
+import gzip
+import numpy as np
+
+
+def open_file(infile, mode="rt"):
+    '''open a file that may or may not be gzipped
+    '''
+    if infile.endswith(".gz"):
+        return gzip.open(infile, mode)
+    return open(infile, mode)
+
+
+def find_file(indir, names):
+    '''return the first of *names* (with or without .gz) found in indir
+    '''
+    for name in names:
+        for suffix in (".gz", ""):
+            path = os.path.join(indir, name + suffix)
+            if os.path.exists(path):
+                return path
+    raise OSError("none of %s found in %s" % (", ".join(names), indir))
+
+
+def matrix_files(indir):
+    '''return the matrix, barcodes and features files in a 10x directory
+    '''
+    return (find_file(indir, ["matrix.mtx"]),
+            find_file(indir, ["barcodes.tsv"]),
+            find_file(indir, ["features.tsv", "genes.tsv"]))
+
+
+def read_lines(infile):
+    '''read the lines of a (gzipped) text file
+    '''
+    with open_file(infile) as inf:
+        return [line.rstrip("\n") for line in inf]
+
+
+def read_header(inf):
+    '''read the MatrixMarket header of an open (binary) file returning
+    the header lines and the number of rows, columns and entries
+    '''
+    header = []
+    while True:
+        line = inf.readline()
+        header.append(line)
+        if not line.startswith(b"%"):
+            break
+    nrows, ncols, nnz = [int(x) for x in line.split()]
+    return header, nrows, ncols, nnz
+
+
+def iterate_entries(infile, blocksize=1 << 26):
+    '''iterate over the entries of a MatrixMarket coordinate file in
+    blocks, yielding 0-based row and column index arrays and values
+    '''
+    with open_file(infile, "rb") as inf:
+        header, nrows, ncols, nnz = read_header(inf)
+        remainder = b""
+        while True:
+            block = inf.read(blocksize)
+            if not block:
+                break
+            block = remainder + block
+            end = block.rfind(b"\n") + 1
+            block, remainder = block[:end], block[end:]
+            if not block:
+                continue
+            values = np.fromstring(block, dtype=np.float64, sep=" ")
+            values = values.reshape(-1, 3)
+            yield (values[:, 0].astype(np.int64) - 1,
+                   values[:, 1].astype(np.int64) - 1,
+                   values[:, 2])
+        if remainder.strip():
+            values = np.fromstring(remainder, dtype=np.float64, sep=" ")
+            values = values.reshape(-1, 3)
+            yield (values[:, 0].astype(np.int64) - 1,
+                   values[:, 1].astype(np.int64) - 1,
+                   values[:, 2])
+
+
+def dimensions(infile):
+    '''return the number of rows, columns and entries of a matrix file
+    '''
+    with open_file(infile, "rb") as inf:
+        return read_header(inf)[1:]
+
+
+def column_totals(infile):
+    '''return the sum and number of entries of each column of a
+    MatrixMarket file in a single pass
+    '''
+    nrows, ncols, nnz = dimensions(infile)
+    totals = np.zeros(ncols)
+    entries = np.zeros(ncols, dtype=np.int64)
+    for rows, cols, values in iterate_entries(infile):
+        totals += np.bincount(cols, values, ncols)
+        entries += np.bincount(cols, minlength=ncols)
+    return totals, entries
+
+
+def write_lines(outfile, lines):
+    with gzip.open(outfile, "wt") as outf:
+        outf.write("".join(x + "\n" for x in lines))
+
+
+def filter_columns(indir, outdir, keep, entries=None):
+    '''write the columns (barcodes) of the 10x matrix in *indir* that are
+    selected by the boolean array *keep* to *outdir*, streaming the
+    matrix. *entries* (number of entries per column) can be given to
+    avoid a counting pass
+    '''
+    matrix, barcodes, features = matrix_files(indir)
+    nrows, ncols, nnz = dimensions(matrix)
+    keep = np.asarray(keep, dtype=bool)
+    if entries is None:
+        entries = column_totals(matrix)[1]
+
+    new_index = np.cumsum(keep) - 1
+    os.makedirs(outdir, exist_ok=True)
+
+    write_lines(os.path.join(outdir, "barcodes.tsv.gz"),
+                [x for x, k in zip(read_lines(barcodes), keep) if k])
+    write_lines(os.path.join(outdir, "features.tsv.gz"),
+                read_lines(features))
+
+    with gzip.open(os.path.join(outdir, "matrix.mtx.gz"), "wb",
+                   compresslevel=4) as outf:
+        with open_file(matrix, "rb") as inf:
+            header = read_header(inf)[0]
+        outf.writelines(header[:-1])
+        outf.write(b"%i %i %i\n" % (nrows, int(keep.sum()),
+                                    int(entries[keep].sum())))
+        integer = b"integer" in header[0]
+        for rows, cols, values in iterate_entries(matrix):
+            selected = keep[cols]
+            if not selected.any():
+                continue
+            block = np.column_stack((rows[selected] + 1,
+                                     new_index[cols[selected]] + 1))
+            if integer:
+                block = np.column_stack((block,
+                                         values[selected].astype(np.int64)))
+                fmt = "%i %i %i"
+            else:
+                block = np.column_stack((block, values[selected]))
+                fmt = "%i %i %.10g"
+            np.savetxt(outf, block, fmt=fmt)
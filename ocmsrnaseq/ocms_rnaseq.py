@@ -1,40 +1,199 @@
 '''
-ocms_rnaseq.py - Oxford Centre for Microbiome Studies RNAseq 
+ocms_rnaseq.py - Oxford Centre for Microbiome Studies RNAseq
 ===============================================================
 
+Usage::
+
+    ocms_rnaseq <pipeline> <command> [options]
+    ocms_rnaseq script <script> [options]
+    ocms_rnaseq list
+    ocms_rnaseq benchmark [--repeats=N] [--max-seconds=S]
+
+e.g. ``ocms_rnaseq kallisto make full -v5`` or
+``ocms_rnaseq script inis2ini --help``.
+
+The pipelines of this package are listed in :data:`PIPELINES`, which
+setup.py registers as entry points in the ``ocmsrnaseq.pipelines``
+group (``<name> = <module>:main``). Pipelines of other packages can be
+added to the same group. Entry points of other packages are only
+listed by ``ocms_rnaseq list`` as reading package metadata is slower
+than starting up. Scripts are the files in scripts/. Pipelines and
+scripts are only imported when they are run, so listing them does not
+import ruffus or cgatcore.
+
+A script can also be run as ``ocms_rnaseq <script>`` if no pipeline
+has the same name.
+
+benchmark times the start up of ``ocms_rnaseq --help`` in a new
+interpreter and exits with an error if the median time is above
+--max-seconds (0.5 seconds by default).
+
 '''
 
 import os
 import sys
-import re
-import glob
-import imp
-import cgatcore.iotools as iotools
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+
+ENTRY_POINT_GROUP = "ocmsrnaseq.pipelines"
+
+# pipelines of this package, registered as entry points by setup.py
+PIPELINES = {"cite-seq-count": "ocmsrnaseq.pipeline_cite_seq_count",
+             "geomx": "ocmsrnaseq.pipeline_geomx",
+             "hto_demux": "ocmsrnaseq.pipeline_hto_demux",
+             "kallisto": "ocmsrnaseq.pipeline_kallisto",
+             "subsample": "ocmsrnaseq.pipeline_subsample"}
+
+
+def pipelines():
+    '''return a dictionary of pipeline name to module
+    '''
+    return dict(PIPELINES)
+
+
+def scripts():
+    '''return a dictionary of script name to path
+    '''
+    modules = {}
+    with os.scandir(os.path.join(PATH, "scripts")) as entries:
+        for entry in entries:
+            if entry.name.endswith(".py"):
+                modules[entry.name[:-len(".py")]] = entry.path
+    return modules
+
+
+def entry_points():
+    '''return a dictionary of name to entry point of the pipelines
+    registered in ENTRY_POINT_GROUP by this and other packages
+    '''
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        return {}
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    return dict((x.name, x) for x in eps)
+
+
+def load_module(name, path):
+    '''import a module from path under name
+    '''
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_script(argv):
+    '''run the script named by argv[0] with argv as its arguments.
+    Returns 1 if there is no such script
+    '''
+    available = scripts()
+    if argv[0] not in available:
+        sys.stderr.write("ocms_rnaseq: unknown script '%s', use "
+                         "ocms_rnaseq --help to list them\n" % argv[0])
+        return 1
+    sys.argv = argv
+    return load_module(argv[0], available[argv[0]]).main(sys.argv)
+
+
+def usage(outf=sys.stdout, registered=False):
+    outf.write(globals()["__doc__"])
+    outf.write("Pipelines:\n\n")
+    names = set(pipelines())
+    if registered:
+        names.update(entry_points())
+    for name in sorted(names):
+        outf.write("    %s\n" % name)
+    outf.write("\nScripts (ocms_rnaseq script <name>):\n\n")
+    for name in sorted(scripts()):
+        outf.write("    %s\n" % name)
+
+
+def benchmark(argv):
+    '''time the start up of ocms_rnaseq --help in a new interpreter.
+    Returns 1 if the median is above --max-seconds
+    '''
+    import argparse
+    import statistics
+    import subprocess
+    import time
+
+    parser = argparse.ArgumentParser(prog="ocms_rnaseq benchmark")
+    parser.add_argument("--repeats", type=int, default=10,
+                        help="number of times to start ocms_rnaseq")
+    parser.add_argument("--max-seconds", type=float, default=0.5,
+                        help="fail if the median start up time is above "
+                        "this, 0 to not fail")
+    args = parser.parse_args(argv)
+
+    command = [sys.executable, "-m", "ocmsrnaseq.ocms_rnaseq", "--help"]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(PATH)] +
+        [x for x in [env.get("PYTHONPATH")] if x])
+
+    times = []
+    for i in range(args.repeats):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    median = statistics.median(times)
+    sys.stdout.write("repeats\tmin\tmedian\tmax\n%i\t%.4f\t%.4f\t%.4f\n" %
+                     (len(times), min(times), median, max(times)))
+    if args.max_seconds and median > args.max_seconds:
+        sys.stderr.write("median start up time %.4fs is above %.4fs\n" %
+                         (median, args.max_seconds))
+        return 1
+    return 0
 
 
 def main(argv=None):
 
-    argv = sys.argv
+    if argv is None:
+        argv = sys.argv
 
-    path = os.path.join(os.path.abspath(os.path.dirname(__file__)))
-    paths = [path, os.path.abspath(os.path.basename(__file__))[:-3]]
-    
-    if len(argv) == 1 or argv[1] == "--help" or argv[1] == "-h":
-        print((globals()["__doc__"]))
+    if len(argv) == 1 or argv[1] in ("--help", "-h", "list"):
+        usage(registered=len(argv) > 1 and argv[1] == "list")
+        return 0
 
     command = argv[1]
-    if command in ["gtf2gene_names", "inis2ini"]:
-        pipeline = command
-    else:
-        pipeline = "pipeline_{}".format(command)
-    
+    if command == "benchmark":
+        return benchmark(argv[2:])
+
+    if command == "script":
+        if len(argv) == 2:
+            sys.stderr.write("ocms_rnaseq: usage: ocms_rnaseq script "
+                             "<script> [options]\n")
+            return 1
+        return run_script(argv[2:])
+
     # remove 'ocms_rnaseq' from sys.argv
-    del sys.argv[0]
+    sys.argv = argv[1:]
+
+    available = pipelines()
+    if command in available:
+        import importlib
+        return importlib.import_module(available[command]).main(sys.argv)
+
+    if command in scripts():
+        return run_script(sys.argv)
+
+    available = entry_points()
+    if command in available:
+        return available[command].load()(sys.argv)
+
+    sys.stderr.write("ocms_rnaseq: unknown pipeline or script '%s', use "
+                     "ocms_rnaseq --help to list them\n" % command)
+    return 1
 
-    (file, pathname, description) = imp.find_module(pipeline, paths)
-    module = imp.load_module(pipeline, file, pathname, description)
-    module.main(sys.argv)
-    
 
 if __name__ == "__main__":
     sys.exit(main())
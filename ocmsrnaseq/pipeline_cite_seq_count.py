@@ -0,0 +1,492 @@
+"""===========================
+pipeline_cite_seq_count.py
+===========================
+
+Overview
+========
+
+This pipeline takes raw fastq files that are from a multiplexed single cell experiment. The multiplexing has been performed using Hash tag oligo's (HTO). It runs Cite-seq-count on these ADT files.
+ 
+
+Usage
+=====
+
+See :ref:`PipelineSettingUp` and :ref:`PipelineRunning` on general
+information how to use cgat pipelines.
+
+Configuration
+-------------
+
+The pipeline requires a configured :file:`pipeline.yml` file.
+
+Default configuration files can be generated by executing:
+
+   python <srcdir>/pipeline_cite_seq_count.py config
+
+Input files
+-----------
+
+* ADT fastq files that are in the format .fastq.1.gz and .fastq.2.gz.
+* A tags.csv file must be present. This takes the form sample_name,hto_sequence,hto_name. The sample_name attribute in tags.csv must match the prefix to the fastq file i.e. if you are running CITE-seq-count on the fastq file sample1.fastq.1.gz and sample1.fastq.2.gz then you must have a tags.csv file that looks something like:
+
+sample1,TGATGGCCTATTGGG,HTO1
+sample1,TTCCGCCTCTCTTTG,HTO2
+sample1,AGTAAGTTCAGCGTA,HTO3
+
+In this example 3 samples have been multiplexed and ended up in sample1 fastq files. 
+
+Outputs
+--------
+
+The counts for the HTOs for each sample (i.e.multiplexed) is output into cite-seq-count.dir/. These data can be used as input into HTODemux from Seurat in combination with cellranger count outputs for the corresponding GEX data.
+
+The umi_count and read_count matrices of each sample are also converted to
+sparse HDF5 files in the 10x layout (cite-seq-count.dir/<sample>/umi_count.h5
+and read_count.h5, see ocmsrnaseq/h5matrix.py) that can be read with
+ocmsrnaseq.h5matrix.H5Matrix or Seurat::Read10X_h5. They are written
+uncompressed unless matrix_compression is set, so that they are read through
+memory maps.
+
+
+Requirements
+------------
+
+
+Install CITE-seq-count:
+
+   pip install CITE-seq-count
+
+Alternatively set citeseqcount_engine to native in pipeline.yml to use the
+built in multiprocess counting engine, which writes the same outputs.
+
+Estimating cell numbers (citeseqcount_cells set to auto) and the native
+engine require numpy.
+
+
+Pipeline output
+===============
+
+
+Glossary
+========
+
+.. glossary::
+
+
+Code
+====
+
+"""
+import sys
+import os
+import collections
+import glob
+from pathlib import Path
+from ruffus import *
+from cgatcore import pipeline as P
+import ocmsrnaseq.scratch as scratch
+
+# load options from the config file
+PARAMS = P.get_parameters(
+    ["pipeline.yml"])
+
+#get all files within the directory to process
+SEQUENCEFILES = ("*.fastq.1.gz")
+
+SEQUENCEFILES_REGEX = regex(
+    r"(\S+).(fastq.1.gz)")
+
+scriptsdir = os.path.dirname(os.path.abspath(__file__)) + "/scripts"
+PARAMS["scriptsdir"] = scriptsdir
+
+# number of shards to count each library in
+SHARDS = int(PARAMS.get("citeseqcount_shards") or 1)
+
+
+def getCells(sample_name):
+    '''
+    return the number of cells and the whitelist (or None) to use
+    for a sample. If citeseqcount_cells is auto these come from
+    estimateCells
+    '''
+    ncells = PARAMS["citeseqcount_cells"]
+    if str(ncells) != "auto":
+        return ncells, None
+    whitelist = f"knee.dir/{sample_name}_whitelist.csv"
+    with open(whitelist) as inf:
+        ncells = len(inf.readlines())
+    return ncells, whitelist
+
+
+def getNativeOptions():
+    '''
+    return the command line options for citeseq_count.py
+    '''
+    return " ".join([
+        "--cbf=%s" % PARAMS["citeseqcount_cbf"],
+        "--cbl=%s" % PARAMS["citeseqcount_cbl"],
+        "--umif=%s" % PARAMS["citeseqcount_umif"],
+        "--umil=%s" % PARAMS["citeseqcount_umil"],
+        "--trim=%s" % PARAMS.get("citeseqcount_native_trim", 0),
+        "--max-error=%s" % PARAMS.get("citeseqcount_native_max_error", 2),
+        "--bc-collapsing-dist=%s" %
+        PARAMS.get("citeseqcount_native_bc_collapsing_dist", 1),
+        "--umi-collapsing-dist=%s" %
+        PARAMS.get("citeseqcount_native_umi_collapsing_dist", 2)])
+
+
+########################################################
+########################################################
+########################################################
+# create tag sets
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("tags.dir"))
+@split(PARAMS["citeseqcount_tag_file"], "tags.dir/*_tags.csv")
+def makeSampleTags(infile, outfiles):
+    '''create sample tag files
+    '''
+    sample2tags = collections.defaultdict(set)
+    for line in open(PARAMS["citeseqcount_tag_file"]).readlines():
+        data = line[:-1].split(",")
+        sample2tags[data[0]].add((data[1], data[2]))
+
+    for sample, tag_list in sample2tags.items():
+        outf = open("tags.dir/"+sample+"_tags.csv", "w")
+        for seq, name in tag_list:
+            outf.write(",".join([seq, name]) + "\n")
+        outf.close()
+
+########################################################
+########################################################
+########################################################
+# Estimate cell numbers
+########################################################
+########################################################
+########################################################
+
+@active_if(str(PARAMS["citeseqcount_cells"]) == "auto")
+@follows(mkdir("knee.dir"))
+@transform(SEQUENCEFILES,
+           SEQUENCEFILES_REGEX,
+           r"knee.dir/\1_whitelist.csv")
+def estimateCells(infile, outfile):
+    '''
+    estimate the number of cells from the inflection of the
+    barcode rank curve and write a whitelist of cell barcodes.
+    These are used by runCiteSeqCount if citeseqcount_cells is auto
+    and the task is skipped otherwise
+    '''
+    cbf = PARAMS["citeseqcount_cbf"]
+    cbl = PARAMS["citeseqcount_cbl"]
+    topk = PARAMS.get("citeseqcount_knee_topk", 100000)
+    max_reads = PARAMS.get("citeseqcount_knee_max_reads", 0)
+    min_count = PARAMS.get("citeseqcount_knee_min_count", 100)
+    summary = outfile.replace("_whitelist.csv", "_knee.tsv")
+
+    statement = '''python %(scriptsdir)s/citeseq_knee.py
+                   --fastq1=%(infile)s
+                   --cbf=%(cbf)s
+                   --cbl=%(cbl)s
+                   --topk=%(topk)s
+                   --max-reads=%(max_reads)s
+                   --min-count=%(min_count)s
+                   --whitelist=%(outfile)s
+                   --log=%(summary)s.log
+                   > %(summary)s
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Count large libraries in shards
+########################################################
+########################################################
+########################################################
+
+def generateShardJobs():
+    '''
+    yield a counting job for each shard of each library
+    '''
+    for infile in sorted(glob.glob(SEQUENCEFILES)):
+        sample_name = P.snip(infile, ".fastq.1.gz")
+        for shard in range(SHARDS):
+            yield (infile,
+                   "shards.dir/%s.shard_%04i.tsv.gz" % (sample_name, shard),
+                   sample_name,
+                   shard)
+
+
+@active_if(SHARDS > 1)
+@follows(mkdir("shards.dir"), makeSampleTags)
+@files(generateShardJobs)
+def countShards(infile, outfile, sample_name, shard):
+    '''
+    count (cell barcode, umi, tag) triples for one shard of a library
+    with the native counting engine. Each shard job reads the original
+    fastq files and counts every citeseqcount_shards-th block of reads,
+    skipping the others without parsing them, so no shard files are
+    written. Nothing is counted unless citeseqcount_shards is greater
+    than 1
+    '''
+    p1 = infile
+    p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+    tags = "tags.dir/"+sample_name+"_tags.csv"
+    nshards = SHARDS
+    job_threads = nthreads = PARAMS["citeseqcount_nthreads"]
+    native_options = getNativeOptions()
+
+    statement = '''python %(scriptsdir)s/citeseq_count.py
+                   --fastq1=%(p1)s
+                   --fastq2=%(p2)s
+                   --tags=%(tags)s
+                   %(native_options)s
+                   --threads=%(nthreads)s
+                   --shard=%(shard)s
+                   --nshards=%(nshards)s
+                   --counts-file=%(outfile)s
+                   --log=%(outfile)s.log
+                '''
+    P.run(statement)
+
+
+@follows(mkdir("cite-seq-count.dir"), estimateCells)
+@collate(countShards,
+         regex(r"shards.dir/(\S+).shard_\d+.tsv.gz"),
+         r"cite-seq-count.dir/\1/\1.log")
+def mergeShards(infiles, outfile):
+    '''
+    merge shard counts for a library and build the read_count and
+    umi_count matrices. Cells are selected and UMIs are collapsed
+    after merging so that UMIs split across shards are collapsed
+    '''
+    outdir = os.path.dirname(outfile)
+    sample_name = os.path.basename(outdir)
+    os.makedirs(outdir, exist_ok=True)
+    tags = "tags.dir/"+sample_name+"_tags.csv"
+
+    ncells, whitelist = getCells(sample_name)
+    whitelist_option = f"--whitelist={whitelist}" if whitelist else ""
+    job_threads = nthreads = PARAMS["citeseqcount_nthreads"]
+    native_options = getNativeOptions()
+    infiles = " ".join(sorted(infiles))
+
+    statement = '''python %(scriptsdir)s/citeseq_count.py
+                   --tags=%(tags)s
+                   --cells=%(ncells)s
+                   %(whitelist_option)s
+                   %(native_options)s
+                   --threads=%(nthreads)s
+                   --outdir=%(outdir)s
+                   --shard-counts %(infiles)s
+                   --log=%(outfile)s
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Run CITE-seq-count
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("cite-seq-count.dir"), makeSampleTags, estimateCells,
+         mergeShards)
+@transform(SEQUENCEFILES,
+           SEQUENCEFILES_REGEX,
+           r"cite-seq-count.dir/\1/\1.log")
+def runCiteSeqCount(infile, outfile):
+    '''HTO count infile using CITE-seq-count or, if
+    citeseqcount_engine is native, the built in counting engine.
+    Libraries already counted in shards by mergeShards are up to
+    date and are not rerun. If scratch_dir is set, counting runs in
+    node-local scratch space and only the final outputs are moved to
+    cite-seq-count.dir/<sample>/
+    '''
+
+    tags = PARAMS["citeseqcount_tag_file"]
+
+    # Note that at the moment I only deal with paired-end
+    # reads
+    p1 = infile
+    p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+    sample_name = P.snip(p1, ".fastq.1.gz")
+
+    # get tag seqs
+    tags = "tags.dir/"+sample_name+"_tags.csv"
+
+    # make sample directory
+    outdir = f"cite-seq-count.dir/{sample_name}"
+    os.makedirs(outdir, exist_ok=True)
+
+    cbf = PARAMS["citeseqcount_cbf"]
+    cbl = PARAMS["citeseqcount_cbl"]
+    umif = PARAMS["citeseqcount_umif"]
+    umil = PARAMS["citeseqcount_umil"]
+    nthreads = PARAMS["citeseqcount_nthreads"]
+
+    # add additional options
+    options = PARAMS["citeseqcount_options"]
+
+    # use the estimated cells rather than a fixed number
+    ncells, whitelist = getCells(sample_name)
+    if whitelist:
+        whitelist_option = f"--whitelist={whitelist}"
+        options = f"{options} -wl {whitelist}"
+    else:
+        whitelist_option = ""
+
+    scratch_dir = PARAMS.get("scratch_dir")
+    copy_inputs = PARAMS.get("scratch_stage_inputs")
+    inputs = [p1, p2]
+    workdir = outdir
+    if scratch_dir:
+        workdir = scratch.OUTDIR
+        if copy_inputs:
+            p1, p2 = [scratch.scratch_path(x) for x in inputs]
+
+    if PARAMS.get("citeseqcount_engine", "citeseqcount") == "native":
+        job_threads = nthreads
+        native_options = getNativeOptions()
+        statement = '''python %(scriptsdir)s/citeseq_count.py
+                       --fastq1=%(p1)s
+                       --fastq2=%(p2)s
+                       --tags=%(tags)s
+                       --cells=%(ncells)s
+                       %(whitelist_option)s
+                       %(native_options)s
+                       --threads=%(nthreads)s
+                       --outdir=%(workdir)s
+                       --log=%(workdir)s/%(sample_name)s.log
+                    '''
+    else:
+        statement = '''CITE-seq-Count
+                       -R1 %(p1)s
+                       -R2 %(p2)s
+                       -t %(tags)s 
+                       -cbf %(cbf)s
+                       -cbl %(cbl)s
+                       -umif %(umif)s
+                       -umil %(umil)s
+                       -cells %(ncells)s
+                       -T %(nthreads)s
+                       -o %(workdir)s 
+                       %(options)s > %(workdir)s/%(sample_name)s.log
+                    '''
+
+    if scratch_dir:
+        statement = scratch.wrap(statement, outdir, scratch_dir,
+                                 inputs=inputs if copy_inputs else (),
+                                 copy_inputs=copy_inputs,
+                                 last=sample_name + ".log")
+    P.run(statement)
+
+
+########################################################
+########################################################
+########################################################
+
+@transform(runCiteSeqCount,
+           regex(r"cite-seq-count.dir/(\S+)/(\S+).log"),
+           [r"cite-seq-count.dir/\1/umi_count.h5",
+            r"cite-seq-count.dir/\1/read_count.h5"])
+def convertMatrices(infile, outfiles):
+    '''
+    convert the umi_count and read_count matrices to sparse HDF5
+    (10x layout, see ocmsrnaseq/h5matrix.py) so that they can be read
+    without parsing text. Matrices are stored uncompressed (and memory
+    mapped when read) unless matrix_compression is set
+    '''
+    indir = os.path.dirname(infile)
+    umi_h5, read_h5 = outfiles
+    if PARAMS.get("matrix_compression"):
+        compression = ""
+    else:
+        compression = "--no-compression"
+
+    statement = '''python %(scriptsdir)s/mtx2h5.py
+                   --indir=%(indir)s/umi_count
+                   --outfile=%(umi_h5)s
+                   %(compression)s
+                   --log=%(umi_h5)s.log &&
+                   python %(scriptsdir)s/mtx2h5.py
+                   --indir=%(indir)s/read_count
+                   --outfile=%(read_h5)s
+                   %(compression)s
+                   --log=%(read_h5)s.log
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("run_report.dir"))
+@transform(runCiteSeqCount,
+           regex("cite-seq-count.dir/(\S+)/(\S+).log"),
+           r"run_report.dir/\2_run_report.tsv")
+def parseRunReport(infile, outfile):
+    '''
+       retrieves the percentage mapped from the run_report
+       yaml file
+    '''
+    report_dir = os.path.dirname(infile)
+    sample_name = P.snip(os.path.basename(infile), ".log") 
+    report_file = os.path.join(report_dir, "run_report.yaml")
+    statement = '''echo %(sample_name)s > %(outfile)s;
+                   cat %(report_file)s
+                   | sed -n 5p
+                   | sed 's/Percentage mapped: //g'
+                   >> %(outfile)s
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+
+@merge(parseRunReport, "run_report.dir/percentage_mapped.tsv")
+def mergeRunReports(infiles, outfile):
+    '''
+    merge percentage mapped from run reports
+    '''
+    infiles = " ".join(infiles)
+    statement = '''paste %(infiles)s > %(outfile)s;
+                '''
+    P.run(statement)
+
+
+# ---------------------------------------------------
+# Generic pipeline tasks
+@follows(mergeRunReports, convertMatrices)
+def full():
+    pass
+
+
+@follows(mkdir("report.dir"))
+def build_report():
+    '''build report
+    '''
+    report_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                            "pipeline_docs/Rmd/pipeline_cite-seq-count"))
+    report_file = os.path.join(report_dir, "cite_seq_count_report.Rmd")
+
+    statement ='''cd report.dir; 
+              cp %(report_file)s .;
+              Rscript -e "rmarkdown::render('cite_seq_count_report.Rmd', output_format='html_document')";
+              cd ../  
+              '''
+    P.run(statement)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    P.main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(P.main(sys.argv))    
@@ -1,10 +1,13 @@
 import sys
 import os
 import glob
-import configparser
+import shutil
 from pathlib import Path
 from ruffus import *
 from cgatcore import pipeline as P
+import cgatcore.experiment as E
+import ocmsrnaseq.geomx as geomx
+import ocmsrnaseq.scratch as scratch
 
 # load options from the config file
 PARAMS = P.get_parameters(
@@ -24,58 +27,169 @@ PARAMS["rscriptsdir"] = rscriptsdir
 ######################################################################
 ######################################################################
 
-@follows(mkdir("dcc.dir"))
-@transform("*L001*R1_001.fastq.gz", regex("(\S+)_L00[0-9]_R[0-9]_001.fastq.gz"), r"dcc.dir/\1.dcc")
-def runGeomx(infile, outfile):
+@follows(mkdir("geomx_manifest.dir"))
+@split("*.ini", "geomx_manifest.dir/aois/*.json")
+def buildManifest(infiles, outfiles):
     '''
+    scan the FASTQ directory and parse the ini file once, writing an
+    entry per AOI (its FASTQ files and configuration) that is read by
+    the jobs that process the AOI. Several ini files are combined
+    into geomx_manifest.dir/combined_config.ini first
     '''
-    job_memory = PARAMS["geomx_memory"]
-    job_threads = PARAMS["geomx_threads"]
+    for outfile in outfiles:
+        os.unlink(outfile)
+
+    index = None
+    ini = sorted(infiles)[0]
+    if len(infiles) > 1:
+        ini = "geomx_manifest.dir/combined_config.ini"
+        index = geomx.combine_inis(sorted(infiles), ini,
+                                   index="geomx_manifest.dir/aoi_index.json",
+                                   nthreads=min(len(infiles), 8))
+        E.info("combined %i ini files into %s" % (len(infiles), ini))
+
+    aois, missing = geomx.build_manifest(ini, "geomx_manifest.dir",
+                                         index=index)
+    E.info("%i AOIs with FASTQ files in %s" % (len(aois), ini))
+    if missing:
+        E.warn("%i AOIs in %s have no FASTQ files: %s" %
+               (len(missing), ini, ", ".join(missing)))
+
 
+def runGeomxSamples(sample_names, job_threads, job_memory, ini_threads):
+    '''
+    run geomxngspipeline once on the AOIs in sample_names and
+    move the per-AOI dcc files and summaries to dcc.dir. If
+    scratch_dir is set, geomxngspipeline runs in node-local scratch
+    space and only its outputs are copied back
+    '''
     options = PARAMS["geomx_options"]
-    outdir = os.path.abspath(os.path.dirname(outfile))
+    outdir = os.path.abspath("dcc.dir")
     if not options:
         options=""
 
-    # running each fastq separately so create a
-    # temp directory to store results
+    # create a temp directory to store results
     tmpdir = P.get_temp_dir(".")
 
-    # collate all files associated with the fastq R1
-    sample_name = infile.split("_")[0]
-    infiles = " ".join([os.path.abspath(x) for x in glob.glob(sample_name + "*")])
+    # collate all files associated with the AOIs from their
+    # manifest entries
+    entries = [geomx.read_entry("geomx_manifest.dir", x)
+               for x in sample_names]
+    infiles = " ".join([x for entry in entries for x in entry["fastqs"]])
 
-    ini = glob.glob("*.ini")[0]
+    # build a new config file restricted to the AOIs
+    geomx.write_entry_config("geomx_manifest.dir", entries,
+                             os.path.join(tmpdir, "config.ini"),
+                             threads=ini_threads)
 
-    # build a new config file per fastq set
-    # set threads as 1 to avoid console interaction
-    config = configparser.ConfigParser()
-    config.optionxform = str
-    config.read(ini)
-    config["Processing_v2"]["threads"] = "1"
-    aoi, value = sample_name, config["AOI_List"][sample_name]
-    config["AOI_List"] = {sample_name: value}
+    # build geomx statement
+    scratch_dir = PARAMS.get("scratch_dir")
+    if scratch_dir:
+        inputs = [x for entry in entries for x in entry["fastqs"]]
+        inputs.append(os.path.join(tmpdir, "config.ini"))
+        indir, workdir = scratch.INDIR, scratch.OUTDIR
+        statement = '''geomxngspipeline
+                       --in=%(indir)s
+                       --out=%(workdir)s
+                       --ini=%(indir)s/config.ini
+                       --check-illumina-naming=false
+                       --threads=%(job_threads)s
+                       %(options)s
+                    '''
+        statement = scratch.wrap(
+            statement, tmpdir, scratch_dir, inputs=inputs,
+            copy_inputs=PARAMS.get("scratch_stage_inputs"),
+            last="summary.txt")
+    else:
+        statement = '''cd %(tmpdir)s && ln -s %(infiles)s . && cd ../ &&
+                       geomxngspipeline
+                       --in=%(tmpdir)s
+                       --out=%(tmpdir)s
+                       --ini=%(tmpdir)s/config.ini
+                       --check-illumina-naming=false
+                       --threads=%(job_threads)s
+                       %(options)s &&
+                       rm -rf %(tmpdir)s/*.fastq.gz
+                    '''
 
-    # write out AOI config file
-    with open(os.path.join(tmpdir, "config.ini"), "w") as configfile:
-        config.write(configfile) 
+    # the temp directory is removed whether or not the run and the
+    # collection of its outputs succeed
+    try:
+        P.run(statement)
 
-    # build geomx statement
-    statement = '''cd %(tmpdir)s; ln -s %(infiles)s .; cd ../;
-                   geomxngspipeline
-                   --in=%(tmpdir)s
-                   --out=%(tmpdir)s
-                   --ini=%(tmpdir)s/config.ini
-                   --check-illumina-naming=false
-                   --threads=%(job_threads)s
-                   %(options)s;
-                   rm -rf %(tmpdir)s/config.ini;
-                   rm -rf %(tmpdir)s/*.fastq.gz;
-                   mv %(tmpdir)s/summary.txt dcc.dir/%(sample_name)s_summary.txt;
-                   mv %(tmpdir)s/* dcc.dir;
-                   rm -rf %(tmpdir)s
-                '''
-    P.run(statement)
+        if os.path.exists(os.path.join(tmpdir, "config.ini")):
+            os.unlink(os.path.join(tmpdir, "config.ini"))
+
+        # split the summary back into per-AOI summaries
+        geomx.split_summary(os.path.join(tmpdir, "summary.txt"),
+                            sample_names,
+                            [os.path.join(outdir, x + "_summary.txt")
+                             for x in sample_names])
+        os.unlink(os.path.join(tmpdir, "summary.txt"))
+        for x in os.listdir(tmpdir):
+            shutil.move(os.path.join(tmpdir, x), os.path.join(outdir, x))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@follows(mkdir("geomx_batch.dir"))
+@split(buildManifest, "geomx_batch.dir/batch_*.tsv")
+def batchAOIs(infiles, outfiles):
+    '''
+    group AOIs into batches of geomx_batch_size to be run by a single
+    geomxngspipeline invocation. Nothing is written if
+    geomx_batch_size is not greater than 1
+    '''
+    for outfile in outfiles:
+        os.unlink(outfile)
+
+    batch_size = int(PARAMS.get("geomx_batch_size") or 1)
+    if batch_size <= 1:
+        return
+
+    sample_names = sorted(P.snip(os.path.basename(x), ".json")
+                          for x in infiles)
+    for i in range(0, len(sample_names), batch_size):
+        outfile = "geomx_batch.dir/batch_%04i.tsv" % (i // batch_size + 1)
+        with open(outfile, "w") as outf:
+            for sample_name in sample_names[i:i + batch_size]:
+                outf.write(sample_name + "\n")
+
+
+@follows(mkdir("dcc.dir"))
+@transform(batchAOIs,
+           regex("geomx_batch.dir/(\S+).tsv"),
+           r"geomx_batch.dir/\1.done")
+def runGeomxBatch(infile, outfile):
+    '''
+    run geomxngspipeline on a batch of AOIs with a merged AOI_List.
+    The threads in the ini file match the threads of the job. dcc
+    and summary files are the same as those of runGeomx
+    '''
+    with open(infile) as inf:
+        sample_names = [line[:-1] for line in inf if line.strip()]
+
+    job_memory = PARAMS["geomx_memory"]
+    job_threads = PARAMS["geomx_threads"]
+    runGeomxSamples(sample_names, job_threads, job_memory, job_threads)
+    Path(outfile).touch()
+
+
+@follows(mkdir("dcc.dir"), runGeomxBatch)
+@transform(buildManifest,
+           regex("geomx_manifest.dir/aois/(\S+).json"),
+           r"dcc.dir/\1.dcc")
+def runGeomx(infile, outfile):
+    '''
+    run geomxngspipeline on a single AOI. AOIs already processed
+    by runGeomxBatch are up to date and are not rerun
+    '''
+    job_memory = PARAMS["geomx_memory"]
+    job_threads = PARAMS["geomx_threads"]
+
+    # set threads as 1 to avoid console interaction
+    sample_name = P.snip(os.path.basename(infile), ".json")
+    runGeomxSamples([sample_name], job_threads, job_memory, 1)
 
 ######################################################################
 ######################################################################
@@ -104,6 +218,35 @@ def mergeSummaries(infiles, outfile):
 ######################################################################
 ######################################################################
 
+@follows(mkdir("matrix.dir"))
+@merge([runGeomx,
+        PARAMS["annotation_file"],
+        PARAMS["pkc_file"]],
+        "matrix.dir/geomx_counts.h5")
+def buildCountMatrix(infiles, outfile):
+    '''
+    parse dcc files in parallel into a sparse probe x AOI count
+    matrix with probe annotations from the pkc file and AOI metadata
+    joined with the annotation file
+    '''
+    annotations = PARAMS["annotation_file"]
+    pkc_file = PARAMS["pkc_file"]
+    job_threads = PARAMS["matrix_threads"]
+    metadata = P.snip(outfile, ".h5") + "_aoi_metadata.tsv"
+
+    statement = '''python %(scriptsdir)s/dcc2matrix.py
+                   --dcc-dir=dcc.dir
+                   --pkc-file=%(pkc_file)s
+                   --annotation-file=%(annotations)s
+                   --threads=%(job_threads)s
+                   --outfile=%(outfile)s
+                   --log=%(outfile)s.log
+                   > %(metadata)s
+    '''
+    P.run(statement)
+
+
+@active_if(PARAMS.get("geomxset_build", 1))
 @follows(mkdir("NanoStringGeoMxSet.dir"))
 @merge([runGeomx,
         PARAMS["annotation_file"],
@@ -127,7 +270,7 @@ def buildNanoStringGeoMxSet(infiles, outfile):
 
 # ---------------------------------------------------
 # Generic pipeline tasks
-@follows(mergeSummaries, buildNanoStringGeoMxSet)
+@follows(mergeSummaries, buildCountMatrix, buildNanoStringGeoMxSet)
 def full():
     pass
 
@@ -37,11 +37,51 @@ Outputs
 
 The output from this pipeline is a Seurat object of demultiplexed data that can be found in demux.dir/.
 
+Before demultiplexing, the GEX and ADT matrices are streamed once to keep only
+the cell barcodes with at least filter_umi GEX UMIs that are also present in the
+ADT data. The reduced matrices are written to prefilter.dir/<sample_name>/{gex,adt}
+together with a summary of the number of barcodes kept, so that HTODemux never
+loads the full (raw) GEX matrix. The reduced matrices are then converted once to
+sparse HDF5 files in the 10x layout (prefilter.dir/<sample_name>/{gex,adt}.h5,
+see ocmsrnaseq/h5matrix.py) that are read by both engines (in R with
+Seurat::Read10X_h5) without parsing MatrixMarket text again. The files are
+written uncompressed unless matrix_compression is set, so that the native
+engine reads them through memory maps.
+
+Demultiplexing is performed by one of two engines, set with hto_demux_engine:
+
+* seurat - R/hto_demux.R builds a Seurat object and runs HTODemux, writing
+  hto_demux.dir/<sample_name>_hashtag.rds. With hto_demux_workers set, samples
+  are instead distributed over that many R sessions, each demultiplexing its
+  samples in turn so that R and Seurat are loaded once per session. A failing
+  sample does not stop the others and is rerun on its own afterwards
+* native - scripts/hto_demux.py runs the same algorithm (CLR normalisation,
+  k-medoids clustering and a negative binomial cutoff at positive_quantile per
+  HTO) on the HTO counts only, writing a per-cell call table to
+  hto_demux.dir/<sample_name>_calls.tsv.gz. This takes seconds and does not
+  touch the RNA assay.
+
+Both engines also write hto_demux.dir/<sample_name>_demux.h5 containing the
+per-cell calls and margins, GEX UMI counts, HTO counts and CLR values. The report
+reads only these files, once per sample.
+
+To choose filter and demultiplexing parameters, the sweep target
+(python pipeline_hto_demux.py make sweep) reads each sample once and evaluates
+every combination of the sweep_umi thresholds, sweep_positive_quantile values
+and sweep_hto_exclusions with the native engine. The rates of singlets,
+doublets and negatives per sample and setting are written to sweep.dir/sweep.tsv.
+
 Requirements
 ------------
 
 Seurat
 ggplot2
+rhdf5
+hdf5r
+Rtsne
+numpy
+scipy
+h5py
 
 
 Pipeline output
@@ -65,6 +105,7 @@ import glob
 from pathlib import Path
 from ruffus import *
 from cgatcore import pipeline as P
+import ocmsrnaseq.batching as batching
 
 # load options from the config file
 PARAMS = P.get_parameters(
@@ -108,37 +149,250 @@ def link_infiles(infile, outfiles):
 ############################################################
 ############################################################
 ############################################################
-@follows(mkdir("hto_demux.dir"))
-@transform(link_infiles, regex("linked_files.dir/(\S+)"), r"hto_demux.dir/\1_hashtag.Rds")
-def runHTODemux(infile, outfile):
+@follows(mkdir("prefilter.dir"))
+@transform(link_infiles, regex("linked_files.dir/(\S+)"), r"prefilter.dir/\1/\1_prefilter.tsv")
+def prefilterMatrices(infile, outfile):
     '''
-    run HTODemux from Seurat based on inputs from paths.map
+    stream the GEX matrix to keep barcodes passing the UMI filter that
+    are also in the ADT matrix and write reduced matrices for HTODemux
     '''
     gex_dir = infile + "/gex"
     adt_dir = infile + "/adt"
     outdir = os.path.dirname(outfile)
     umi_count = PARAMS["filter_umi"]
-    sample_name=os.path.basename(infile)
+
+    statement = '''python %(scriptsdir)s/hto_prefilter.py
+                   --gex-dir=%(gex_dir)s
+                   --adt-dir=%(adt_dir)s
+                   --filter-umi-count=%(umi_count)s
+                   --outdir=%(outdir)s
+                   --log=%(outfile)s.log
+                   > %(outfile)s
+                '''
+    P.run(statement)
+
+
+############################################################
+############################################################
+############################################################
+@transform(prefilterMatrices,
+           regex("prefilter.dir/(\S+)/\S+_prefilter.tsv"),
+           [r"prefilter.dir/\1/gex.h5", r"prefilter.dir/\1/adt.h5"])
+def convertMatrices(infile, outfiles):
+    '''
+    convert the prefiltered matrices to sparse HDF5 (10x layout) so
+    that later steps read them without parsing text. Matrices are
+    stored uncompressed (and memory mapped when read) unless
+    matrix_compression is set
+    '''
+    indir = os.path.dirname(infile)
+    gex_h5, adt_h5 = outfiles
+    csr = "--csr" if PARAMS.get("matrix_csr") else ""
+    if PARAMS.get("matrix_compression"):
+        compression = ""
+    else:
+        compression = "--no-compression"
+
+    statement = '''python %(scriptsdir)s/mtx2h5.py
+                   --indir=%(indir)s/gex
+                   --outfile=%(gex_h5)s
+                   %(csr)s
+                   %(compression)s
+                   --log=%(gex_h5)s.log &&
+                   python %(scriptsdir)s/mtx2h5.py
+                   --indir=%(indir)s/adt
+                   --outfile=%(adt_h5)s
+                   %(csr)s
+                   %(compression)s
+                   --log=%(adt_h5)s.log
+                '''
+    P.run(statement)
+
+
+############################################################
+############################################################
+############################################################
+def getHTODemuxOptions():
+    '''
+    return the hto_demux.R options shared by all samples
+    '''
+    umi_count = PARAMS["filter_umi"]
+    positive_quantile = PARAMS["hto_demux_positive_quantile"]
     filter_htos=PARAMS["filter_hto_list"]
     if not filter_htos:
         filter_hto_option = ""
     else:
         filter_hto_option = "--filter-htos=%(filter_htos)s" % locals()
 
+    return '''--filter-umi-count=%(umi_count)s
+              --positive-quantile=%(positive_quantile)s
+              %(filter_hto_option)s''' % locals()
+
+
+@active_if(PARAMS["hto_demux_engine"] == "seurat")
+@follows(mkdir("hto_demux_batch.dir"), convertMatrices)
+@split(prefilterMatrices, "hto_demux_batch.dir/batch_*.tsv")
+def batchHTODemux(infiles, outfiles):
+    '''
+    distribute samples over hto_demux_workers R sessions, balanced
+    by the number of cells kept by the prefilter. Nothing is written
+    if hto_demux_workers is 0
+    '''
+    for outfile in outfiles:
+        os.unlink(outfile)
+
+    nworkers = int(PARAMS.get("hto_demux_workers") or 0)
+    if nworkers <= 0:
+        return
+
+    ncells = {}
+    for infile in infiles:
+        with open(infile) as inf:
+            header = inf.readline()[:-1].split("\t")
+            ncells[infile] = int(inf.readline()[:-1].split("\t")[header.index("kept")])
+
+    batches = batching.pack(infiles, nworkers, ncells.get)
+    for i, batch in enumerate(batches):
+        outfile = "hto_demux_batch.dir/batch_%04i.tsv" % (i + 1)
+        with open(outfile, "w") as outf:
+            for infile in batch:
+                indir = os.path.dirname(infile)
+                outf.write("\t".join([os.path.basename(indir),
+                                       os.path.join(indir, "gex.h5"),
+                                       os.path.join(indir, "adt.h5")]) + "\n")
+
+
+@transform(batchHTODemux,
+           regex("hto_demux_batch.dir/(\S+).tsv"),
+           r"hto_demux_batch.dir/\1.status")
+def runHTODemuxBatch(infile, outfile):
+    '''
+    run HTODemux on a batch of samples in a single R session so that
+    R, Seurat and ggplot2 are loaded once. A failing sample is recorded
+    in the status file and does not stop the remaining samples; it is
+    rerun (and reported) by runHTODemux. Outputs are the same as those
+    of runHTODemux
+    '''
+    hto_demux_options = getHTODemuxOptions()
     statement = '''Rscript %(rscriptsdir)s/hto_demux.R
-                   --gex-dir=%(gex_dir)s
-                   --adt-dir=%(adt_dir)s
+                   --batch=%(infile)s
+                   --status=%(outfile)s
+                   --out-dir=hto_demux.dir
+                   %(hto_demux_options)s
+                '''
+    P.run(statement)
+
+
+@active_if(PARAMS["hto_demux_engine"] == "seurat")
+@follows(mkdir("hto_demux.dir"), runHTODemuxBatch)
+@transform(convertMatrices, regex("prefilter.dir/(\S+)/gex.h5"), r"hto_demux.dir/\1_hashtag.rds")
+def runHTODemux(infiles, outfile):
+    '''
+    run HTODemux from Seurat based on the prefiltered matrices. Samples
+    already demultiplexed by runHTODemuxBatch are up to date and are
+    not rerun
+    '''
+    gex_h5, adt_h5 = infiles
+    outdir = os.path.dirname(outfile)
+    sample_name=os.path.basename(os.path.dirname(gex_h5))
+    hto_demux_options = getHTODemuxOptions()
+
+    statement = '''Rscript %(rscriptsdir)s/hto_demux.R
+                   --gex-matrix=%(gex_h5)s
+                   --adt-matrix=%(adt_h5)s
                    --sample-name=%(sample_name)s
                    --out-dir=%(outdir)s
-                   --filter-umi-count=%(umi_count)s
+                   %(hto_demux_options)s
+                '''
+    P.run(statement)
+
+
+############################################################
+############################################################
+############################################################
+@active_if(PARAMS["hto_demux_engine"] == "native")
+@follows(mkdir("hto_demux.dir"))
+@transform(convertMatrices, regex("prefilter.dir/(\S+)/gex.h5"), r"hto_demux.dir/\1_calls.tsv.gz")
+def runHTODemuxNative(infiles, outfile):
+    '''
+    demultiplex the prefiltered HTO counts with the native engine
+    '''
+    gex_h5, adt_h5 = infiles
+    h5 = P.snip(outfile, "_calls.tsv.gz") + "_demux.h5"
+    positive_quantile = PARAMS["hto_demux_positive_quantile"]
+    filter_htos=PARAMS["filter_hto_list"]
+    if not filter_htos:
+        filter_hto_option = ""
+    else:
+        filter_hto_option = "--filter-htos=%(filter_htos)s" % locals()
+
+    statement = '''python %(scriptsdir)s/hto_demux.py
+                   --adt-matrix=%(adt_h5)s
+                   --gex-matrix=%(gex_h5)s
+                   --h5=%(h5)s
+                   --positive-quantile=%(positive_quantile)s
                    %(filter_hto_option)s
+                   --log=%(outfile)s.log
+                   | gzip > %(outfile)s
                 '''
     P.run(statement)
 
 
+############################################################
+############################################################
+############################################################
+@follows(mkdir("sweep.dir"))
+@transform(link_infiles, regex("linked_files.dir/(\S+)"), r"sweep.dir/\1_sweep.tsv")
+def sweepHTODemux(infile, outfile):
+    '''
+    demultiplex each sample with the native engine over the grid of
+    sweep_umi thresholds, sweep_positive_quantile values and
+    sweep_hto_exclusions. Both matrices are read once per sample
+    '''
+    gex_dir = infile + "/gex"
+    adt_dir = infile + "/adt"
+    sample_name = os.path.basename(infile)
+    umi_thresholds = PARAMS["sweep_umi"]
+    quantiles = PARAMS["sweep_positive_quantile"]
+    exclusions = PARAMS["sweep_hto_exclusions"] or ""
+    exclusion_options = " ".join(["--exclude-htos=%s" % x
+                                  for x in str(exclusions).split(";") if x])
+
+    statement = '''python %(scriptsdir)s/hto_demux_sweep.py
+                   --gex-dir=%(gex_dir)s
+                   --adt-dir=%(adt_dir)s
+                   --sample=%(sample_name)s
+                   --umi-thresholds=%(umi_thresholds)s
+                   --quantiles=%(quantiles)s
+                   %(exclusion_options)s
+                   --log=%(outfile)s.log
+                   > %(outfile)s
+                '''
+    P.run(statement)
+
+
+@merge(sweepHTODemux, "sweep.dir/sweep.tsv")
+def mergeSweep(infiles, outfile):
+    '''
+    combine the per-sample sweep tables
+    '''
+    with open(outfile, "w") as outf:
+        for i, infile in enumerate(sorted(infiles)):
+            with open(infile) as inf:
+                header = inf.readline()
+                if i == 0:
+                    outf.write(header)
+                outf.writelines(inf)
+
+
+@follows(mergeSweep)
+def sweep():
+    pass
+
+
 # ---------------------------------------------------
 # Generic pipeline tasks
-@follows(runHTODemux)
+@follows(runHTODemux, runHTODemuxNative)
 def full():
     pass
 
@@ -27,7 +27,19 @@ Default configuration files can be generated by executing:
 Input files
 -----------
 
-fastq files that are in the format .fastq.1.gz and .fastq.2.gz.
+fastq files that are in the format .fastq.1.gz and .fastq.2.gz. Samples
+without a .fastq.2.gz file are quantified as single-end.
+
+Before quantification the first reads of every sample are checked for
+consistent pairing and read names and read length is estimated. Results
+are in preflight.dir/manifest.tsv. Single-end samples use the fragment
+length prior in the preflight section of pipeline.yml.
+
+The library type (unstranded, fr or rf) of each sample is detected by
+pseudoaligning a subsample of reads in each mode. Detected library types
+are in strandedness.dir/strandedness.tsv and, depending on
+strandedness_mode, are either used for quantification or checked against
+kallisto_options.
 
 Requirements
 ------------
@@ -35,10 +47,34 @@ Requirements
 
 Requirements:
 
+* kallisto (>= 0.50 for batches)
+* bustools (for batches)
+* numpy
+* scipy
+* h5py
+
 
 Pipeline output
 ===============
 
+Per-sample kallisto outputs are written to kallisto.dir/<sample>/. If
+bootstraps were run, kallisto.dir/<sample>/<sample>_bootstrap_summary.tsv.gz
+holds the per-transcript mean and variance of est_counts across bootstraps.
+
+With kallisto_batch_size greater than 1, samples are quantified in batches
+(kallisto bus --batch, bustools count and kallisto quant-tcc) that write the
+same files per sample (<sample>_abundance.tsv, abundance.h5 and
+run_info.json) with transcript lengths from kallisto_transcripts_gtf and the
+effective lengths of each sample. Batches can not be bootstrapped, and
+run_info.json has no n_processed, p_pseudoaligned, n_unique or p_unique.
+Estimates are those of quant-tcc and may differ slightly from those of
+kallisto quant.
+
+quant.dir/kallisto_quant.h5 contains transcript (eff_length, est_counts,
+tpm) and gene (counts, abundance, length) x sample matrices. Gene level
+matrices are summarised as in tximport. The matrices can be loaded in
+python with :func:`ocmsrnaseq.kallisto.load_matrix` or in R with rhdf5.
+
 
 Glossary
 ========
@@ -53,9 +89,13 @@ Code
 import sys
 import os
 import glob
+import math
 from pathlib import Path
 from ruffus import *
 from cgatcore import pipeline as P
+import cgatcore.experiment as E
+import ocmsrnaseq.scratch as scratch
+import ocmsrnaseq.batching as batching
 
 # load options from the config file
 PARAMS = P.get_parameters(
@@ -70,46 +110,301 @@ SEQUENCEFILES_REGEX = regex(
 scriptsdir = os.path.dirname(os.path.abspath(__file__)) + "/scripts"
 PARAMS["scriptsdir"] = scriptsdir
 
-########################################################
-########################################################
-########################################################
-# Run kallisto
-########################################################
-########################################################
-########################################################
 
-@follows(mkdir("kallisto.dir"))
-@transform(SEQUENCEFILES, SEQUENCEFILES_REGEX, r"kallisto.dir/\1/\1_abundance.tsv")
-def runKallisto(infile, outfile):
-    '''classify reads with kraken2
+def getBootstraps(nsamples):
     '''
-    # Note that at the moment I only deal with paired-end
-    # reads properly
-    p1 = infile
-    p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+    return the number of bootstraps to run per sample. kallisto_bootstraps
+    can be an integer (including 0 to skip bootstrapping) or "auto". With
+    "auto" the total number of bootstraps across the run is kept at
+    roughly 1000, with between 10 and 100 per sample, as inferential
+    variance matters less when there are many biological replicates
+    '''
+    bootstraps = PARAMS.get("kallisto_bootstraps", 100)
+    if bootstraps is None:
+        return 0
+    if str(bootstraps).lower() == "auto":
+        return max(10, min(100, 1000 // max(nsamples, 1)))
+    return int(bootstraps)
 
-    # bit of a hack about
-    if not os.path.exists(p2):
-        p2 = "--single"
 
-    transcriptome = PARAMS.get("kallisto_transcriptome")
-    nthreads = PARAMS.get("kallisto_nthreads")
+BOOTSTRAPS = getBootstraps(len(glob.glob(SEQUENCEFILES)))
+
+
+def getFastqSize(infile):
+    '''
+    return the total size in bytes of the (compressed) fastq
+    files for the sample with read 1 in infile
+    '''
+    p2 = infile.replace(".fastq.1.gz", ".fastq.2.gz")
+    return sum(os.path.getsize(x) for x in (infile, p2) if os.path.exists(x))
+
+
+def getJobResources(infiles):
+    '''
+    return the number of threads and the memory per thread for
+    a kallisto job that quantifies infiles in turn.
+
+    If kallisto_nthreads is "auto" one thread is used for every
+    kallisto_gb_per_thread of compressed fastq in the largest sample,
+    up to kallisto_max_threads. If kallisto_job_mem is not set,
+    memory is estimated from the index size as kallisto holds the
+    index in memory (~2x its size on disk) plus 1G overhead; this
+    is divided by the number of threads as job_memory is per thread
+    '''
+    nthreads = PARAMS.get("kallisto_nthreads") or 1
+    if str(nthreads).lower() == "auto":
+        fastq_gb = max(getFastqSize(x) for x in infiles) / 1e9
+        gb_per_thread = float(PARAMS.get("kallisto_gb_per_thread") or 2)
+        max_threads = int(PARAMS.get("kallisto_max_threads") or 8)
+        nthreads = min(max_threads,
+                       max(1, int(math.ceil(fastq_gb / gb_per_thread))))
+    nthreads = int(nthreads)
+
     job_memory = PARAMS.get("kallisto_job_mem")
+    if not job_memory:
+        index_gb = os.path.getsize(PARAMS["kallisto_transcriptome"]) / 1e9
+        total_gb = 2 * index_gb + 1
+        job_memory = "%iG" % int(math.ceil(total_gb / nthreads))
+    return nthreads, job_memory
+
+
+def readPreflight(sample_name):
+    '''
+    return the preflight manifest entry for a sample as a dictionary
+    '''
+    with open("preflight.dir/%s.tsv" % sample_name) as inf:
+        header = inf.readline()[:-1].split("\t")
+        values = inf.readline()[:-1].split("\t")
+    return dict(zip(header, values))
+
+
+STRAND_OPTIONS = {"fr": "--fr-stranded",
+                  "rf": "--rf-stranded",
+                  "unstranded": ""}
+
+
+def getStrandOptions(sample_name, options):
+    '''
+    return kallisto options with the library type detected by
+    detectStrandedness. With strandedness_mode "auto" any stranded
+    option in kallisto_options is replaced by the detected one; with
+    "check" kallisto_options is used as is but a warning is given if it
+    disagrees with the detected library type; with "off" options
+    are returned unchanged
+    '''
+    mode = PARAMS.get("strandedness_mode", "auto")
+    if mode == "off":
+        return options
+
+    with open("strandedness.dir/%s.tsv" % sample_name) as inf:
+        header = inf.readline()[:-1].split("\t")
+        detected = dict(zip(header, inf.readline()[:-1].split("\t")))
+    detected = detected["library_type"]
+
+    configured = "unstranded"
+    for library_type, option in STRAND_OPTIONS.items():
+        if option and option in options.split():
+            configured = library_type
+
+    if configured != detected:
+        E.warn("%s: kallisto_options specify a %s library but %s was "
+               "detected%s" % (sample_name, configured, detected,
+                               " - using detected" if mode == "auto" else ""))
+
+    if mode == "auto":
+        options = " ".join([x for x in options.split()
+                            if x not in STRAND_OPTIONS.values()] +
+                           [STRAND_OPTIONS[detected]])
+    return options
+
+
+def getTempOption():
+    '''
+    return the mktemp option to create temporary directories in
+    scratch_dir if it is set
+    '''
+    scratch_dir = PARAMS.get("scratch_dir")
+    if scratch_dir:
+        return "-p %s" % scratch_dir
+    return ""
+
+
+def buildKallistoStatement(infile, transcriptome, nthreads):
+    '''
+    build the kallisto quant statement for a single sample. Outputs
+    are written to kallisto.dir/<sample>/. Single-end samples are
+    identified from the preflight manifest, which also provides the
+    fragment length prior that kallisto requires for them.
+
+    If scratch_dir is set, kallisto runs in node-local scratch space
+    and only its final outputs are moved to kallisto.dir/<sample>/
+    '''
+    p1 = infile
+    sample_name = P.snip(p1, ".fastq.1.gz")
+    preflight = readPreflight(sample_name)
+    scratch_dir = PARAMS.get("scratch_dir")
+    copy_inputs = PARAMS.get("scratch_stage_inputs")
+    outdir = "kallisto.dir/%s" % sample_name
+
+    inputs = [p1]
+    if preflight["layout"] == "paired":
+        p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+        inputs.append(p2)
+    else:
+        p2 = "--single -l %(fragment_length)s -s %(fragment_sd)s" % preflight
+
+    workdir = outdir
+    if scratch_dir:
+        workdir = scratch.OUTDIR
+        if copy_inputs:
+            p1 = scratch.scratch_path(p1)
+            if preflight["layout"] == "paired":
+                p2 = scratch.scratch_path(p2)
+
     options = PARAMS.get("kallisto_options")
     if options == None:
         options = ""
-    sample_name = P.snip(p1, ".fastq.1.gz")
+    options = getStrandOptions(sample_name, options)
+    bootstraps = BOOTSTRAPS
     statement = '''kallisto quant 
                    -i %(transcriptome)s 
-                   -o kallisto.dir/%(sample_name)s 
-                   -b 100
+                   -o %(workdir)s 
+                   -b %(bootstraps)s
+                   -t %(nthreads)s
                    %(options)s 
                    %(p1)s 
-                   %(p2)s;
-                   mv kallisto.dir/%(sample_name)s/abundance.tsv kallisto.dir/%(sample_name)s/%(sample_name)s_abundance.tsv
+                   %(p2)s &&
+                   mv %(workdir)s/abundance.tsv %(workdir)s/%(sample_name)s_abundance.tsv
+                ''' % locals()
+    if scratch_dir:
+        statement = scratch.wrap(statement, outdir, scratch_dir,
+                                 inputs=inputs if copy_inputs else (),
+                                 copy_inputs=copy_inputs,
+                                 last="%s_abundance.tsv" % sample_name)
+    return statement
+
+########################################################
+########################################################
+########################################################
+# Preflight checks of fastq files
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("preflight.dir"))
+@transform(SEQUENCEFILES, SEQUENCEFILES_REGEX, r"preflight.dir/\1.tsv")
+def checkFastqs(infile, outfile):
+    '''
+    scan the first reads of each sample to check pairing and read
+    names, detect single-end samples and estimate read length. These
+    are quick so are run locally rather than queued
+    '''
+    to_cluster = False
+    nreads = PARAMS.get("preflight_nreads", 10000)
+    fragment_length = PARAMS.get("preflight_fragment_length", 200)
+    fragment_sd = PARAMS.get("preflight_fragment_sd", 20)
+
+    statement = '''python %(scriptsdir)s/fastq_preflight.py
+                   --fastq1=%(infile)s
+                   --nreads=%(nreads)s
+                   --fragment-length=%(fragment_length)s
+                   --fragment-sd=%(fragment_sd)s
+                   --log=%(outfile)s.log
+                   > %(outfile)s
                 '''
     P.run(statement)
 
+
+@merge(checkFastqs, "preflight.dir/manifest.tsv")
+def buildFastqManifest(infiles, outfile):
+    '''
+    combine per-sample preflight results into a single manifest
+    '''
+    with open(outfile, "w") as outf:
+        for i, infile in enumerate(sorted(infiles)):
+            with open(infile) as inf:
+                lines = inf.readlines()
+            outf.writelines(lines if i == 0 else lines[1:])
+
+########################################################
+########################################################
+########################################################
+# Detect strandedness from a subsample of reads
+########################################################
+########################################################
+########################################################
+
+@active_if(PARAMS.get("strandedness_mode", "auto") != "off")
+@follows(mkdir("strandedness.dir"), buildFastqManifest)
+@transform(SEQUENCEFILES, SEQUENCEFILES_REGEX, r"strandedness.dir/\1.tsv")
+def detectStrandedness(infile, outfile):
+    '''
+    pseudoalign the first strandedness_nreads reads of a sample in
+    unstranded, fr and rf modes and compare the numbers of
+    pseudoaligned reads to infer the library type. The job has the
+    threads and memory of quantifying the sample as kallisto holds
+    the whole index in memory however few reads are aligned.
+    Skipped if strandedness_mode is off
+    '''
+    transcriptome = PARAMS.get("kallisto_transcriptome")
+    nreads = int(PARAMS.get("strandedness_nreads", 200000))
+    threshold = PARAMS.get("strandedness_threshold", 0.8)
+    nlines = 4 * nreads
+    job_threads, job_memory = getJobResources([infile])
+
+    sample_name = P.snip(infile, ".fastq.1.gz")
+    preflight = readPreflight(sample_name)
+
+    # zcat is killed by SIGPIPE when head exits, which would
+    # otherwise fail the statement under pipefail
+    if preflight["layout"] == "paired":
+        p2 = infile.replace(".fastq.1.gz", ".fastq.2.gz")
+        subsample = '''{ zcat %(infile)s || true; } | head -n %(nlines)s | gzip > $tmpdir/r1.fastq.gz &&
+                       { zcat %(p2)s || true; } | head -n %(nlines)s | gzip > $tmpdir/r2.fastq.gz'''
+        reads = "$tmpdir/r1.fastq.gz $tmpdir/r2.fastq.gz"
+    else:
+        subsample = '''{ zcat %(infile)s || true; } | head -n %(nlines)s | gzip > $tmpdir/r1.fastq.gz'''
+        reads = "--single -l %(fragment_length)s -s %(fragment_sd)s " \
+            "$tmpdir/r1.fastq.gz" % preflight
+    subsample = subsample % locals()
+
+    tmp_option = getTempOption()
+    statement = '''tmpdir=$(mktemp -d %(tmp_option)s) &&
+                   trap "rm -rf $tmpdir" EXIT &&
+                   %(subsample)s &&
+                   kallisto quant -i %(transcriptome)s -o $tmpdir/unstranded
+                       -t %(job_threads)s
+                       %(reads)s &&
+                   kallisto quant -i %(transcriptome)s -o $tmpdir/fr
+                       -t %(job_threads)s
+                       --fr-stranded %(reads)s &&
+                   kallisto quant -i %(transcriptome)s -o $tmpdir/rf
+                       -t %(job_threads)s
+                       --rf-stranded %(reads)s &&
+                   python %(scriptsdir)s/kallisto_strandedness.py
+                       --sample=%(sample_name)s
+                       --unstranded=$tmpdir/unstranded/run_info.json
+                       --fr=$tmpdir/fr/run_info.json
+                       --rf=$tmpdir/rf/run_info.json
+                       --threshold=%(threshold)s
+                       --log=%(outfile)s.log
+                       > %(outfile)s
+                '''
+    P.run(statement)
+
+
+@active_if(PARAMS.get("strandedness_mode", "auto") != "off")
+@merge(detectStrandedness, "strandedness.dir/strandedness.tsv")
+def mergeStrandedness(infiles, outfile):
+    '''
+    combine detected library types across samples
+    '''
+    with open(outfile, "w") as outf:
+        for i, infile in enumerate(sorted(infiles)):
+            with open(infile) as inf:
+                lines = inf.readlines()
+            outf.writelines(lines if i == 0 else lines[1:])
+
 ########################################################
 ########################################################
 ########################################################
@@ -123,20 +418,268 @@ def runKallisto(infile, outfile):
        "transcripts2genes.dir/transcripts2genes.tsv")
 def transcripts2genes(infile, outfile):
     '''
-    convert fasta file to tsv files containing transcript2gene
-    mapping
+    build transcript to gene, gene name and biotype tables
+    from the gtf file. Tables are cached by checksum of the gtf
+    so they are only rebuilt when the annotation changes
+    '''
+    cache_dir = PARAMS.get("kallisto_annotation_cache")
+    if cache_dir:
+        cache_option = "--cache-dir=%(cache_dir)s" % locals()
+    else:
+        cache_option = ""
+
+    outdir = os.path.dirname(outfile)
+    statement = '''python %(scriptsdir)s/gtf2annotations.py
+                   --gtf=%(infile)s
+                   --outdir=%(outdir)s
+                   %(cache_option)s
+                   --log=transcripts2genes.dir/transcripts2genes.log
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Run kallisto in batches
+########################################################
+########################################################
+########################################################
+
+def getBatchKey(infile):
+    '''
+    return the layout, library type and (for single-end samples)
+    fragment length prior of a sample. Samples in a batch are
+    quantified together and must share these
+    '''
+    sample_name = P.snip(infile, ".fastq.1.gz")
+    preflight = readPreflight(sample_name)
+    options = getStrandOptions(sample_name,
+                               PARAMS.get("kallisto_options") or "")
+    strand = [x for x in options.split() if x in STRAND_OPTIONS.values()]
+    key = (preflight["layout"], " ".join(strand))
+    if preflight["layout"] != "paired":
+        key += (preflight["fragment_length"], preflight["fragment_sd"])
+    return key
+
+
+def getBatchedSamples():
+    '''
+    return the samples of the batches quantified by runKallistoBatch
+    '''
+    samples = set()
+    for batch in glob.glob("kallisto_batch.dir/batch_*.tsv"):
+        if os.path.exists(P.snip(batch, ".tsv") + ".done"):
+            with open(batch) as inf:
+                samples.update(line[:-1] for line in inf if line.strip())
+    return samples
+
+
+@follows(mkdir("kallisto_batch.dir"), mkdir("kallisto.dir"),
+         buildFastqManifest, mergeStrandedness)
+@split(SEQUENCEFILES, "kallisto_batch.dir/batch_*.tsv")
+def batchSamples(infiles, outfiles):
+    '''
+    group samples with the same layout and library type into batches
+    of ~kallisto_batch_size samples balanced by read volume. Nothing
+    is written if kallisto_batch_size is not greater than 1. Batches
+    are quantified with quant-tcc, which does not bootstrap, so
+    kallisto_bootstraps must be 0 to use batches
+    '''
+    for outfile in outfiles:
+        os.unlink(outfile)
+
+    batch_size = int(PARAMS.get("kallisto_batch_size") or 1)
+    if batch_size <= 1:
+        return
+    if BOOTSTRAPS > 0:
+        raise ValueError(
+            "kallisto_batch_size is %i but batches can not be bootstrapped "
+            "- set kallisto_bootstraps to 0 to use batches or "
+            "kallisto_batch_size to 1 to bootstrap" % batch_size)
+
+    groups = {}
+    for infile in infiles:
+        groups.setdefault(getBatchKey(infile), []).append(infile)
+
+    # pack samples so that each batch has a similar volume of reads
+    n = 0
+    for key, group in sorted(groups.items()):
+        nbatches = int(math.ceil(len(group) / batch_size))
+        for batch in batching.pack(group, nbatches, getFastqSize):
+            n += 1
+            outfile = "kallisto_batch.dir/batch_%04i.tsv" % n
+            with open(outfile, "w") as outf:
+                for infile in batch:
+                    outf.write(infile + "\n")
+
+
+@follows(transcripts2genes)
+@transform(batchSamples,
+           regex("kallisto_batch.dir/(\S+).tsv"),
+           r"kallisto_batch.dir/\1.done")
+def runKallistoBatch(infile, outfile):
+    '''
+    quantify a batch of samples loading the index once. Reads of
+    all samples are pseudoaligned by a single kallisto bus --batch
+    run, counted per sample and equivalence class with bustools
+    and quantified with kallisto quant-tcc. The files written per
+    sample are those of runKallisto (see kallisto_tcc2abundance.py
+    for the differences) with transcript lengths from the gtf
+    '''
+    transcriptome = PARAMS.get("kallisto_transcriptome")
+    lengths = "transcripts2genes.dir/transcript_lengths.tsv"
+
+    with open(infile) as inf:
+        samples = [line[:-1] for line in inf.readlines()]
+    sample_names = [P.snip(x, ".fastq.1.gz") for x in samples]
+
+    batch_file = P.snip(outfile, ".done") + "_bus.txt"
+    with open(batch_file, "w") as outf:
+        for sample_name, p1 in zip(sample_names, samples):
+            p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+            fastqs = [os.path.abspath(x) for x in (p1, p2)
+                      if os.path.exists(x)]
+            outf.write("\t".join([sample_name] + fastqs) + "\n")
+
+    key = getBatchKey(samples[0])
+    strand = key[1]
+    if key[0] == "paired":
+        paired = "--paired"
+        fragments = "-f $tmpdir/bus/flens.txt"
+    else:
+        paired = ""
+        fragments = "-l %s -s %s" % key[2:]
+
+    job_threads, job_memory = getJobResources(samples)
+    sample_names = " ".join(sample_names)
+    tmp_option = getTempOption()
+    statement = '''tmpdir=$(mktemp -d %(tmp_option)s) &&
+                   trap "rm -rf $tmpdir" EXIT &&
+                   kallisto bus
+                       -i %(transcriptome)s
+                       -o $tmpdir/bus
+                       -x bulk
+                       -t %(job_threads)s
+                       --batch=%(batch_file)s
+                       %(paired)s
+                       %(strand)s &&
+                   awk -v OFS="\\t" '{print $1, $1}' $tmpdir/bus/transcripts.txt
+                       > $tmpdir/bus/t2t.txt &&
+                   bustools sort
+                       -t %(job_threads)s
+                       -T $tmpdir/sort
+                       -o $tmpdir/bus/output.s.bus
+                       $tmpdir/bus/output.bus &&
+                   bustools count
+                       --cm
+                       -o $tmpdir/bus/tcc
+                       -e $tmpdir/bus/matrix.ec
+                       -t $tmpdir/bus/transcripts.txt
+                       -g $tmpdir/bus/t2t.txt
+                       $tmpdir/bus/output.s.bus &&
+                   kallisto quant-tcc
+                       -t %(job_threads)s
+                       -i %(transcriptome)s
+                       -e $tmpdir/bus/tcc.ec.txt
+                       %(fragments)s
+                       -o $tmpdir/quant
+                       $tmpdir/bus/tcc.mtx &&
+                   python %(scriptsdir)s/kallisto_tcc2abundance.py
+                       --bus-dir=$tmpdir/bus
+                       --quant-dir=$tmpdir/quant
+                       --lengths=%(lengths)s
+                       --outdir=kallisto.dir
+                       --log=%(outfile)s.log
+                       %(sample_names)s &&
+                   touch %(outfile)s
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Run kallisto
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("kallisto.dir"), buildFastqManifest, mergeStrandedness,
+         runKallistoBatch)
+@transform(SEQUENCEFILES, SEQUENCEFILES_REGEX, r"kallisto.dir/\1/\1_abundance.tsv")
+def runKallisto(infile, outfile):
+    '''quantify reads with kallisto. Samples quantified by a
+    completed runKallistoBatch job are not rerun
+    '''
+    if infile in getBatchedSamples() and os.path.exists(outfile):
+        E.info("%s was quantified in a batch" % infile)
+        return
+
+    transcriptome = PARAMS.get("kallisto_transcriptome")
+    job_threads, job_memory = getJobResources([infile])
+    statement = buildKallistoStatement(infile, transcriptome, job_threads)
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Summarise bootstraps
+########################################################
+########################################################
+########################################################
+
+@active_if(BOOTSTRAPS > 0)
+@transform(runKallisto,
+           regex("kallisto.dir/(\S+)/(\S+)_abundance.tsv"),
+           r"kallisto.dir/\1/\2_bootstrap_summary.tsv.gz")
+def summariseBootstraps(infile, outfile):
+    '''
+    summarise bootstraps in abundance.h5 to per-transcript mean
+    and variance of est_counts. Bootstraps are read a chunk at a
+    time so the full bootstrap matrix is never held in memory.
+    Skipped if kallisto_bootstraps is 0
+    '''
+    h5file = os.path.join(os.path.dirname(infile), "abundance.h5")
+    chunksize = PARAMS.get("kallisto_bootstrap_chunksize", 10)
+
+    statement = '''python %(scriptsdir)s/kallisto_bootstraps.py
+                   --h5=%(h5file)s
+                   --chunksize=%(chunksize)s
+                   --log=%(outfile)s.log
+                   | gzip > %(outfile)s
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Aggregate abundances into transcript and gene matrices
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("quant.dir"), transcripts2genes)
+@merge(runKallisto, "quant.dir/kallisto_quant.h5")
+def aggregateAbundances(infiles, outfile):
+    '''
+    combine kallisto abundances across samples into
+    transcript and gene level matrices (tximport style)
     '''
-    statement = '''zcat %(infile)s | python %(scriptsdir)s/gtf2genes.py
-                                     --log=transcripts2genes.dir/transcripts2genes.log
-                                   | sort -k1,2
-                                   | uniq
-                                     > transcripts2genes.dir/transcripts2genes.tsv
+    tx2gene = "transcripts2genes.dir/transcripts2genes.tsv"
+    infiles = " ".join(infiles)
+    job_memory = PARAMS.get("kallisto_aggregate_mem", "4G")
+
+    statement = '''python %(scriptsdir)s/kallisto2matrix.py
+                   --tx2gene=%(tx2gene)s
+                   --outfile=%(outfile)s
+                   --log=%(outfile)s.log
+                   %(infiles)s
                 '''
     P.run(statement)
 
 # ---------------------------------------------------
 # Generic pipeline tasks
-@follows(runKallisto, transcripts2genes)
+@follows(runKallisto, transcripts2genes, aggregateAbundances,
+         summariseBootstraps)
 def full():
     pass
 
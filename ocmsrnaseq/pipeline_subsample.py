@@ -0,0 +1,172 @@
+"""===========================
+pipeline_subsample.py
+===========================
+
+Overview
+========
+
+This pipeline produces reproducibly subsampled fastq files for fast pilot
+runs, e.g. when tuning CITE-seq-count, kallisto or geomx parameters. Mate
+files are subsampled in sync and reads are streamed so that large files can
+be processed without holding reads in memory.
+
+The subsampled files keep their original names and are written to
+subsample.dir/ together with links to other pipeline inputs (tag files,
+.ini, .pkc files etc.). Any of the other pipelines can then be configured
+and run from within subsample.dir/, e.g.::
+
+    ocms_rnaseq subsample make full -v5 -p24
+    cd subsample.dir
+    ocms_rnaseq cite-seq-count config
+    ocms_rnaseq cite-seq-count make full -v5 -p24
+
+
+Usage
+=====
+
+See :ref:`PipelineSettingUp` and :ref:`PipelineRunning` on general
+information how to use cgat pipelines.
+
+Configuration
+-------------
+
+The pipeline requires a configured :file:`pipeline.yml` file.
+
+Default configuration files can be generated by executing:
+
+   python <srcdir>/pipeline_subsample.py config
+
+Input files
+-----------
+
+* fastq files in the format <sample>.fastq.1.gz and <sample>.fastq.2.gz
+  (pipeline_kallisto, pipeline_cite_seq_count)
+* fastq files in the format <sample>_L00N_R1_001.fastq.gz and
+  <sample>_L00N_R2_001.fastq.gz (pipeline_geomx). Each lane file is
+  subsampled separately.
+
+Either a fraction of reads or a fixed number of reads per file is kept.
+
+Requirements
+------------
+
+
+Pipeline output
+===============
+
+subsample.dir/ contains subsampled fastq files and links to other inputs.
+
+
+Glossary
+========
+
+.. glossary::
+
+
+Code
+====
+
+"""
+import sys
+import os
+import glob
+from ruffus import *
+from cgatcore import pipeline as P
+
+# load options from the config file
+PARAMS = P.get_parameters(
+    ["pipeline.yml"])
+
+# read 1 files for pipeline_kallisto/pipeline_cite_seq_count
+# and pipeline_geomx naming
+SEQUENCEFILES = ("*.fastq.1.gz", "*_R1_001.fastq.gz")
+
+SEQUENCEFILES_REGEX = regex(
+    r"(\S+)(\.fastq\.1\.gz|_R1_001\.fastq\.gz)")
+
+scriptsdir = os.path.dirname(os.path.abspath(__file__)) + "/scripts"
+PARAMS["scriptsdir"] = scriptsdir
+
+########################################################
+########################################################
+########################################################
+# Subsample fastq files
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("subsample.dir"))
+@transform(SEQUENCEFILES, SEQUENCEFILES_REGEX, r"subsample.dir/\1\2")
+def subsampleFastqs(infile, outfile):
+    '''
+    subsample read pairs keeping mates in sync
+    '''
+    fraction = PARAMS.get("subsample_fraction")
+    nreads = PARAMS.get("subsample_nreads")
+    seed = PARAMS.get("subsample_seed", 1)
+    if nreads:
+        sample_option = "--nreads=%(nreads)s" % locals()
+    elif fraction:
+        sample_option = "--fraction=%(fraction)s" % locals()
+    else:
+        raise ValueError("one of subsample_fraction or subsample_nreads "
+                         "must be set")
+
+    if infile.endswith(".fastq.1.gz"):
+        p2 = infile.replace(".fastq.1.gz", ".fastq.2.gz")
+    else:
+        p2 = infile.replace("_R1_001.fastq.gz", "_R2_001.fastq.gz")
+    outfile2 = os.path.join(os.path.dirname(outfile), os.path.basename(p2))
+
+    if os.path.exists(p2):
+        mate_options = "--fastq2=%(p2)s --outfile2=%(outfile2)s" % locals()
+    else:
+        mate_options = ""
+
+    statement = '''python %(scriptsdir)s/fastq_subsample.py
+                   --fastq1=%(infile)s
+                   --outfile1=%(outfile)s
+                   %(mate_options)s
+                   %(sample_option)s
+                   --seed=%(seed)s
+                   --log=%(outfile)s.log
+                '''
+    P.run(statement)
+
+########################################################
+########################################################
+########################################################
+# Link other inputs
+########################################################
+########################################################
+########################################################
+
+@follows(mkdir("subsample.dir"))
+def linkInputs():
+    '''
+    link files matching subsample_link into subsample.dir so that
+    pipelines can be run there
+    '''
+    patterns = PARAMS.get("subsample_link") or ""
+    for pattern in patterns.split(","):
+        for infile in glob.glob(pattern.strip()):
+            outfile = os.path.join("subsample.dir", os.path.basename(infile))
+            if not os.path.lexists(outfile):
+                os.symlink(os.path.abspath(infile), outfile)
+
+
+# ---------------------------------------------------
+# Generic pipeline tasks
+@follows(subsampleFastqs, linkInputs)
+def full():
+    pass
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    P.main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(P.main(sys.argv))    
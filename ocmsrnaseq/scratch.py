@@ -0,0 +1,70 @@
+'''
+scratch.py - run pipeline statements in node-local scratch space
+=================================================================
+
+Tools that write many intermediate files are slow on shared (Lustre,
+NFS) filesystems when many jobs run at once. :func:`wrap` turns a
+statement into one that is run in a directory created on node-local
+storage (e.g. /tmp, /dev/shm or $TMPDIR) when the job starts::
+
+    <scratch_dir>/ocmsrnaseq.XXXXXX/in    inputs (linked or copied)
+    <scratch_dir>/ocmsrnaseq.XXXXXX/out   outputs of the statement
+
+The statement writes its outputs to :data:`OUTDIR` and reads staged
+inputs from :data:`INDIR` (see :func:`scratch_path`). When the statement
+succeeds, the outputs are copied to a temporary directory in the final
+output directory and then renamed into place, so that incomplete
+outputs never appear under their final names. The file that marks the
+task as complete (*last*) is moved after all other outputs. The scratch
+directory is removed when the job exits, whether or not it succeeded.
+
+Statements are returned as a subshell so that several wrapped
+statements can be chained in a single job.
+
+'''
+
+import os
+
+# input and output directories of a wrapped statement
+INDIR = "$scratch/in"
+OUTDIR = "$scratch/out"
+
+
+def scratch_path(path):
+    '''return the path of an input staged to scratch by :func:`wrap`
+    '''
+    return os.path.join(INDIR, os.path.basename(path))
+
+
+def wrap(statement, outdir, scratch_dir, inputs=(), copy_inputs=False,
+         last=None):
+    '''return *statement* run in a scratch directory created in
+    *scratch_dir* with its outputs (written to :data:`OUTDIR`) moved
+    to *outdir*.
+
+    *inputs* are linked into the scratch directory or copied if
+    *copy_inputs* is set. *last* is the name of the output moved last.
+    '''
+    parts = ["scratch=$(mktemp -d -p %s ocmsrnaseq.XXXXXX)" % scratch_dir,
+             "copy=",
+             "trap 'rm -rf $scratch $copy' EXIT",
+             "trap 'exit 1' INT TERM",
+             "mkdir %s %s" % (INDIR, OUTDIR)]
+    for infile in inputs:
+        parts.append("%s %s %s/" % ("cp" if copy_inputs else "ln -s",
+                                    os.path.abspath(infile), INDIR))
+    parts.append("{ %s ; }" % statement.strip())
+
+    # copy back to the filesystem of outdir, then rename
+    parts += ["mkdir -p %s" % outdir,
+              "copy=$(mktemp -d -p %s .scratch.XXXXXX)" % outdir,
+              "cp -r $scratch/out/. $copy/"]
+    move = "rm -rf %(outdir)s/$f && mv $copy/$f %(outdir)s/ || exit 1" % \
+        locals()
+    if last is None:
+        parts.append("for f in $(ls -A $copy); do %s; done" % move)
+    else:
+        parts += ["for f in $(ls -A $copy); do "
+                  "if [ $f != %s ]; then %s; fi; done" % (last, move),
+                  "mv $copy/%s %s/" % (last, outdir)]
+    return "( %s )" % " && ".join(parts)
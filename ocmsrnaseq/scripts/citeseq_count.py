@@ -0,0 +1,201 @@
+'''
+citeseq_count.py
+==================
+
+:Tags: Python
+
+Purpose
+-------
+
+Count hashtag oligo (HTO) or antibody derived tags (ADT) per cell barcode
+from paired fastq files. This is a native, multiprocess alternative to
+CITE-seq-Count that writes the same read_count/umi_count matrix layout and
+run_report.yaml so that downstream steps (e.g. hto_demux.R) are unchanged.
+
+Read 1 contains the cell barcode (--cbf/--cbl) and UMI (--umif/--umil).
+Read 2 contains the tag sequence after --trim bases. Tags are matched
+allowing up to --max-error substitutions.
+
+Large libraries can be counted in shards: each shard is counted by a job
+run with --shard, --nshards and --counts-file that counts every
+--nshards-th block of --chunksize reads of the fastq files (all shards
+of a library must use the same --chunksize), and the matrices are then
+built by
+a final run with --shard-counts, which merges the shard counts before
+selecting cells and collapsing UMIs across shards.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python citeseq_count.py --fastq1=sample1.fastq.1.gz
+                           --fastq2=sample1.fastq.2.gz
+                           --tags=tags.dir/sample1_tags.csv
+                           --cbf=1 --cbl=16 --umif=17 --umil=26
+                           --cells=15000 --threads=8
+                           --outdir=cite-seq-count.dir/sample1
+
+Type::
+
+   python citeseq_count.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import time
+import cgatcore.experiment as E
+import ocmsrnaseq.citeseq as citeseq
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--fastq1", dest="fastq1", type=str,
+                        help="read 1 fastq file (cell barcode and UMI)")
+
+    parser.add_argument("--fastq2", dest="fastq2", type=str,
+                        help="read 2 fastq file (tag sequence)")
+
+    parser.add_argument("--tags", dest="tags", type=str,
+                        help="csv file of tag_sequence,tag_name")
+
+    parser.add_argument("--cbf", dest="cbf", type=int,
+                        help="first base of the cell barcode in read 1")
+
+    parser.add_argument("--cbl", dest="cbl", type=int,
+                        help="last base of the cell barcode in read 1")
+
+    parser.add_argument("--umif", dest="umif", type=int,
+                        help="first base of the UMI in read 1")
+
+    parser.add_argument("--umil", dest="umil", type=int,
+                        help="last base of the UMI in read 1")
+
+    parser.add_argument("--cells", dest="cells", type=int,
+                        help="number of cells to report")
+
+    parser.add_argument("--whitelist", dest="whitelist", type=str,
+                        help="file of cell barcodes to report, one per "
+                        "line. Overrides --cells")
+
+    parser.add_argument("--trim", dest="trim", type=int,
+                        help="number of bases to trim from the start "
+                        "of read 2")
+
+    parser.add_argument("--max-error", dest="max_error", type=int,
+                        help="maximum substitutions allowed when "
+                        "matching tags")
+
+    parser.add_argument("--bc-collapsing-dist", dest="bc_distance", type=int,
+                        help="distance for correcting cell barcodes "
+                        "(0 or 1)")
+
+    parser.add_argument("--umi-collapsing-dist", dest="umi_distance",
+                        type=int,
+                        help="distance for collapsing UMIs")
+
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="number of processes to use")
+
+    parser.add_argument("--chunksize", dest="chunksize", type=int,
+                        help="number of reads per chunk")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="output directory")
+
+    parser.add_argument("--shard", dest="shard", type=int,
+                        help="index of the shard of the library to count "
+                        "(0-based)")
+
+    parser.add_argument("--nshards", dest="nshards", type=int,
+                        help="number of shards the library is counted in")
+
+    parser.add_argument("--counts-file", dest="counts_file", type=str,
+                        help="write (cell barcode, umi, tag) counts to this "
+                        "file instead of building matrices. Used when "
+                        "counting shards")
+
+    parser.add_argument("--shard-counts", dest="shard_counts", type=str,
+                        nargs="+",
+                        help="build matrices from the merged counts of these "
+                        "shard count files instead of reading fastq files")
+
+    parser.set_defaults(cbf=1,
+                        cbl=16,
+                        umif=17,
+                        umil=26,
+                        cells=15000,
+                        trim=0,
+                        max_error=2,
+                        bc_distance=1,
+                        umi_distance=2,
+                        threads=1,
+                        chunksize=100000,
+                        shard=0,
+                        nshards=1)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    start_time = time.time()
+    tags = citeseq.load_tags(args.tags)
+
+    whitelist = None
+    if args.whitelist:
+        with open(args.whitelist) as inf:
+            whitelist = [line.strip().split(",")[0].split("-")[0]
+                         for line in inf if line.strip()]
+
+    if args.shard_counts:
+        E.info("merging counts from %i shards" % len(args.shard_counts))
+        counts = citeseq.read_counts(args.shard_counts)
+    else:
+        E.info("counting %i tags in %s (shard %i of %i)" %
+               (len(tags), args.fastq2, args.shard + 1, args.nshards))
+        counts = citeseq.count_reads(args.fastq1, args.fastq2, tags,
+                                     args.cbf, args.cbl, args.umif, args.umil,
+                                     trim=args.trim,
+                                     max_error=args.max_error,
+                                     nthreads=args.threads,
+                                     chunksize=args.chunksize,
+                                     shard=args.shard,
+                                     nshards=args.nshards)
+
+    if args.counts_file:
+        citeseq.write_counts(counts, args.counts_file)
+        E.stop()
+        return
+
+    result = citeseq.build_matrices(counts, tags, args.outdir,
+                                    args.cells,
+                                    whitelist=whitelist,
+                                    bc_distance=args.bc_distance,
+                                    umi_distance=args.umi_distance,
+                                    nthreads=args.threads,
+                                    start_time=start_time)
+
+    E.info("processed %(reads)i reads, %(mapped)i mapped, "
+           "%(cells)i cells" % result)
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,118 @@
+'''
+citeseq_knee.py
+=================
+
+:Tags: Python
+
+Purpose
+-------
+
+Estimate the number of cells in a HTO/ADT library from the barcode rank
+curve. Cell barcodes in read 1 are counted exactly in a single streaming
+pass (as compact integer codes, so memory depends on the number of
+distinct barcodes) and the number of cells is taken as the inflection of
+the log-log barcode rank curve of the top --topk barcodes.
+
+The barcodes of the estimated cells are written to --whitelist (one per
+line, suitable for CITE-seq-Count -wl) and a one row summary with the
+columns sample, reads, expected_cells is written to stdout.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python citeseq_knee.py --fastq1=sample1.fastq.1.gz
+                          --cbf=1 --cbl=16
+                          --whitelist=knee.dir/sample1_whitelist.csv
+
+Type::
+
+   python citeseq_knee.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.citeseq as citeseq
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--fastq1", dest="fastq1", type=str,
+                        help="read 1 fastq file")
+
+    parser.add_argument("--cbf", dest="cbf", type=int,
+                        help="first base of the cell barcode in read 1")
+
+    parser.add_argument("--cbl", dest="cbl", type=int,
+                        help="last base of the cell barcode in read 1")
+
+    parser.add_argument("--topk", dest="topk", type=int,
+                        help="number of barcodes with the most reads used for "
+                        "the barcode rank curve")
+
+    parser.add_argument("--max-reads", dest="max_reads", type=int,
+                        help="maximum number of reads to scan "
+                        "(0 for all)")
+
+    parser.add_argument("--min-count", dest="min_count", type=int,
+                        help="ignore barcodes with fewer reads when "
+                        "finding the inflection")
+
+    parser.add_argument("--whitelist", dest="whitelist", type=str,
+                        help="file to write cell barcodes to")
+
+    parser.set_defaults(cbf=1,
+                        cbl=16,
+                        topk=100000,
+                        max_reads=0,
+                        min_count=100)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    sample = os.path.basename(args.fastq1).replace(".fastq.1.gz", "")
+
+    counts, nreads = citeseq.count_barcodes(args.fastq1,
+                                            args.cbf,
+                                            args.cbl,
+                                            topk=args.topk,
+                                            max_reads=args.max_reads)
+    ncells = citeseq.find_knee(counts.values(), args.min_count)
+    if ncells >= args.topk:
+        E.warn("%s: estimated cells (%i) reached --topk; increase --topk" %
+               (sample, ncells))
+
+    ranked = sorted(counts.items(), key=lambda x: (-x[1], x[0]))[:ncells]
+    with open(args.whitelist, "w") as outf:
+        for barcode, count in ranked:
+            outf.write(barcode + "\n")
+
+    args.stdout.write("sample\treads\texpected_cells\n")
+    args.stdout.write("%s\t%i\t%i\n" % (sample, nreads, ncells))
+    E.info("%s: %i cells estimated from %i reads" % (sample, ncells, nreads))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
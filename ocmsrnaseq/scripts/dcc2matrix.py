@@ -0,0 +1,112 @@
+'''
+dcc2matrix.py
+===============
+
+:Tags: Python
+
+Purpose
+-------
+
+Build a sparse probe x AOI count matrix from the DCC files written by
+geomxngspipeline. DCC files are parsed in parallel and RTS ids are
+mapped to targets with an index built from the PKC files. The DCC
+attributes of each AOI are joined with the lab worksheet (on
+Sample_ID).
+
+The matrix and metadata are written to --outfile (HDF5, see
+ocmsrnaseq/geomx.py) and the AOI metadata is also written as a tab
+separated table to stdout.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python dcc2matrix.py --dcc-dir=dcc.dir
+                        --pkc-file=Hs_R_NGS_WTA_v1.0.pkc
+                        --annotation-file=All_LabWorksheet.txt
+                        --outfile=matrix.dir/geomx_counts.h5
+
+Type::
+
+   python dcc2matrix.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import glob
+import cgatcore.experiment as E
+import ocmsrnaseq.geomx as geomx
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--dcc-dir", dest="dcc_dir", type=str,
+                        help="directory containing .dcc files")
+
+    parser.add_argument("--pkc-file", dest="pkc_files", type=str,
+                        action="append",
+                        help=".pkc file. Can be given several times")
+
+    parser.add_argument("--annotation-file", dest="annotation_file",
+                        type=str,
+                        help="tab separated lab worksheet with a "
+                        "Sample_ID column")
+
+    parser.add_argument("--outfile", dest="outfile", type=str,
+                        help="HDF5 file to write")
+
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="number of processes to parse DCC files")
+
+    parser.set_defaults(pkc_files=[],
+                        threads=1)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    dcc_files = sorted(glob.glob(os.path.join(args.dcc_dir, "*.dcc")))
+    E.info("parsing %i dcc files" % len(dcc_files))
+
+    columns, metadata, unknown = geomx.build_count_matrix(
+        dcc_files, args.pkc_files, args.outfile,
+        worksheet=args.annotation_file,
+        nthreads=args.threads)
+
+    if unknown:
+        E.warn("%i counts for RTS ids not in %s" %
+               (unknown, ",".join(args.pkc_files)))
+
+    missing = [x for x, row in metadata.items()
+               if args.annotation_file and not row[columns.index("Sample_ID")]]
+    if missing:
+        E.warn("%i AOIs not found in %s: %s" %
+               (len(missing), args.annotation_file, ", ".join(missing)))
+
+    args.stdout.write("\t".join(["aoi"] + columns) + "\n")
+    for aoi, row in metadata.items():
+        args.stdout.write("\t".join([aoi] + row) + "\n")
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
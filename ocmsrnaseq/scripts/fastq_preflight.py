@@ -0,0 +1,123 @@
+'''
+fastq_preflight.py
+====================
+
+:Tags: Python
+
+Purpose
+-------
+
+Check a sample's fastq files before quantification. The first --nreads
+reads of <sample>.fastq.1.gz (and <sample>.fastq.2.gz if present) are
+streamed to check that the files are readable fastq, that mates are in
+sync and have matching read names, and to estimate read length.
+
+A one row manifest is written to stdout with the columns:
+
+* sample
+* layout - paired or single
+* nreads - number of reads scanned
+* read_length - mean read length of read 1
+* read_length_sd - standard deviation of read length
+* fragment_length - fragment length prior for single-end quantification
+* fragment_sd - standard deviation of the fragment length prior
+
+Fragment length cannot be observed from single-end reads, so the prior is
+taken from --fragment-length/--fragment-sd. For single-end libraries the
+prior is raised to at least the mean read length, as fragments cannot be
+shorter than the reads sequenced from them.
+
+The script exits with an error if the files are inconsistent.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python fastq_preflight.py --fastq1=sample1.fastq.1.gz
+
+Type::
+
+   python fastq_preflight.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.fastq as fastq
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--fastq1", dest="fastq1", type=str,
+                        help="read 1 fastq file (<sample>.fastq.1.gz)")
+
+    parser.add_argument("--nreads", dest="nreads", type=int,
+                        help="number of reads to scan")
+
+    parser.add_argument("--fragment-length", dest="fragment_length",
+                        type=float,
+                        help="fragment length prior for single-end data")
+
+    parser.add_argument("--fragment-sd", dest="fragment_sd", type=float,
+                        help="fragment length standard deviation prior "
+                        "for single-end data")
+
+    parser.set_defaults(nreads=10000,
+                        fragment_length=200,
+                        fragment_sd=20)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    p1 = args.fastq1
+    p2 = p1.replace(".fastq.1.gz", ".fastq.2.gz")
+    if not os.path.exists(p2):
+        p2 = None
+    sample = os.path.basename(p1).replace(".fastq.1.gz", "")
+
+    result = fastq.scan(p1, p2, args.nreads)
+
+    fragment_length, fragment_sd = args.fragment_length, args.fragment_sd
+    if result["layout"] == "single" and \
+       fragment_length < result["read_length"]:
+        E.warn("%s: fragment length prior %g is shorter than the mean read "
+               "length %.1f - using the read length" %
+               (sample, fragment_length, result["read_length"]))
+        fragment_length = round(result["read_length"])
+
+    args.stdout.write("\t".join(["sample", "layout", "nreads",
+                                 "read_length", "read_length_sd",
+                                 "fragment_length", "fragment_sd"]) + "\n")
+    args.stdout.write("%s\t%s\t%i\t%.1f\t%.1f\t%g\t%g\n" %
+                      (sample,
+                       result["layout"],
+                       result["nreads"],
+                       result["read_length"],
+                       result["read_length_sd"],
+                       fragment_length,
+                       fragment_sd))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
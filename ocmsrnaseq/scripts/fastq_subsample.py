@@ -0,0 +1,97 @@
+'''
+fastq_subsample.py
+====================
+
+:Tags: Python
+
+Purpose
+-------
+
+Reproducibly subsample reads from a gzipped fastq file or pair of mate
+files keeping mates in sync. Either a fraction of reads (--fraction) or an
+exact number of reads (--nreads) is kept. Reads are streamed so memory use
+does not depend on file size. The same --seed always gives the same reads.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python fastq_subsample.py --fastq1=sample1.fastq.1.gz
+                             --fastq2=sample1.fastq.2.gz
+                             --outfile1=subsample.dir/sample1.fastq.1.gz
+                             --outfile2=subsample.dir/sample1.fastq.2.gz
+                             --nreads=100000 --seed=1
+
+Type::
+
+   python fastq_subsample.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.fastq as fastq
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--fastq1", dest="fastq1", type=str,
+                        help="read 1 fastq file")
+
+    parser.add_argument("--fastq2", dest="fastq2", type=str,
+                        help="read 2 fastq file (optional)")
+
+    parser.add_argument("--outfile1", dest="outfile1", type=str,
+                        help="subsampled read 1 output file")
+
+    parser.add_argument("--outfile2", dest="outfile2", type=str,
+                        help="subsampled read 2 output file")
+
+    parser.add_argument("--fraction", dest="fraction", type=float,
+                        help="fraction of reads to keep")
+
+    parser.add_argument("--nreads", dest="nreads", type=int,
+                        help="number of reads to keep")
+
+    parser.add_argument("--seed", dest="seed", type=int,
+                        help="random seed")
+
+    parser.set_defaults(seed=1)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    infiles, outfiles = [args.fastq1], [args.outfile1]
+    if args.fastq2:
+        infiles.append(args.fastq2)
+        outfiles.append(args.outfile2)
+
+    written = fastq.subsample(infiles, outfiles,
+                              fraction=args.fraction,
+                              nreads=args.nreads,
+                              seed=args.seed)
+    E.info("wrote %i reads from %s" % (written, ", ".join(infiles)))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
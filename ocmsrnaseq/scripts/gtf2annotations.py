@@ -0,0 +1,95 @@
+'''
+gtf2annotations.py
+====================
+
+:Tags: Python
+
+Purpose
+-------
+
+Build transcript to gene, gene to name, biotype and transcript length
+tables from an ensembl gtf file in a single pass. This replaces gtf2genes.py and gtf2gene_names.py.
+
+Tables are cached under --cache-dir in a directory named after the checksum
+of the gtf file. If the same annotation has been indexed before (by this or
+any other project using the same cache) the tables are copied from the cache
+rather than rebuilt.
+
+The following tables are written to --outdir:
+
+* transcripts2genes.tsv - TXNAME GENEID (for use with tximport)
+* genes2names.tsv - gene_id gene_name
+* gene_biotypes.tsv - gene_id gene_biotype
+* transcript_biotypes.tsv - transcript_id transcript_biotype
+* transcript_lengths.tsv - transcript_id length (sum of exon lengths)
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python gtf2annotations.py --gtf=genes.gtf.gz --outdir=annotations.dir
+
+Type::
+
+   python gtf2annotations.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import shutil
+import cgatcore.experiment as E
+import ocmsrnaseq.annotation as annotation
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--gtf", dest="gtf", type=str,
+                        help="gtf file to build annotation tables from")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="directory to write annotation tables to")
+
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str,
+                        help="directory to cache annotation tables in")
+
+    parser.set_defaults(outdir=".",
+                        cache_dir=annotation.DEFAULT_CACHE)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    if not args.gtf:
+        raise ValueError("a gtf file must be specified with --gtf")
+
+    index_dir = annotation.cached_index(args.gtf, args.cache_dir)
+    E.info("using annotation index in %s" % index_dir)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    for table in annotation.TABLES:
+        shutil.copyfile(os.path.join(index_dir, table),
+                        os.path.join(args.outdir, table))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -53,7 +53,7 @@ def main(argv=None):
     (args) = E.start(parser, argv=argv)
 
     args.stdout.write("gene_id\tgene_name\n")
-    gene_ids = []
+    gene_ids = set()
     for gtf in GTF.iterator(args.stdin):
         gene_id = gtf.gene_id
         try:
@@ -64,7 +64,7 @@ def main(argv=None):
         if gene_id in gene_ids:
             continue
         else:
-            gene_ids.append(gene_id)
+            gene_ids.add(gene_id)
             args.stdout.write("\t".join([gene_id, gene_name]) + "\n")
 
     # write footer and output benchmark information.
@@ -0,0 +1,176 @@
+'''
+hto_demux.py
+==============
+
+:Tags: Python
+
+Purpose
+-------
+
+Demultiplex cells from the HTO counts of a CITE-seq-Count matrix
+using a native implementation of Seurat's HTODemux (CLR
+normalisation, k-medoids clustering and a negative binomial cutoff at
+--positive-quantile for each HTO).
+
+Only the HTO matrix is read, so the matrix should already be restricted
+to the cells to be demultiplexed (see hto_prefilter.py). Matrices can be
+given as 10x directories or as HDF5 files converted with mtx2h5.py.
+
+A table of per-cell calls with the columns barcode, HTO_maxID,
+HTO_secondID, HTO_margin, HTO_classification, HTO_classification.global
+and hash.ID is written to stdout. With --h5, the calls, HTO counts and
+CLR values are also written to a compact HDF5 file for reporting; the
+GEX UMI count of each cell (nCount_RNA) is added if --gex-matrix is given.
+
+With --reference, the calls are compared with those of the Seurat engine
+(the _demux.h5 file written by hto_demux.R for the same cells). The
+fraction of cells with the same call is reported for each column along
+with the largest difference of HTO_margin, and the script fails if fewer
+than --min-agreement of the cells have the same
+HTO_classification.global.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python hto_demux.py --adt-matrix=prefilter.dir/sample1/adt.h5
+                       --positive-quantile=0.99
+                       --filter-htos=HTO3,HTO7
+                       --gex-matrix=prefilter.dir/sample1/gex.h5
+                       --h5=hto_demux.dir/sample1_demux.h5
+
+Type::
+
+   python hto_demux.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import collections
+import numpy as np
+import cgatcore.experiment as E
+import ocmsrnaseq.mtx as mtx
+import ocmsrnaseq.h5matrix as h5matrix
+import ocmsrnaseq.htodemux as htodemux
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--adt-matrix", dest="adt_matrix", type=str,
+                        help="HTO matrix from CITE-seq-Count as a .h5 file "
+                        "or a matrix directory")
+
+    parser.add_argument("--filter-htos", dest="filter_htos", type=str,
+                        help="comma separated list of HTOs to remove")
+
+    parser.add_argument("--positive-quantile", dest="positive_quantile",
+                        type=float,
+                        help="quantile of the background distribution "
+                        "above which cells are positive for a HTO")
+
+    parser.add_argument("--samples", dest="samples", type=int,
+                        help="number of samples drawn for k-medoids "
+                        "clustering")
+
+    parser.add_argument("--seed", dest="seed", type=int,
+                        help="random seed for k-medoids clustering")
+
+    parser.add_argument("--gex-matrix", dest="gex_matrix", type=str,
+                        help="cellranger GEX matrix as a .h5 file or a "
+                        "matrix directory, used to report nCount_RNA in "
+                        "--h5")
+
+    parser.add_argument("--h5", dest="h5", type=str,
+                        help="write calls, HTO counts and CLR values to "
+                        "this HDF5 file")
+
+    parser.add_argument("--reference", dest="reference", type=str,
+                        help="_demux.h5 file from hto_demux.R to compare "
+                        "the calls with")
+
+    parser.add_argument("--min-agreement", dest="min_agreement", type=float,
+                        help="minimum fraction of cells with the same "
+                        "HTO_classification.global as --reference")
+
+    parser.set_defaults(filter_htos="",
+                        positive_quantile=0.99,
+                        samples=100,
+                        seed=1,
+                        min_agreement=0.95)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    exclude = [x for x in args.filter_htos.split(",") if x]
+    counts, htos, barcodes = htodemux.read_hto_matrix(args.adt_matrix,
+                                                      exclude=exclude)
+    E.info("demultiplexing %i cells with %i HTOs" % (len(barcodes),
+                                                      len(htos)))
+
+    result = htodemux.hto_demux(counts, htos,
+                                positive_quantile=args.positive_quantile,
+                                samples=args.samples,
+                                seed=args.seed)
+    htodemux.write_calls(args.stdout, barcodes, result)
+
+    if args.h5:
+        ncount_rna = None
+        if args.gex_matrix and args.gex_matrix.endswith(".h5"):
+            with h5matrix.H5Matrix(args.gex_matrix) as gex:
+                totals = gex.column_totals()
+                gex_barcodes = gex.barcodes
+        elif args.gex_matrix:
+            matrix, gex_barcodes, gex_features = \
+                mtx.matrix_files(args.gex_matrix)
+            totals, entries = mtx.column_totals(matrix)
+            gex_barcodes = mtx.read_lines(gex_barcodes)
+        if args.gex_matrix:
+            index = dict((x.split("-")[0], i)
+                         for i, x in enumerate(gex_barcodes))
+            ncount_rna = np.array([totals[index[x]] if x in index else np.nan
+                                   for x in barcodes])
+        htodemux.write_h5(args.h5, barcodes, htos, counts, result,
+                          ncount_rna=ncount_rna)
+
+    for hto, cutoff in zip(htos, result["cutoffs"]):
+        E.info("%s: cutoff %i" % (hto, cutoff))
+    E.info("classifications: %s" % dict(
+        collections.Counter(result["HTO_classification.global"])))
+
+    if args.reference:
+        comparison = htodemux.compare_calls(
+            barcodes, result, htodemux.read_calls(args.reference))
+        for column in htodemux.CALL_COLUMNS[1:]:
+            E.info("%s: %s %.4f on %i cells" % (
+                args.reference, column, comparison[column],
+                comparison["cells"]))
+        agreement = comparison["HTO_classification.global"]
+        if agreement < args.min_agreement:
+            raise ValueError(
+                "HTO_classification.global agrees with %s for %.4f of "
+                "cells, below --min-agreement=%.4f" %
+                (args.reference, agreement, args.min_agreement))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
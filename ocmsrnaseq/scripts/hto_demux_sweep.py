@@ -0,0 +1,148 @@
+'''
+hto_demux_sweep.py
+====================
+
+:Tags: Python
+
+Purpose
+-------
+
+Evaluate HTODemux settings for a sample in a single pass. The GEX
+(cellranger) matrix is streamed once to compute the UMI total of each
+barcode and the HTO (CITE-seq-Count) matrix is read once. Cells are
+then demultiplexed with the native engine (see hto_demux.py) for every
+combination of --umi-thresholds, --quantiles and --exclude-htos.
+
+Normalisation and clustering only depend on the cells and HTOs used,
+so they are computed once per UMI threshold and HTO exclusion and
+reused for all quantiles.
+
+A table with the columns sample, umi_threshold, excluded_htos,
+positive_quantile, cells, singlet, doublet, negative and the
+corresponding rates is written to stdout.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python hto_demux_sweep.py --gex-dir=linked_files.dir/sample1/gex
+                             --adt-dir=linked_files.dir/sample1/adt
+                             --sample=sample1
+                             --umi-thresholds=200,400,800
+                             --quantiles=0.95,0.99,0.999
+                             --exclude-htos=HTO3
+                             --exclude-htos=HTO3,HTO7
+
+Type::
+
+   python hto_demux_sweep.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import numpy as np
+import cgatcore.experiment as E
+import ocmsrnaseq.mtx as mtx
+import ocmsrnaseq.htodemux as htodemux
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--gex-dir", dest="gex_dir", type=str,
+                        help="directory containing cellranger matrices")
+
+    parser.add_argument("--adt-dir", dest="adt_dir", type=str,
+                        help="directory containing CITE-seq-Count matrices")
+
+    parser.add_argument("--sample", dest="sample", type=str,
+                        help="sample name for the output table")
+
+    parser.add_argument("--umi-thresholds", dest="umi_thresholds", type=str,
+                        help="comma separated list of minimum GEX UMI "
+                        "counts per cell")
+
+    parser.add_argument("--quantiles", dest="quantiles", type=str,
+                        help="comma separated list of positive quantiles")
+
+    parser.add_argument("--exclude-htos", dest="exclusions", type=str,
+                        action="append",
+                        help="comma separated set of HTOs to exclude. Can "
+                        "be given several times; no exclusion is always "
+                        "evaluated")
+
+    parser.add_argument("--samples", dest="samples", type=int,
+                        help="number of samples drawn for k-medoids "
+                        "clustering")
+
+    parser.add_argument("--seed", dest="seed", type=int,
+                        help="random seed for k-medoids clustering")
+
+    parser.set_defaults(sample="sample",
+                        umi_thresholds="400",
+                        quantiles="0.99",
+                        exclusions=[],
+                        samples=100,
+                        seed=1)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    umi_thresholds = [float(x) for x in args.umi_thresholds.split(",") if x]
+    quantiles = [float(x) for x in args.quantiles.split(",") if x]
+    exclusions = [()] + [tuple(x for x in y.split(",") if x)
+                         for y in args.exclusions if y]
+
+    counts, htos, barcodes = htodemux.read_hto_matrix(args.adt_dir)
+
+    # GEX totals of the HTO barcodes; barcodes missing from the
+    # GEX matrix never pass a threshold
+    gex_matrix, gex_barcodes, gex_features = mtx.matrix_files(args.gex_dir)
+    gex_totals, entries = mtx.column_totals(gex_matrix)
+    index = dict((x.split("-")[0], i)
+                 for i, x in enumerate(mtx.read_lines(gex_barcodes)))
+    totals = np.array([gex_totals[index[x]] if x in index else -1
+                       for x in barcodes])
+    E.info("%s: %i of %i HTO barcodes found in GEX" %
+           (args.sample, (totals >= 0).sum(), len(barcodes)))
+
+    args.stdout.write("\t".join(["sample", "umi_threshold", "excluded_htos",
+                                 "positive_quantile", "cells",
+                                 "singlet", "doublet", "negative",
+                                 "singlet_rate", "doublet_rate",
+                                 "negative_rate"]) + "\n")
+    for row in htodemux.sweep(counts, htos, barcodes, totals,
+                              umi_thresholds, quantiles, exclusions,
+                              samples=args.samples, seed=args.seed):
+        ncells = max(row["cells"], 1)
+        args.stdout.write("%s\t%g\t%s\t%g\t%i\t%i\t%i\t%i\t%.4f\t%.4f\t%.4f\n" %
+                          (args.sample, row["umi_threshold"],
+                           row["excluded_htos"] or "none",
+                           row["positive_quantile"], row["cells"],
+                           row["Singlet"], row["Doublet"], row["Negative"],
+                           row["Singlet"] / ncells,
+                           row["Doublet"] / ncells,
+                           row["Negative"] / ncells))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
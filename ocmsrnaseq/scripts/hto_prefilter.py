@@ -0,0 +1,118 @@
+'''
+hto_prefilter.py
+==================
+
+:Tags: Python
+
+Purpose
+-------
+
+Reduce the GEX (cellranger) and ADT (CITE-seq-Count) matrices of a
+multiplexed sample to the cell barcodes that hto_demux.R keeps, without
+loading either matrix into memory.
+
+The GEX matrix.mtx is streamed once to compute the UMI total of every
+barcode. Barcodes with at least --filter-umi-count UMIs that are also
+present in the ADT matrix (ignoring the -1 suffix of cellranger barcodes)
+are kept, and filtered copies of both matrices are written to
+<outdir>/gex and <outdir>/adt in the same 10x layout.
+
+A one row summary with the columns sample, gex_barcodes, passing_umi,
+adt_barcodes and kept is written to stdout.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python hto_prefilter.py --gex-dir=linked_files.dir/sample1/gex
+                           --adt-dir=linked_files.dir/sample1/adt
+                           --filter-umi-count=400
+                           --outdir=prefilter.dir/sample1
+
+Type::
+
+   python hto_prefilter.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import numpy as np
+import cgatcore.experiment as E
+import ocmsrnaseq.mtx as mtx
+
+
+def strip_suffix(barcode):
+    '''remove the -1 (gem group) suffix from a cellranger barcode
+    '''
+    return barcode.split("-")[0]
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--gex-dir", dest="gex_dir", type=str,
+                        help="directory containing cellranger matrices")
+
+    parser.add_argument("--adt-dir", dest="adt_dir", type=str,
+                        help="directory containing CITE-seq-Count matrices")
+
+    parser.add_argument("--filter-umi-count", dest="filter_umi_count",
+                        type=float,
+                        help="minimum number of GEX UMIs per barcode")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="directory to write filtered matrices to")
+
+    parser.set_defaults(filter_umi_count=0)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    gex_matrix, gex_barcodes, gex_features = mtx.matrix_files(args.gex_dir)
+    adt_matrix, adt_barcodes, adt_features = mtx.matrix_files(args.adt_dir)
+
+    totals, entries = mtx.column_totals(gex_matrix)
+    gex_barcodes = [strip_suffix(x) for x in mtx.read_lines(gex_barcodes)]
+    adt_barcodes = mtx.read_lines(adt_barcodes)
+    adt_set = set(adt_barcodes)
+
+    passing = totals >= args.filter_umi_count
+    keep_gex = passing & np.array([x in adt_set for x in gex_barcodes],
+                                  dtype=bool)
+    kept = set(x for x, k in zip(gex_barcodes, keep_gex) if k)
+    keep_adt = np.array([x in kept for x in adt_barcodes], dtype=bool)
+
+    mtx.filter_columns(args.gex_dir, os.path.join(args.outdir, "gex"),
+                       keep_gex, entries)
+    mtx.filter_columns(args.adt_dir, os.path.join(args.outdir, "adt"),
+                       keep_adt)
+
+    sample = os.path.basename(os.path.normpath(args.outdir))
+    args.stdout.write("sample\tgex_barcodes\tpassing_umi\tadt_barcodes\tkept\n")
+    args.stdout.write("%s\t%i\t%i\t%i\t%i\n" %
+                      (sample, len(gex_barcodes), passing.sum(),
+                       len(adt_barcodes), keep_gex.sum()))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,35 +1,98 @@
-# Combine multiple .ini files to run through geomxngspipeline
-# all together
+'''
+inis2ini.py
+=============
+
+:Tags: Python
+
+Purpose
+-------
+
+Combine multiple GeoMx DSP .ini files (e.g. one per slide) to run
+through geomxngspipeline all together.
+
+Files are parsed in parallel. All files must have the same [Targets]
+(i.e. transcript probes) and an AOI may only be listed in one file.
+The [AOI_List] sections are merged and all other sections are taken
+from the first file. The AOIs of the combined file are written to
+stdout with the file they were listed in. With --index, a JSON index of
+the AOIs is also written.
+
+pipeline_geomx combines the .ini files of the working directory
+itself, so this is only needed to run geomxngspipeline outside of the
+pipeline.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python inis2ini.py --outfile=combined_config.ini slide1.ini slide2.ini
+
+Type::
+
+   python inis2ini.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
 
 import sys
 import glob
-import configparser
+import cgatcore.experiment as E
+import ocmsrnaseq.geomx as geomx
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("inis", nargs="*", type=str,
+                        help=".ini files to combine (default: *.ini)")
+
+    parser.add_argument("--outfile", dest="outfile", type=str,
+                        help="combined .ini file to write")
+
+    parser.add_argument("--index", dest="index", type=str,
+                        help="write a JSON index of AOIs to this file")
+
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="number of files to parse in parallel")
+
+    parser.set_defaults(outfile="combined_config.ini",
+                        index=None,
+                        threads=4)
 
-inis_to_combine = glob.glob("*.ini")
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
 
-# create main .ini using 1st ini file as
-# template
-main_ini = configparser.ConfigParser()
-main_ini.optionxform = str 
-main_ini.read(inis_to_combine[0])
+    inis = args.inis or sorted(x for x in glob.glob("*.ini")
+                               if x != args.outfile)
+    if not inis:
+        raise ValueError("no .ini files to combine")
 
-# iterate over remaining .ini files
-# and add their information. Ensure [Targets]
-# are the same i.e. transcript probes
+    aois = geomx.combine_inis(inis, args.outfile, index=args.index,
+                              nthreads=args.threads)
+    E.info("combined %i AOIs from %i files" % (len(aois), len(inis)))
 
-target_targets = main_ini["Targets"].items()
-for ini in inis_to_combine[1:]:
-    config = configparser.ConfigParser()
-    config.optionxform = str 
-    config.read(ini)
-    targets = config["Targets"].items()
+    args.stdout.write("aoi\tini\n")
+    for aoi, entry in aois.items():
+        args.stdout.write("%s\t%s\n" % (aoi, entry["ini"]))
 
-    if not bool(set(targets).intersection(set(target_targets))):
-        raise ValueError("targets in files do not match")
+    # write footer and output benchmark information.
+    E.stop()
 
-    # only need to update the AOI_List
-    main_ini["AOI_List"] = {**main_ini["AOI_List"], **config["AOI_List"]}
 
-with open("combined_config.ini", "w") as configfile:
-    main_ini.write(configfile)
-                
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+'''
+kallisto2matrix.py
+====================
+
+:Tags: Python
+
+Purpose
+-------
+
+Combine kallisto abundance files (<sample>_abundance.tsv) into transcript
+and gene level count, tpm and length matrices stored in a compressed hdf5
+file. Gene level summaries are computed as in tximport and replace the need
+to re-read every abundance file in R.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python kallisto2matrix.py --tx2gene=transcripts2genes.tsv
+                             --outfile=kallisto_quant.h5
+                             kallisto.dir/*/*_abundance.tsv
+
+Type::
+
+   python kallisto2matrix.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.kallisto as kallisto
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--tx2gene", dest="tx2gene", type=str,
+                        help="transcripts2genes.tsv mapping transcripts to genes")
+
+    parser.add_argument("--outfile", dest="outfile", type=str,
+                        help="hdf5 file to write matrices to")
+
+    parser.add_argument("infiles", nargs="+",
+                        help="kallisto <sample>_abundance.tsv files")
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    infiles = sorted(args.infiles)
+    samples = [os.path.basename(x).replace("_abundance.tsv", "")
+               for x in infiles]
+
+    unmapped = kallisto.aggregate_abundances(infiles,
+                                             samples,
+                                             args.tx2gene,
+                                             args.outfile)
+    E.info("aggregated %i samples into %s" % (len(samples), args.outfile))
+    if unmapped:
+        E.warn("%i transcripts were not found in %s and are excluded "
+               "from gene level matrices" % (unmapped, args.tx2gene))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,81 @@
+'''
+kallisto_bootstraps.py
+========================
+
+:Tags: Python
+
+Purpose
+-------
+
+Summarise the bootstraps stored in a kallisto abundance.h5 file as the
+per-transcript mean and variance of est_counts. Bootstraps are read in
+chunks so that memory use does not grow with the number of bootstraps.
+
+Output is a tab separated table with columns target_id, est_counts,
+bootstrap_mean and bootstrap_var written to stdout.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python kallisto_bootstraps.py --h5=kallisto.dir/sample1/abundance.h5
+
+Type::
+
+   python kallisto_bootstraps.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.kallisto as kallisto
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--h5", dest="h5", type=str,
+                        help="kallisto abundance.h5 file")
+
+    parser.add_argument("--chunksize", dest="chunksize", type=int,
+                        help="number of bootstraps to read at a time")
+
+    parser.set_defaults(chunksize=10)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    transcripts, est_counts, mean, variance, nbootstraps = \
+        kallisto.summarise_bootstraps(args.h5, args.chunksize)
+
+    if nbootstraps == 0:
+        E.warn("no bootstraps found in %s" % args.h5)
+    else:
+        E.info("summarised %i bootstraps" % nbootstraps)
+
+    args.stdout.write("target_id\test_counts\tbootstrap_mean\tbootstrap_var\n")
+    for row in zip(transcripts, est_counts, mean, variance):
+        args.stdout.write("%s\t%.6f\t%.6f\t%.6f\n" % row)
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
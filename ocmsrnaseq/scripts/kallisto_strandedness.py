@@ -0,0 +1,131 @@
+'''
+kallisto_strandedness.py
+==========================
+
+:Tags: Python
+
+Purpose
+-------
+
+Infer the library type of a sample from kallisto run_info.json files
+produced by quantifying the same read subsample in unstranded, --fr-stranded
+and --rf-stranded modes.
+
+For a stranded library the number of pseudoaligned reads in the correct
+stranded mode is close to the unstranded number while the opposite mode
+loses most reads. For an unstranded library both stranded modes lose about
+half of the reads.
+
+A one row table is written to stdout with the columns sample,
+unstranded, fr, rf (numbers of pseudoaligned reads), fr_fraction,
+rf_fraction (relative to unstranded) and library_type (fr, rf or
+unstranded).
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python kallisto_strandedness.py --sample=sample1
+                                   --unstranded=un/run_info.json
+                                   --fr=fr/run_info.json
+                                   --rf=rf/run_info.json
+
+Type::
+
+   python kallisto_strandedness.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import json
+import cgatcore.experiment as E
+
+
+def pseudoaligned(run_info):
+    '''return the number of pseudoaligned reads in a run_info.json
+    '''
+    with open(run_info) as inf:
+        return json.load(inf)["n_pseudoaligned"]
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--sample", dest="sample", type=str,
+                        help="sample name")
+
+    parser.add_argument("--unstranded", dest="unstranded", type=str,
+                        help="run_info.json from unstranded quantification")
+
+    parser.add_argument("--fr", dest="fr", type=str,
+                        help="run_info.json from --fr-stranded "
+                        "quantification")
+
+    parser.add_argument("--rf", dest="rf", type=str,
+                        help="run_info.json from --rf-stranded "
+                        "quantification")
+
+    parser.add_argument("--threshold", dest="threshold", type=float,
+                        help="minimum fraction of unstranded pseudoaligned "
+                        "reads retained in a stranded mode to call the "
+                        "library stranded")
+
+    parser.set_defaults(threshold=0.8)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    unstranded = pseudoaligned(args.unstranded)
+    fr = pseudoaligned(args.fr)
+    rf = pseudoaligned(args.rf)
+
+    if unstranded == 0:
+        E.warn("%s: no reads pseudoaligned in the subsample - assuming "
+               "unstranded" % args.sample)
+        fr_fraction = rf_fraction = 0
+    else:
+        fr_fraction = fr / unstranded
+        rf_fraction = rf / unstranded
+
+    if fr_fraction >= args.threshold:
+        library_type = "fr"
+    elif rf_fraction >= args.threshold:
+        library_type = "rf"
+    else:
+        library_type = "unstranded"
+        # unstranded libraries retain about half of the reads in each
+        # stranded mode, warn if closer to the threshold than to that
+        if max(fr_fraction, rf_fraction) > (0.5 + args.threshold) / 2:
+            E.warn("%s: ambiguous strandedness (fr=%.2f, rf=%.2f) - "
+                   "assuming unstranded" %
+                   (args.sample, fr_fraction, rf_fraction))
+
+    args.stdout.write("\t".join(["sample", "unstranded", "fr", "rf",
+                                 "fr_fraction", "rf_fraction",
+                                 "library_type"]) + "\n")
+    args.stdout.write("%s\t%i\t%i\t%i\t%.3f\t%.3f\t%s\n" %
+                      (args.sample, unstranded, fr, rf,
+                       fr_fraction, rf_fraction, library_type))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
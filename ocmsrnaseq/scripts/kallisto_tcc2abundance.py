@@ -0,0 +1,157 @@
+'''
+kallisto_tcc2abundance.py
+===========================
+
+:Tags: Python
+
+Purpose
+-------
+
+Write per-sample abundance files from a batch of samples quantified
+with a single kallisto bus --batch run followed by bustools count and
+kallisto quant-tcc, so that the index is loaded once for the batch.
+
+Samples are given in the order of the kallisto bus batch file, which
+is the order encoded in the barcodes. For each sample the files of
+kallisto quant are written to <outdir>/<sample>/:
+
+* <sample>_abundance.tsv - target_id, length, eff_length, est_counts
+  and tpm, with numbers formatted as by kallisto quant
+* abundance.h5 - the same values in the kallisto layout, without
+  bootstraps
+* run_info.json - n_targets, n_bootstraps, n_pseudoaligned and the
+  version and call of the kallisto bus run
+
+Transcript lengths are not part of the quant-tcc output and are read
+from --lengths (transcript_lengths.tsv from gtf2annotations.py built
+from the gtf of the index). Effective lengths are those of each sample.
+The numbers of processed and uniquely pseudoaligned reads of a sample
+are not known from a batch run, so run_info.json has no n_processed,
+p_pseudoaligned, n_unique or p_unique.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python kallisto_tcc2abundance.py --bus-dir=bus --quant-dir=quant
+                                    --lengths=transcript_lengths.tsv
+                                    --outdir=kallisto.dir
+                                    sample1 sample2
+
+Type::
+
+   python kallisto_tcc2abundance.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import json
+import cgatcore.experiment as E
+import ocmsrnaseq.annotation as annotation
+import ocmsrnaseq.kallisto as kallisto
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("samples", nargs="+", type=str,
+                        help="samples in the order of the batch file")
+
+    parser.add_argument("--bus-dir", dest="bus_dir", type=str,
+                        help="directory with the kallisto bus output "
+                        "(transcripts.txt) and bustools count output "
+                        "(tcc.barcodes.txt)")
+
+    parser.add_argument("--quant-dir", dest="quant_dir", type=str,
+                        help="directory with the kallisto quant-tcc output")
+
+    parser.add_argument("--lengths", dest="lengths", type=str,
+                        help="table of transcript lengths (transcript_id, "
+                        "length)")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="directory to write per-sample directories to")
+
+    parser.set_defaults(outdir="kallisto.dir")
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    with open(os.path.join(args.bus_dir, "transcripts.txt")) as inf:
+        transcripts = [line.rstrip("\n") for line in inf]
+    with open(os.path.join(args.bus_dir, "tcc.barcodes.txt")) as inf:
+        barcodes = [line.rstrip("\n") for line in inf]
+
+    if not args.lengths:
+        raise ValueError("transcript lengths must be given with --lengths")
+    lengths = annotation.read_lengths(args.lengths)
+    missing = [x for x in transcripts if x not in lengths]
+    if missing:
+        raise ValueError(
+            "%i of %i transcripts of the index are not in %s, e.g. %s - "
+            "was the index built from the same annotation?" %
+            (len(missing), len(transcripts), args.lengths, missing[0]))
+    lengths = [lengths[x] for x in transcripts]
+
+    run_info = {}
+    if os.path.exists(os.path.join(args.bus_dir, "run_info.json")):
+        with open(os.path.join(args.bus_dir, "run_info.json")) as inf:
+            run_info = json.load(inf)
+
+    values = kallisto.split_tcc_quant(
+        os.path.join(args.quant_dir, "matrix.abundance.mtx"),
+        os.path.join(args.quant_dir, "matrix.efflens.mtx"),
+        barcodes, len(args.samples))
+
+    for sample, sample_values in zip(args.samples, values):
+        outdir = os.path.join(args.outdir, sample)
+        os.makedirs(outdir, exist_ok=True)
+        kallisto.write_abundance_h5(
+            os.path.join(outdir, "abundance.h5"),
+            transcripts, lengths, sample_values, run_info=run_info)
+        sample_info = {"n_targets": len(transcripts),
+                       "n_bootstraps": 0,
+                       "n_pseudoaligned": int(round(
+                           sample_values[:, 1].sum()))}
+        for key in ("kallisto_version", "index_version", "start_time",
+                    "call"):
+            if key in run_info:
+                sample_info[key] = run_info[key]
+        with open(os.path.join(outdir, "run_info.json"), "w") as outf:
+            json.dump(sample_info, outf, indent=1)
+            outf.write("\n")
+        # the abundance file is written last as it marks the sample as
+        # quantified
+        kallisto.write_abundance(
+            os.path.join(outdir, sample + "_abundance.tsv"),
+            transcripts, lengths, sample_values)
+        E.info("%s: %i reads pseudoaligned" % (sample,
+                                                sample_values[:, 1].sum()))
+
+    missing = len(args.samples) - len(barcodes)
+    if missing:
+        E.warn("%i samples have no pseudoaligned reads" % missing)
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
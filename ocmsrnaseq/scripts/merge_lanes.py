@@ -0,0 +1,120 @@
+'''
+merge_lanes.py
+================
+
+:Tags: Python
+
+Purpose
+-------
+
+Merge FASTQ files split across lanes into one file per read and sample
+(<sample>.fastq.1.gz, <sample>.fastq.2.gz) as expected by
+pipeline_kallisto and pipeline_cite_seq_count.
+
+Input files are named <sample>[_S<n>]_L<lane>_R<read>_001.fastq.gz (as
+staged by stage_fastqs.py or written by bcl2fastq) or follow the
+Novogene naming (<sample>_..._L<lane>_<read>.fq.gz). Lanes are joined
+in lane order by concatenating their gzip members byte for byte, so
+nothing is recompressed and merging is limited by I/O rather than CPU.
+Samples are merged in parallel.
+
+Reads of each lane are counted as the lane is copied and the number of
+reads is checked to be the same for read 1 and read 2 of each lane. A
+table of sample, read, lane file and number of reads is written to
+stdout. Use --no-verify to copy without counting. Samples whose output
+files exist are skipped.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python merge_lanes.py --indir=raw_data --outdir=. > lanes.tsv
+
+Type::
+
+   python merge_lanes.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import os
+import sys
+import concurrent.futures
+import cgatcore.experiment as E
+import ocmsrnaseq.staging as staging
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--indir", dest="indir", type=str,
+                        help="directory containing per-lane FASTQ files")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="directory to write merged FASTQ files to")
+
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="number of samples to merge in parallel")
+
+    parser.add_argument("--buffer-size", dest="buffer_size", type=int,
+                        help="size of blocks copied in MB")
+
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="do not count the reads of each lane")
+
+    parser.set_defaults(indir=".",
+                        outdir=".",
+                        threads=4,
+                        buffer_size=16,
+                        verify=True)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    lanes = staging.group_lanes(args.indir)
+    todo = {}
+    for sample, reads in lanes.items():
+        outfiles = [os.path.join(args.outdir, "%s.fastq.%s.gz" % (sample, x))
+                    for x in reads]
+        if all(os.path.exists(x) for x in outfiles):
+            E.info("%s: already merged, skipping" % sample)
+            continue
+        todo[sample] = reads
+    E.info("merging %i of %i samples" % (len(todo), len(lanes)))
+
+    args.stdout.write("sample\tread\tlane_file\tnreads\n")
+    with concurrent.futures.ThreadPoolExecutor(args.threads) as pool:
+        futures = dict(
+            (sample, pool.submit(staging.merge_lanes, sample, reads,
+                                 args.outdir, verify=args.verify,
+                                 bufsize=args.buffer_size << 20))
+            for sample, reads in sorted(todo.items()))
+        for sample, future in futures.items():
+            for read, infile, nreads in future.result():
+                args.stdout.write("%s\t%s\t%s\t%s\n" %
+                                  (sample, read, infile,
+                                   "na" if nreads is None else nreads))
+            E.info("%s: merged %i lanes" % (sample,
+                                            len(next(iter(todo[sample].values())))))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
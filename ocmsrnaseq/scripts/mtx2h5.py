@@ -0,0 +1,91 @@
+'''
+mtx2h5.py
+===========
+
+:Tags: Python
+
+Purpose
+-------
+
+Convert a 10x style MatrixMarket directory (cellranger outs matrices or
+CITE-seq-Count read_count/umi_count) to a compressed sparse HDF5 file in
+the 10x layout, with barcode and feature indexes. The matrix is stored
+by column (barcode) and, with --csr, also by row (feature) so that
+either can be read selectively.
+
+The output can be read in python with ocmsrnaseq.h5matrix.H5Matrix and
+in R with Seurat::Read10X_h5.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python mtx2h5.py --indir=prefilter.dir/sample1/gex
+                    --outfile=prefilter.dir/sample1/gex.h5
+
+Type::
+
+   python mtx2h5.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.h5matrix as h5matrix
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--indir", dest="indir", type=str,
+                        help="directory containing matrix.mtx, "
+                        "barcodes.tsv and features.tsv (optionally gzipped)")
+
+    parser.add_argument("--outfile", dest="outfile", type=str,
+                        help="HDF5 file to write")
+
+    parser.add_argument("--csr", dest="csr", action="store_true",
+                        help="also store the matrix by row for fast "
+                        "reading of selected features")
+
+    parser.add_argument("--no-compression", dest="compression",
+                        action="store_const", const=None,
+                        help="store datasets uncompressed and contiguous "
+                        "so that they can be memory mapped")
+
+    parser.set_defaults(csr=False,
+                        compression="gzip")
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    h5matrix.from_mtx(args.indir, args.outfile,
+                      csr=args.csr,
+                      compression=args.compression)
+
+    with h5matrix.H5Matrix(args.outfile) as matrix:
+        E.info("%s: %i features x %i barcodes" %
+               ((args.outfile,) + matrix.shape))
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
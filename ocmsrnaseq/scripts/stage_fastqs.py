@@ -0,0 +1,112 @@
+'''
+stage_fastqs.py
+=================
+
+:Tags: Python
+
+Purpose
+-------
+
+Link Novogene FASTQ files (<sample>_..._L<lane>_<read>.fq.gz) into a
+directory under the names expected by geomxngspipeline and the other
+pipelines (<sample>_L00<lane>_R<read>_001.fastq.gz, with the lowest lane
+of each sample numbered L001).
+
+With --ini, the Novogene sample names are GeoMx DSP wells (e.g. A01)
+and are renamed to the AOI ids of the [AOI_List] of the .ini file
+(e.g. DSP-1001660012345-A-A01). This replaces ini2fastq.py (with --ini)
+and novogene2geomx.py (without).
+
+The input directory is scanned once and the mapping is checked before
+any link is made: every file must follow the naming and map to an AOI,
+targets must be unique and existing files are never overwritten. Links
+that already exist are skipped, so staging can be rerun. Links are
+created in parallel.
+
+The mapping (source, target) is written to stdout. Use --dry-run to
+check the mapping without creating links.
+
+Usage
+-----
+
+.. Example use case
+
+Example::
+
+   python stage_fastqs.py --indir=raw_data --outdir=. --ini=config.ini
+                          > file_map.txt
+
+Type::
+
+   python stage_fastqs.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+
+import sys
+import cgatcore.experiment as E
+import ocmsrnaseq.staging as staging
+
+
+def main(argv=None):
+    """script main.
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    # setup command line parser
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--indir", dest="indir", type=str,
+                        help="directory containing Novogene .fq.gz files")
+
+    parser.add_argument("--outdir", dest="outdir", type=str,
+                        help="directory to create links in")
+
+    parser.add_argument("--ini", dest="ini", type=str,
+                        help="GeoMx .ini file used to map wells to AOIs")
+
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="number of links to create in parallel")
+
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                        help="check and output the mapping without "
+                        "creating links")
+
+    parser.set_defaults(indir=".",
+                        outdir=".",
+                        ini=None,
+                        threads=8,
+                        dry_run=False)
+
+    # add common options (-h/--help, ...) and parse command line
+    (args) = E.start(parser, argv=argv)
+
+    mapping, missing = staging.build_mapping(args.indir, args.outdir,
+                                             ini=args.ini)
+    if missing:
+        E.warn("%i AOIs in %s have no FASTQ files: %s" %
+               (len(missing), args.ini, ", ".join(missing)))
+
+    todo = staging.validate_mapping(mapping)
+    E.info("%i files mapped, %i already linked, %i to link" %
+           (len(mapping), len(mapping) - len(todo), len(todo)))
+
+    for source, target in mapping:
+        args.stdout.write("%s\t%s\n" % (source, target))
+
+    if not args.dry_run:
+        staging.stage(todo, nthreads=args.threads)
+
+    # write footer and output benchmark information.
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,311 @@
+'''
+staging.py - rename and link sequencing provider FASTQ files
+=============================================================
+
+FASTQ files from Novogene are named::
+
+    <sample>_<flowcell...>_L<lane>_<read>.fq.gz
+
+and are staged (symlinked) under the names expected by geomxngspipeline
+and the other pipelines::
+
+    <sample>_L00<lane>_R<read>_001.fastq.gz
+
+with the lowest lane of each sample numbered L001. For GeoMx DSP runs
+the Novogene sample is the well of the AOI (e.g. A01) and is mapped to
+the AOI id in the [AOI_List] of the .ini file (e.g. DSP-1001660012345-A-A01).
+
+The mapping is built from a single scan of the input directory and is
+validated before any link is made: every file must map to a sample,
+every target name must be unique and existing files must not be
+overwritten. Files that already have the staged naming (e.g. links made
+by an earlier run into the same directory) are not scanned and links
+that already exist and point to the same file are skipped, so that
+staging can be rerun.
+
+Tools that take one FASTQ file per read and sample are given lanes
+merged with :func:`merge_lanes`, which concatenates the gzip members of
+the lanes byte for byte into::
+
+    <sample>.fastq.1.gz
+    <sample>.fastq.2.gz
+
+as read by pipeline_kallisto and pipeline_cite_seq_count. Nothing is
+recompressed, so merging is limited by I/O. Reads are counted as the
+lanes are copied to check that mates have the same number of reads.
+
+'''
+
+import os
+import re
+import zlib
+import configparser
+import concurrent.futures
+
+
+NOVOGENE_REGEX = re.compile(r"^(?P<sample>[^_]+)_.*L(?P<lane>\d+)_"
+                            r"(?P<read>[12])\.(fq|fastq)\.gz$")
+
+LANE_REGEX = re.compile(r"^(?P<sample>.+?)(_S\d+)?_L(?P<lane>\d+)_"
+                        r"R(?P<read>[12])_001\.fastq\.gz$")
+
+
+class StagingError(ValueError):
+    pass
+
+
+def parse_name(filename):
+    '''return the sample, lane (int) and read of a Novogene FASTQ file
+    name or None if the name does not match
+    '''
+    match = NOVOGENE_REGEX.match(filename)
+    if match is None:
+        return None
+    return (match.group("sample"), int(match.group("lane")),
+            match.group("read"))
+
+
+def well_map(ini):
+    '''map wells (e.g. A01) to AOI ids from the [AOI_List] of a GeoMx
+    .ini file
+    '''
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    with open(ini) as inf:
+        config.read_file(inf)
+
+    wells = {}
+    for aoi in config["AOI_List"]:
+        aoi = aoi.upper()
+        well = aoi.split("-")[-1]
+        if well in wells and wells[well] != aoi:
+            raise StagingError(
+                "well %s is used by more than one AOI in %s (%s, %s) - "
+                "stage each slide separately" %
+                (well, ini, wells[well], aoi))
+        wells[well] = aoi
+    return wells
+
+
+def build_mapping(indir, outdir, ini=None):
+    '''scan indir once and return the list of (source, target) paths and
+    the samples (or AOIs) of the ini that have no files. Files with the
+    staged naming are skipped
+    '''
+    wells = well_map(ini) if ini else None
+
+    files = {}
+    unmatched, unmapped = [], []
+    with os.scandir(indir) as entries:
+        for entry in entries:
+            if not (entry.name.endswith(".fq.gz") or
+                    entry.name.endswith(".fastq.gz")):
+                continue
+            if LANE_REGEX.match(entry.name):
+                continue
+            parsed = parse_name(entry.name)
+            if parsed is None:
+                unmatched.append(entry.name)
+                continue
+            sample, lane, read = parsed
+            if wells is not None:
+                if sample.upper() not in wells:
+                    unmapped.append(entry.name)
+                    continue
+                sample = wells[sample.upper()]
+            files.setdefault(sample, []).append(
+                (lane, read, os.path.abspath(entry.path)))
+
+    if unmatched:
+        raise StagingError(
+            "%i files do not follow the <sample>_..._L<lane>_<read>.fq.gz "
+            "naming, e.g. %s" % (len(unmatched), unmatched[0]))
+    if unmapped:
+        raise StagingError(
+            "%i files have no AOI in %s, e.g. %s" %
+            (len(unmapped), ini, unmapped[0]))
+
+    mapping = []
+    for sample, lanes in sorted(files.items()):
+        first = min(x[0] for x in lanes)
+        for lane, read, source in sorted(lanes):
+            # the lowest lane is numbered L001
+            lane = 1 if lane == first else lane
+            target = "%s_L%03i_R%s_001.fastq.gz" % (sample, lane, read)
+            mapping.append((source, os.path.join(outdir, target)))
+
+    missing = []
+    if wells is not None:
+        missing = sorted(set(wells.values()) - set(files))
+    return mapping, missing
+
+
+def validate_mapping(mapping):
+    '''check that targets are unique and that existing targets are
+    links to the same source. Returns the mappings still to be linked
+    '''
+    targets = {}
+    for source, target in mapping:
+        if target in targets:
+            raise StagingError("%s and %s both map to %s" %
+                               (targets[target], source, target))
+        targets[target] = source
+
+    todo = []
+    for source, target in mapping:
+        if os.path.lexists(target):
+            if not (os.path.islink(target) and
+                    os.path.realpath(target) == os.path.realpath(source)):
+                raise StagingError("%s exists and is not a link to %s" %
+                                   (target, source))
+        else:
+            todo.append((source, target))
+    return todo
+
+
+def stage(mapping, nthreads=8):
+    '''create the symlinks of mapping in parallel
+    '''
+    with concurrent.futures.ThreadPoolExecutor(nthreads) as pool:
+        list(pool.map(lambda x: os.symlink(*x), mapping))
+
+
+def group_lanes(indir):
+    '''scan indir once and return a dictionary of sample to a dictionary
+    of read (1 or 2) to the files of the read sorted by lane. Files are
+    named <sample>[_S<n>]_L<lane>_R<read>_001.fastq.gz (as written by
+    :func:`stage` or bcl2fastq) or follow the Novogene naming
+    '''
+    files = {}
+    unmatched = []
+    with os.scandir(indir) as entries:
+        for entry in entries:
+            if not (entry.name.endswith(".fq.gz") or
+                    entry.name.endswith(".fastq.gz")):
+                continue
+            match = LANE_REGEX.match(entry.name)
+            if match is not None:
+                parsed = (match.group("sample"), int(match.group("lane")),
+                          match.group("read"))
+            else:
+                parsed = parse_name(entry.name)
+            if parsed is None:
+                unmatched.append(entry.name)
+                continue
+            sample, lane, read = parsed
+            files.setdefault(sample, {}).setdefault(read, []).append(
+                (lane, os.path.abspath(entry.path)))
+
+    if unmatched:
+        raise StagingError(
+            "%i files do not follow the <sample>_L<lane>_R<read>_001.fastq.gz "
+            "or Novogene naming, e.g. %s" % (len(unmatched), unmatched[0]))
+
+    lanes = {}
+    for sample, reads in sorted(files.items()):
+        lanes[sample] = {}
+        for read, x in sorted(reads.items()):
+            numbers = [lane for lane, path in x]
+            if len(set(numbers)) != len(numbers):
+                raise StagingError("sample %s has more than one file for a "
+                                   "lane of read %s" % (sample, read))
+            lanes[sample][read] = [path for lane, path in sorted(x)]
+        if len(lanes[sample]) == 2 and \
+           len(lanes[sample]["1"]) != len(lanes[sample]["2"]):
+            raise StagingError("sample %s has %i lanes for read 1 and %i "
+                               "for read 2" % (sample,
+                                               len(lanes[sample]["1"]),
+                                               len(lanes[sample]["2"])))
+    return lanes
+
+
+def concatenate(infiles, outfile, verify=True, bufsize=1 << 24,
+                slicesize=1 << 18):
+    '''concatenate gzipped files byte for byte into outfile.
+
+    Concatenated gzip members are a valid gzip file, so nothing is
+    recompressed. Data is streamed in blocks of *bufsize* bytes and
+    outfile is written under a temporary name and renamed when
+    complete. If *verify* is set, each file is decompressed as it is
+    copied (without a second read) and the number of reads of each
+    file is returned, otherwise None for each file. Blocks are
+    decompressed in slices of *slicesize* bytes and gzip members are
+    located by offset, so that neither the decompressed data nor the
+    data following the end of a member is ever larger than a slice.
+    '''
+    counts = []
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    tmpfile = outfile + ".tmp"
+    try:
+        with open(tmpfile, "wb") as outf:
+            for infile in infiles:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                nlines = size = 0
+                with open(infile, "rb") as inf:
+                    while True:
+                        n = inf.readinto(buf)
+                        if not n:
+                            break
+                        outf.write(view[:n])
+                        size += n
+                        if not verify:
+                            continue
+                        offset = 0
+                        while offset < n:
+                            # start a new gzip member
+                            if decompressor.eof:
+                                decompressor = zlib.decompressobj(
+                                    16 + zlib.MAX_WBITS)
+                            data = view[offset:min(n, offset + slicesize)]
+                            nlines += decompressor.decompress(data).count(
+                                b"\n")
+                            offset += len(data) - len(
+                                decompressor.unused_data)
+                if not verify:
+                    counts.append(None)
+                    continue
+                if size and not decompressor.eof:
+                    raise StagingError("%s is truncated" % infile)
+                if nlines % 4:
+                    raise StagingError("%s has %i lines, not a multiple of "
+                                       "4" % (infile, nlines))
+                counts.append(nlines // 4)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
+    return counts
+
+
+def merge_lanes(sample, reads, outdir, verify=True, bufsize=1 << 24):
+    '''concatenate the lanes of *reads* (read to files sorted by lane,
+    see :func:`group_lanes`) of a sample into
+    <outdir>/<sample>.fastq.1.gz and <outdir>/<sample>.fastq.2.gz.
+
+    If *verify* is set, the number of reads of each lane is checked to
+    be the same in both reads and the output is removed if not.
+    Returns a list of (read, file, number of reads) for each lane.
+    '''
+    outfiles, counts = [], {}
+    try:
+        for read, infiles in sorted(reads.items()):
+            outfile = os.path.join(outdir, "%s.fastq.%s.gz" % (sample, read))
+            counts[read] = concatenate(infiles, outfile, verify=verify,
+                                       bufsize=bufsize)
+            outfiles.append(outfile)
+        if verify and len(counts) == 2:
+            for r1, r2, n1, n2 in zip(reads["1"], reads["2"],
+                                      counts["1"], counts["2"]):
+                if n1 != n2:
+                    raise StagingError(
+                        "%s has %i reads and %s has %i reads" %
+                        (r1, n1, r2, n2))
+    except BaseException:
+        for outfile in outfiles:
+            os.unlink(outfile)
+        raise
+    return [(read, infile, n)
+            for read, infiles in sorted(reads.items())
+            for infile, n in zip(infiles, counts[read])]
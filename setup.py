@@ -5,6 +5,9 @@ import subprocess
 import re
 from setuptools import setup, find_packages
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ocmsrnaseq.ocms_rnaseq import ENTRY_POINT_GROUP, PIPELINES
+
 setup(
     # package information
     name='ocms_rnaseq',
@@ -17,7 +20,8 @@ setup(
     url="https://github.com/OxfordCMS/OCMS_RNAseq",
     packages=find_packages("./") + find_packages("./ocmsrnaseq/"),
     entry_points={
-        'console_scripts': ['ocms_rnaseq = ocmsrnaseq.ocms_rnaseq:main']
+        'console_scripts': ['ocms_rnaseq = ocmsrnaseq.ocms_rnaseq:main'],
+        ENTRY_POINT_GROUP: ['%s = %s:main' % x for x in sorted(PIPELINES.items())]
     },
     include_package_data=True,
     python_requires='>=3.6.0'                                            
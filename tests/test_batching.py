@@ -0,0 +1,23 @@
+'''tests for balancing batches of pipeline inputs'''
+
+import ocmsrnaseq.batching as batching
+
+
+def test_pack_balances_weights():
+    weights = {"a": 10, "b": 7, "c": 5, "d": 4, "e": 2, "f": 2}
+    batches = batching.pack(list(weights), 2, weights.get)
+    assert batches == [["a", "d", "f"], ["b", "c", "e"]]
+    assert [sum(weights[x] for x in batch) for batch in batches] == [16, 14]
+
+
+def test_pack_is_deterministic():
+    items = ["s%i" % i for i in range(10)]
+    batches = batching.pack(items, 3, lambda x: 1)
+    assert batches == batching.pack(list(reversed(items)), 3, lambda x: 1)
+    assert sorted(sum(batches, [])) == sorted(items)
+    assert [len(x) for x in batches] == [4, 3, 3]
+
+
+def test_pack_fewer_items_than_batches():
+    assert batching.pack(["a", "b"], 4, len) == [["a"], ["b"]]
+    assert batching.pack([], 4, len) == []
@@ -0,0 +1,113 @@
+'''tests for the native CITE-seq counting engine'''
+
+import collections
+import gzip
+import random
+import ocmsrnaseq.citeseq as citeseq
+
+
+def simulate_library(outfile, ncells=200, nbackground=5000, seed=1):
+    '''write a read 1 fastq file of 16 base cell barcodes and 10 base
+    UMIs. Returns the exact barcode counts'''
+    rng = random.Random(seed)
+
+    def barcode():
+        return "".join(rng.choice("ACGT") for i in range(16))
+
+    cells = [barcode() for i in range(ncells)]
+    background = [barcode() for i in range(nbackground)]
+    reads = []
+    for cell in cells:
+        reads.extend([cell] * rng.randint(200, 1000))
+    for x in background:
+        reads.extend([x] * int(rng.paretovariate(1.5)))
+    # sequencing errors
+    reads.extend(["NNNNACGTACGTACGT"] * 5)
+    rng.shuffle(reads)
+
+    umis = [barcode()[:10] for i in range(1000)]
+    with gzip.open(outfile, "wt", compresslevel=1) as outf:
+        for i, x in enumerate(reads):
+            outf.write("@r%i\n%s%s\n+\n%s\n" %
+                       (i, x, umis[i % len(umis)], "F" * 26))
+    return collections.Counter(reads)
+
+
+def test_count_barcodes_is_exact(tmp_path):
+    fastq = str(tmp_path / "sample.fastq.1.gz")
+    expected = simulate_library(fastq)
+    counts, nreads = citeseq.count_barcodes(fastq, 1, 16, topk=1000,
+                                            chunksize=10000)
+    assert nreads == sum(expected.values())
+    top = sorted(expected.items(), key=lambda x: (-x[1], x[0]))[:1000]
+    assert counts == dict(top)
+
+    counts, nreads = citeseq.count_barcodes(fastq, 1, 16, topk=1000000)
+    assert counts == dict(expected)
+
+
+def test_knee_matches_exact_counts(tmp_path):
+    fastq = str(tmp_path / "sample.fastq.1.gz")
+    expected = simulate_library(fastq)
+    counts, nreads = citeseq.count_barcodes(fastq, 1, 16, chunksize=10000)
+    ncells = citeseq.find_knee(counts.values(), min_count=100)
+    assert ncells == citeseq.find_knee(expected.values(), min_count=100)
+    assert abs(ncells - 200) <= 10
+
+
+def test_read_pairs_shards(tmp_path):
+    fastq1 = str(tmp_path / "sample.fastq.1.gz")
+    fastq2 = str(tmp_path / "sample.fastq.2.gz")
+    for outfile, mate in ((fastq1, "R1"), (fastq2, "R2")):
+        with gzip.open(outfile, "wt") as outf:
+            for i in range(1050):
+                outf.write("@r%i\n%s%i\n+\n%s\n" % (i, mate, i, "F"))
+
+    expected = [("R1%i\n" % i, "R2%i\n" % i) for i in range(1050)]
+    assert sum(citeseq.read_pairs(fastq1, fastq2, 100), []) == expected
+
+    shards = [sum(citeseq.read_pairs(fastq1, fastq2, 100, shard, 3), [])
+              for shard in range(3)]
+    assert [len(x) for x in shards] == [400, 350, 300]
+    assert shards[1][:100] == expected[100:200]
+    assert sorted(sum(shards, [])) == sorted(expected)
+
+
+def collapse_pairwise(umi_counts, distance):
+    '''directional collapsing comparing every pair of UMIs'''
+    umis = sorted(umi_counts, key=lambda x: (-umi_counts[x], x))
+    seen = set()
+    clusters = 0
+    for umi in umis:
+        if umi in seen:
+            continue
+        clusters += 1
+        seen.add(umi)
+        queue = [umi]
+        while queue:
+            node = queue.pop()
+            for other in umis:
+                if other not in seen and \
+                   umi_counts[node] >= 2 * umi_counts[other] - 1 and \
+                   citeseq.hamming(node, other) <= distance:
+                    seen.add(other)
+                    queue.append(other)
+    return clusters
+
+
+def test_collapse_umis_matches_pairwise():
+    rng = random.Random(1)
+    for nparents in (50, 250):
+        umi_counts = collections.Counter()
+        for i in range(nparents):
+            parent = "".join(rng.choice("ACGT") for j in range(10))
+            umi_counts[parent] += rng.randint(5, 50)
+            # sequencing errors of one and two substitutions
+            for nerrors in (1, 1, 2):
+                child = list(parent)
+                for p in rng.sample(range(10), nerrors):
+                    child[p] = rng.choice("ACGTN")
+                umi_counts["".join(child)] += 1
+        for distance in (1, 2):
+            assert citeseq.collapse_umis(umi_counts, distance) == \
+                collapse_pairwise(umi_counts, distance)
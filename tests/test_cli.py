@@ -0,0 +1,30 @@
+'''tests for the ocms_rnaseq command line interface'''
+
+import importlib.util
+import io
+import ocmsrnaseq.ocms_rnaseq as ocms_rnaseq
+
+
+def test_pipelines_are_importable():
+    for name, module in ocms_rnaseq.PIPELINES.items():
+        assert importlib.util.find_spec(module) is not None, name
+
+
+def test_usage_lists_pipelines_and_scripts():
+    outf = io.StringIO()
+    ocms_rnaseq.usage(outf)
+    listed = outf.getvalue()
+    for name in list(ocms_rnaseq.PIPELINES) + ["inis2ini", "hto_demux"]:
+        assert "    %s\n" % name in listed
+
+
+def test_script_namespace(capsys):
+    # hto_demux is both a pipeline and a script
+    assert "hto_demux" in ocms_rnaseq.pipelines()
+    assert "hto_demux" in ocms_rnaseq.scripts()
+    assert ocms_rnaseq.main(["ocms_rnaseq", "script", "no_such_script"]) == 1
+    assert "unknown script" in capsys.readouterr().err
+
+
+def test_start_up_time():
+    assert ocms_rnaseq.benchmark(["--repeats=5"]) == 0
@@ -0,0 +1,272 @@
+'''tests for the GeoMx helpers'''
+
+import os
+import json
+import configparser
+import h5py
+import pytest
+import ocmsrnaseq.geomx as geomx
+import ocmsrnaseq.h5matrix as h5matrix
+
+
+def write_ini(path, aois, targets=("RTS0001", "RTS0002")):
+    with open(path, "w") as outf:
+        outf.write("[Sequencing]\nReadLength = 27\n\n[Targets]\n")
+        for target in targets:
+            outf.write("%s = %s\n" % (target, target.lower()))
+        outf.write("\n[AOI_List]\n")
+        for aoi in aois:
+            outf.write("%s = 1\n" % aoi)
+    return str(path)
+
+
+def test_combine_in_worker_processes(tmp_path):
+    inis = [write_ini(tmp_path / "slide1.ini", ["DSP-1-A-A01", "DSP-1-A-A02"]),
+            write_ini(tmp_path / "slide2.ini", ["DSP-2-A-A01"])]
+    outfile = str(tmp_path / "combined.ini")
+    aois = geomx.combine_inis(inis, outfile, nthreads=2)
+    assert aois["DSP-2-A-A01"]["ini"] == inis[1]
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(outfile)
+    assert sorted(config["AOI_List"]) == sorted(aois)
+    assert dict(config["Targets"]) == {"RTS0001": "rts0001",
+                                       "RTS0002": "rts0002"}
+
+
+def test_combine_different_targets(tmp_path):
+    inis = [write_ini(tmp_path / "slide1.ini", ["DSP-1-A-A01"]),
+            write_ini(tmp_path / "slide2.ini", ["DSP-2-A-A01"],
+                      targets=("RTS0001",))]
+    with pytest.raises(ValueError, match="targets"):
+        geomx.combine_inis(inis, str(tmp_path / "combined.ini"), nthreads=2)
+
+
+def test_combine_duplicate_aoi(tmp_path):
+    inis = [write_ini(tmp_path / "slide1.ini", ["DSP-1-A-A01"]),
+            write_ini(tmp_path / "slide2.ini", ["DSP-1-A-A01"])]
+    with pytest.raises(ValueError, match="DSP-1-A-A01"):
+        geomx.combine_inis(inis, str(tmp_path / "combined.ini"), nthreads=2)
+
+
+# summary.txt of a geomxngspipeline run of two AOIs
+SUMMARY = '''Sample_ID\tRaw\tTrimmed\tStitched\tAligned\tumiQ30\trtsQ30\tDeduplicatedReads
+DSP-1001660012345-A-A01.dcc\t352114\t352114\t349871\t341205\t0.9712\t0.9689\t120455
+DSP-1001660012345-A-B02.dcc\t298731\t298731\t296002\t288914\t0.9705\t0.9677\t101873
+'''
+
+
+@pytest.fixture
+def summary(tmp_path):
+    infile = tmp_path / "summary.txt"
+    infile.write_text(SUMMARY)
+    return str(infile)
+
+
+def test_split_summary(tmp_path, summary):
+    aois = ["DSP-1001660012345-A-A01", "DSP-1001660012345-A-B02"]
+    outfiles = [str(tmp_path / (x + "_summary.txt")) for x in aois]
+    geomx.split_summary(summary, aois, outfiles)
+
+    header, first, second = SUMMARY.splitlines(True)
+    with open(outfiles[0]) as inf:
+        assert inf.read() == header + first
+    with open(outfiles[1]) as inf:
+        assert inf.read() == header + second
+
+
+def test_split_summary_missing_aoi(tmp_path, summary):
+    aois = ["DSP-1001660012345-A-A01", "DSP-1001660012345-A-B02",
+            "DSP-1001660012345-A-C03"]
+    outfiles = [str(tmp_path / (x + "_summary.txt")) for x in aois]
+    with pytest.raises(ValueError, match="DSP-1001660012345-A-C03"):
+        geomx.split_summary(summary, aois, outfiles)
+    assert not any(os.path.exists(x) for x in outfiles)
+
+
+def test_split_summary_unknown_aoi(tmp_path, summary):
+    aois = ["DSP-1001660012345-A-A01"]
+    with pytest.raises(ValueError, match="DSP-1001660012345-A-B02"):
+        geomx.split_summary(summary, aois, [str(tmp_path / "a.txt")])
+
+
+GEOMX_INI = '''[Sequencing]
+ReadLength = 27
+
+[Processing_v2]
+threads = 8
+trimLeft = 0
+
+[AOI_List]
+DSP-1001660012345-A-A01 = 1
+DSP-1001660012345-A-B02 = 1
+DSP-1001660012345-A-C03 = 1
+
+[Targets]
+RTS0001 = rts0001
+'''
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    ini = tmp_path / "run.ini"
+    ini.write_text(GEOMX_INI)
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    for aoi in ("DSP-1001660012345-A-A01", "DSP-1001660012345-A-B02"):
+        for read in (1, 2):
+            (fastq_dir / ("%s_S1_L001_R%i_001.fastq.gz" %
+                          (aoi, read))).write_bytes(b"")
+    outdir = str(tmp_path / "manifest")
+    written, missing = geomx.build_manifest(str(ini), outdir,
+                                            directory=str(fastq_dir))
+    return str(ini), str(fastq_dir), outdir, written, missing
+
+
+def test_build_manifest(manifest):
+    ini, fastq_dir, outdir, written, missing = manifest
+    assert written == ["DSP-1001660012345-A-A01", "DSP-1001660012345-A-B02"]
+    assert missing == ["DSP-1001660012345-A-C03"]
+
+    with open(os.path.join(outdir, "manifest.tsv")) as inf:
+        lines = [x.rstrip("\n").split("\t") for x in inf]
+    assert lines[0] == ["aoi", "nfastqs", "fastqs"]
+    assert [x[:2] for x in lines[1:]] == [[x, "2"] for x in written]
+    assert lines[1][2] == ",".join(
+        os.path.join(fastq_dir, "DSP-1001660012345-A-A01_S1_L001_R%i_001"
+                     ".fastq.gz" % x) for x in (1, 2))
+
+    entry = geomx.read_entry(outdir, "DSP-1001660012345-A-B02")
+    assert entry["aoi"] == "DSP-1001660012345-A-B02"
+    assert entry["config"] == "1"
+    assert entry["processing"] == {"threads": "8", "trimLeft": "0"}
+    assert entry["ini"] == ini
+    assert len(entry["fastqs"]) == 2
+
+
+def test_write_entry_config_round_trip(tmp_path, manifest):
+    ini, fastq_dir, outdir, written, missing = manifest
+    entries = [geomx.read_entry(outdir, x) for x in written]
+    outfile = str(tmp_path / "config.ini")
+    geomx.write_entry_config(outdir, entries, outfile, threads=2)
+
+    original = geomx.read_config(ini)
+    config = geomx.read_config(outfile)
+    assert config.sections() == original.sections()
+    assert dict(config["AOI_List"]) == dict((x, "1") for x in written)
+    assert dict(config["Processing_v2"]) == {"threads": "2",
+                                             "trimLeft": "0"}
+    for section in ("Sequencing", "Targets"):
+        assert dict(config[section]) == dict(original[section])
+
+
+DCC = '''<Header>
+FileVersion,0.02
+SoftwareVersion,"GeoMx_NGS_Pipeline_2.3.3.10"
+Date,2023-03-14
+</Header>
+
+<Scan_Attributes>
+ID,%(aoi)s
+Plate_ID,1001660012345
+Well,%(well)s
+</Scan_Attributes>
+
+<NGS_Processing_Attributes>
+SeqSetId,VH00121:3:AAAG2YWM5
+Raw,352114
+Trimmed,352114
+Stitched,349871
+Aligned,341205
+umiQ30,0.9712
+rtsQ30,0.9689
+DeduplicatedReads,%(deduplicated)s
+</NGS_Processing_Attributes>
+
+<Code_Summary>
+%(counts)s
+</Code_Summary>
+'''
+
+PKC = {"Name": "Hs_R_NGS_WTA_v1.0",
+       "Targets": [
+           {"DisplayName": "ACTA2", "CodeClass": "Endogenous",
+            "Probes": [{"RTS_ID": "RTS0020877", "ProbeID": "ACTA2-1"}]},
+           {"DisplayName": "NegProbe-WTX", "CodeClass": "Negative",
+            "Probes": [{"RTS_ID": "RTS0020878", "ProbeID": "Neg-1"},
+                       {"RTS_ID": "RTS0020879", "ProbeID": "Neg-2"}]}]}
+
+WORKSHEET = '''Sample_ID\tslide name\tsegment\tarea
+DSP-1001660012345-A-A01.dcc\tslide1\tPanCK\t12000.5
+DSP-1001660012345-A-B02.dcc\tslide1\tCD45\t8000
+DSP-1001660012345-A-C03.dcc\tslide1\tCD45\t9000
+'''
+
+
+@pytest.fixture
+def dcc_files(tmp_path):
+    dcc_dir = tmp_path / "dcc.dir"
+    dcc_dir.mkdir()
+    counts = {"A01": "RTS0020877,10\nRTS0020879,2\nRTS0020877,1\n"
+                     "RTS9999999,7",
+              "B02": "RTS0020878,3"}
+    dcc_files = []
+    for well in ("A01", "B02"):
+        aoi = "DSP-1001660012345-A-" + well
+        dcc = dcc_dir / (aoi + ".dcc")
+        dcc.write_text(DCC % {"aoi": aoi, "well": well,
+                              "deduplicated": 100 if well == "A01" else 50,
+                              "counts": counts[well]})
+        dcc_files.append(str(dcc))
+    pkc = tmp_path / "Hs_R_NGS_WTA_v1.0.pkc"
+    pkc.write_text(json.dumps(PKC))
+    worksheet = tmp_path / "annotation.txt"
+    worksheet.write_text(WORKSHEET)
+    return dcc_files, [str(pkc)], str(worksheet)
+
+
+def test_parse_dcc(dcc_files):
+    attributes, counts = geomx.parse_dcc(dcc_files[0][0])
+    assert counts == {"RTS0020877": 11, "RTS0020879": 2, "RTS9999999": 7}
+    assert attributes["SoftwareVersion"] == "GeoMx_NGS_Pipeline_2.3.3.10"
+    assert attributes["ID"] == "DSP-1001660012345-A-A01"
+    assert attributes["DeduplicatedReads"] == "100"
+
+
+def test_build_count_matrix(tmp_path, dcc_files):
+    dccs, pkcs, worksheet = dcc_files
+    outfile = str(tmp_path / "geomx_counts.h5")
+    columns, metadata, unknown = geomx.build_count_matrix(
+        dccs, pkcs, outfile, worksheet=worksheet, nthreads=2)
+
+    # counts of RTS ids not in the pkc file are reported, not stored
+    assert unknown == 7
+    # the worksheet is joined on Sample_ID without .dcc
+    aoi = "DSP-1001660012345-A-A01"
+    assert metadata[aoi][columns.index("segment")] == "PanCK"
+    assert metadata[aoi][columns.index("Sample_ID")] == aoi + ".dcc"
+    assert metadata["DSP-1001660012345-A-B02"][
+        columns.index("DeduplicatedReads")] == "50"
+    assert columns[-4:] == ["Sample_ID", "slide name", "segment", "area"]
+
+    with h5matrix.H5Matrix(outfile) as matrix:
+        counts, features, barcodes = matrix.read()
+        assert barcodes == [aoi, "DSP-1001660012345-A-B02"]
+        assert features == ["RTS0020877", "RTS0020878", "RTS0020879"]
+        assert matrix.feature_names == ["ACTA2", "NegProbe-WTX",
+                                        "NegProbe-WTX"]
+        assert counts.toarray().tolist() == [[11, 0], [0, 3], [2, 0]]
+
+    with h5py.File(outfile, "r") as inf:
+        group = inf["matrix"]
+        assert group["features/feature_type"].asstr()[:].tolist() == [
+            "Endogenous", "Negative", "Negative"]
+        assert group["features/probe_id"].asstr()[:].tolist() == [
+            "ACTA2-1", "Neg-1", "Neg-2"]
+        assert group["features/module"].asstr()[:].tolist() == [
+            "Hs_R_NGS_WTA_v1.0"] * 3
+        assert list(group["aoi_metadata"]) == [
+            x.replace("/", "_") for x in columns]
+        assert group["aoi_metadata/segment"].asstr()[:].tolist() == [
+            "PanCK", "CD45"]
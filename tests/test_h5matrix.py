@@ -0,0 +1,45 @@
+'''tests for the sparse HDF5 matrix store'''
+
+import gzip
+import os
+import numpy as np
+import scipy.io
+import scipy.sparse
+import ocmsrnaseq.h5matrix as h5matrix
+
+
+def write_mtx(outdir, nfeatures=5, nbarcodes=50):
+    os.makedirs(outdir)
+    matrix = scipy.sparse.random(nfeatures, nbarcodes, density=0.3,
+                                 format="coo", random_state=1)
+    matrix.data = np.ceil(matrix.data * 10)
+    with gzip.open(os.path.join(outdir, "matrix.mtx.gz"), "wb") as outf:
+        scipy.io.mmwrite(outf, matrix, field="integer")
+    with gzip.open(os.path.join(outdir, "barcodes.tsv.gz"), "wt") as outf:
+        outf.write("".join("BC%i\n" % i for i in range(nbarcodes)))
+    with gzip.open(os.path.join(outdir, "features.tsv.gz"), "wt") as outf:
+        outf.write("".join("HTO%i\n" % i for i in range(nfeatures)))
+    return matrix.tocsc()
+
+
+def test_uncompressed_is_memory_mapped(tmp_path):
+    expected = write_mtx(str(tmp_path / "umi_count"))
+    outfile = str(tmp_path / "umi_count.h5")
+    h5matrix.from_mtx(str(tmp_path / "umi_count"), outfile, compression=None)
+    with h5matrix.H5Matrix(outfile) as matrix:
+        for name in ("data", "indices", "indptr"):
+            assert isinstance(matrix._array(name), np.memmap)
+        counts, features, barcodes = matrix.read()
+        assert (counts != expected).nnz == 0
+        np.testing.assert_array_equal(matrix.column_totals(),
+                                      expected.sum(axis=0).A1)
+
+
+def test_compressed_is_read(tmp_path):
+    expected = write_mtx(str(tmp_path / "umi_count"))
+    outfile = str(tmp_path / "umi_count.h5")
+    h5matrix.from_mtx(str(tmp_path / "umi_count"), outfile)
+    with h5matrix.H5Matrix(outfile) as matrix:
+        assert not isinstance(matrix._array("data"), np.memmap)
+        counts, features, barcodes = matrix.read(barcodes=["BC3", "BC7"])
+        assert (counts != expected[:, [3, 7]]).nnz == 0
@@ -0,0 +1,73 @@
+'''tests for the native HTODemux engine'''
+
+import numpy as np
+import ocmsrnaseq.htodemux as htodemux
+
+
+def seurat_max_ids(data, htos):
+    '''HTO_maxID, HTO_secondID and HTO_margin as computed by Seurat's
+    HTODemux (which.max, MaxN and which on the CLR values)'''
+    max_ids, second_ids, margins = [], [], []
+    for column in data.T:
+        highest = sorted(column, reverse=True)[0]
+        second = sorted(column, reverse=True)[1]
+        max_ids.append(htos[list(column).index(highest)])
+        second_ids.append(htos[list(column).index(second)])
+        margins.append(highest - second)
+    return max_ids, second_ids, np.array(margins)
+
+
+def simulate(seed=1, ncells=300):
+    rng = np.random.default_rng(seed)
+    htos = np.array(["HTO1", "HTO2", "HTO3"])
+    # HTO1 has a high background so that the highest count and the
+    # highest CLR value differ for many cells
+    counts = rng.poisson([[200], [5], [5]], size=(3, ncells)).astype(float)
+    owner = rng.integers(0, 3, ncells)
+    counts[owner, np.arange(ncells)] += rng.poisson(150, ncells)
+    barcodes = np.array(["CELL%04i" % i for i in range(ncells)])
+    return counts, htos, barcodes
+
+
+def test_ids_and_margin_from_clr():
+    counts, htos, barcodes = simulate()
+    result = htodemux.hto_demux(counts, htos)
+    max_ids, second_ids, margins = seurat_max_ids(result["clr"], htos)
+    assert list(result["HTO_maxID"]) == max_ids
+    assert list(result["HTO_secondID"]) == second_ids
+    np.testing.assert_allclose(result["HTO_margin"], margins)
+    assert (np.argmax(counts, axis=0) !=
+            np.argmax(result["clr"], axis=0)).any()
+
+
+def test_tied_second_id():
+    htos = np.array(["HTO1", "HTO2", "HTO3"])
+    counts = np.array([[10., 10., 0., 1.],
+                       [10., 0., 10., 1.],
+                       [0., 10., 10., 1.]])
+    result = htodemux.hto_demux(counts, htos, samples=5)
+    max_ids, second_ids, margins = seurat_max_ids(result["clr"], htos)
+    assert list(result["HTO_maxID"]) == max_ids
+    assert list(result["HTO_secondID"]) == second_ids
+    np.testing.assert_allclose(result["HTO_margin"], margins)
+
+
+def test_compare_with_reference(tmp_path):
+    counts, htos, barcodes = simulate()
+    result = htodemux.hto_demux(counts, htos)
+    outfile = str(tmp_path / "sample_demux.h5")
+    htodemux.write_h5(outfile, barcodes, htos, counts, result)
+    reference = htodemux.read_calls(outfile)
+    assert reference["HTO_margin"].dtype == np.float64
+
+    # a reference restricted to and reordered on part of the cells
+    comparison = htodemux.compare_calls(barcodes[::-1][:100], dict(
+        (x, np.asarray(y)[::-1][:100]) for x, y in result.items()
+        if x in htodemux.CALL_COLUMNS), reference)
+    assert comparison["cells"] == 100
+    assert comparison["HTO_classification.global"] == 1.0
+    assert comparison["HTO_margin"] == 0.0
+
+    reference["HTO_classification.global"][:30] = "Unknown"
+    comparison = htodemux.compare_calls(barcodes, result, reference)
+    assert comparison["HTO_classification.global"] == 0.9
@@ -0,0 +1,78 @@
+'''tests for the kallisto batch outputs'''
+
+import os
+import numpy as np
+import scipy.io
+import scipy.sparse
+import ocmsrnaseq.annotation as annotation
+import ocmsrnaseq.kallisto as kallisto
+
+
+GTF = '''#!genome-build test
+1\ttest\tgene\t1\t1000\t.\t+\t.\tgene_id "g1"; gene_name "A";
+1\ttest\ttranscript\t1\t1000\t.\t+\t.\tgene_id "g1"; transcript_id "t1";
+1\ttest\texon\t1\t100\t.\t+\t.\tgene_id "g1"; transcript_id "t1";
+1\ttest\texon\t201\t450\t.\t+\t.\tgene_id "g1"; transcript_id "t1";
+1\ttest\texon\t1\t300\t.\t+\t.\tgene_id "g1"; transcript_id "t2";
+'''
+
+
+def test_transcript_lengths(tmp_path):
+    gtf = tmp_path / "test.gtf"
+    gtf.write_text(GTF)
+    annotation.build_index(str(gtf), str(tmp_path))
+    lengths = annotation.read_lengths(
+        os.path.join(str(tmp_path), annotation.TRANSCRIPT_LENGTHS))
+    assert lengths == {"t1": 350, "t2": 300}
+
+
+def test_split_tcc_quant_keeps_sample_efflens(tmp_path):
+    # barcodes of samples 0 and 2 of a batch of 3
+    barcodes = ["AAAAAAAAAAAAAAAA", "AAAAAAAAAAAAAAAG"]
+    counts = np.array([[10.0, 30.0], [5.0, 0.0]])
+    efflens = np.array([[100.0, 200.0], [150.0, 250.0]])
+    scipy.io.mmwrite(str(tmp_path / "matrix.abundance.mtx"),
+                     scipy.sparse.coo_matrix(counts))
+    scipy.io.mmwrite(str(tmp_path / "matrix.efflens.mtx"), efflens)
+
+    values = kallisto.split_tcc_quant(
+        str(tmp_path / "matrix.abundance.mtx"),
+        str(tmp_path / "matrix.efflens.mtx"), barcodes, 3)
+
+    assert values.shape == (3, 2, 3)
+    np.testing.assert_allclose(values[0, :, 0], [100, 200])
+    np.testing.assert_allclose(values[2, :, 0], [150, 250])
+    np.testing.assert_allclose(values[0, :, 1], [10, 30])
+    np.testing.assert_allclose(values[0, :, 2], [400000, 600000])
+    np.testing.assert_allclose(values[2, :, 2], [1e6, 0])
+    # sample 1 has no reads
+    np.testing.assert_allclose(values[1, :, 0], [125, 225])
+    assert values[1, :, 1:].sum() == 0
+
+
+def test_write_abundance(tmp_path):
+    values = np.array([[123.456789, 10.0, 1234567.891],
+                       [200.0, 0.5, 0.0]])
+    outfile = str(tmp_path / "abundance.tsv")
+    kallisto.write_abundance(outfile, ["t1", "t2"], [350, 300], values)
+    with open(outfile) as inf:
+        lines = inf.read().splitlines()
+    assert lines[1] == "t1\t350\t123.457\t10\t1.23457e+06"
+    assert lines[2] == "t2\t300\t200\t0.5\t0"
+
+    transcripts, read = kallisto.read_abundance(outfile)
+    assert transcripts == ["t1", "t2"]
+    np.testing.assert_allclose(read, values, rtol=1e-5)
+
+
+def test_write_abundance_h5(tmp_path):
+    values = np.array([[100.0, 10.0, 4e5], [200.0, 30.0, 6e5]])
+    outfile = str(tmp_path / "abundance.h5")
+    kallisto.write_abundance_h5(outfile, ["t1", "t2"], [350, 300], values,
+                                run_info={"kallisto_version": "0.50.1"})
+    transcripts, est_counts, mean, variance, n = \
+        kallisto.summarise_bootstraps(outfile)
+    assert transcripts == ["t1", "t2"]
+    np.testing.assert_allclose(est_counts, [10, 30])
+    assert n == 0
+    assert np.isnan(mean).all()
@@ -0,0 +1,93 @@
+'''tests for staging of Novogene FASTQ files'''
+
+import os
+import gzip
+import pytest
+import ocmsrnaseq.staging as staging
+
+
+INI = '''[AOI_List]
+DSP-1001660012345-A-A01 = 1
+DSP-1001660012345-A-B02 = 1
+'''
+
+
+def make_files(indir):
+    names = []
+    for well in ("A01", "B02"):
+        for lane in (2, 3):
+            for read in (1, 2):
+                names.append("%s_FKDL2201_HXYZ_L%i_%i.fq.gz" %
+                             (well, lane, read))
+    for name in names:
+        with open(os.path.join(indir, name), "wb") as outf:
+            outf.write(name.encode())
+    ini = os.path.join(indir, "config.ini")
+    with open(ini, "w") as outf:
+        outf.write(INI)
+    return names, ini
+
+
+def test_stage_and_rerun_in_place(tmp_path):
+    indir = str(tmp_path)
+    names, ini = make_files(indir)
+
+    mapping, missing = staging.build_mapping(indir, indir, ini=ini)
+    assert missing == []
+    assert len(mapping) == len(names)
+    targets = sorted(os.path.basename(x[1]) for x in mapping)
+    assert targets[0] == "DSP-1001660012345-A-A01_L001_R1_001.fastq.gz"
+    assert targets[-1] == "DSP-1001660012345-A-B02_L003_R2_001.fastq.gz"
+    staging.stage(staging.validate_mapping(mapping))
+
+    # a rerun with the same input and output directory does not pick up
+    # the links of the first run and has nothing left to do
+    rerun, missing = staging.build_mapping(indir, indir, ini=ini)
+    assert sorted(rerun) == sorted(mapping)
+    assert staging.validate_mapping(rerun) == []
+
+
+def make_member(start, nreads):
+    return gzip.compress(b"".join(
+        b"@r%i\nACGT\n+\nFFFF\n" % i for i in range(start, start + nreads)))
+
+
+def test_concatenate_multi_member(tmp_path):
+    members = [make_member(i * 1000, 1000) for i in range(5)]
+    infiles = []
+    for i in range(2):
+        infile = str(tmp_path / ("in%i.fastq.gz" % i))
+        with open(infile, "wb") as outf:
+            outf.write(b"".join(members[i * 2:i * 2 + 3]))
+        infiles.append(infile)
+    outfile = str(tmp_path / "out.fastq.gz")
+
+    # slices and buffers smaller than a member
+    counts = staging.concatenate(infiles, outfile, bufsize=4096,
+                                 slicesize=1000)
+    assert counts == [3000, 3000]
+    with open(outfile, "rb") as inf:
+        assert inf.read() == b"".join(members[:3] + members[2:])
+
+
+def test_concatenate_member_on_buffer_boundary(tmp_path):
+    members = [make_member(0, 500), make_member(500, 700)]
+    infile = str(tmp_path / "in.fastq.gz")
+    with open(infile, "wb") as outf:
+        outf.write(b"".join(members))
+    outfile = str(tmp_path / "out.fastq.gz")
+
+    for slicesize in (len(members[0]), 100):
+        counts = staging.concatenate([infile], outfile,
+                                     bufsize=len(members[0]),
+                                     slicesize=slicesize)
+        assert counts == [1200]
+        with gzip.open(outfile, "rb") as inf:
+            assert inf.read().count(b"\n") == 4800
+
+    # a file ending on a member boundary is complete, one ending
+    # within a member is not
+    with open(infile, "wb") as outf:
+        outf.write(members[0] + members[1][:-10])
+    with pytest.raises(staging.StagingError):
+        staging.concatenate([infile], outfile, bufsize=len(members[0]))